@@ -0,0 +1,163 @@
+"""bench_record_memory.py - Memory held by the variant and evidence records
+
+Compares the records the listers used to keep, instances with a __dict__
+holding on to the payload dicts of the API, with the slotted records on
+synthetic API payloads. The payloads go through json like the responses
+of the API, so each record gets its own copy of every string, then they
+are dropped and only the records are measured.
+
+Usage: python benchmarks/bench_record_memory.py
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from civic_api_client.variants_lister import VariantDetails
+from civic_api_client.evidence_items_lister import EvidenceItems
+
+EVIDENCE_PER_VARIANT = 4
+# Objects shared by the whole program, not counted in the records
+SHARED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType,
+                types.BuiltinFunctionType)
+
+def make_variants(n_variants):
+    "n_variants API variant payloads, freshly decoded from json"
+    rng = random.Random(1)
+    variants = []
+    for variant_id in range(n_variants):
+        gene_id = variant_id // 5
+        evidence_items = [{
+            'id': variant_id * EVIDENCE_PER_VARIANT + number,
+            'status': 'accepted',
+            'evidence_type': rng.choice(['Predictive', 'Diagnostic',
+                                         'Prognostic']),
+            'disease': {'id': 10, 'name': 'Melanoma', 'display_name':
+                        'Melanoma', 'doid': rng.choice(['1909', '162'])},
+            'drugs': [{'id': 3, 'name': 'Vemurafenib', 'pubchem_id': '42611257'}],
+        } for number in range(EVIDENCE_PER_VARIANT)]
+        variants.append({
+            'id': variant_id,
+            'name': 'V%dE' % variant_id,
+            'entrez_name': 'GENE%d' % gene_id,
+            'gene_id': gene_id,
+            'variant_types': [{'id': 47, 'name': 'missense_variant',
+                               'so_id': 'SO:0001583'}],
+            'coordinates': {
+                'chromosome': rng.choice(['1', '7', '17', 'X']),
+                'start': 140453136,
+                'stop': 140453136,
+                'reference_bases': 'A',
+                'variant_bases': 'T',
+                'representative_transcript': 'ENST00000288602.6',
+                'chromosome2': None,
+                'start2': None,
+                'stop2': None,
+                'representative_transcript2': None,
+                'ensembl_version': 75,
+                'reference_build': 'GRCh37',
+            },
+            'evidence_items': evidence_items,
+        })
+    return json.loads(json.dumps(variants))
+
+class LegacyVariantDetails:
+    "The variant record the variants lister used to keep"
+
+    def __init__(self, args, variant_details, transcripts = None):
+        self.args = args
+        self.transcripts = transcripts
+        self.coordinates = variant_details['coordinates']
+        self.ref_base = self.coordinates['reference_bases']
+        self.var_base = self.coordinates['variant_bases']
+        self.name = variant_details['name']
+        self.id = variant_details['id']
+        self.gene_name = variant_details['entrez_name']
+        self.variant_types = variant_details['variant_types']
+        self.civic_url = "https://civic.genome.wustl.edu/#/events/genes/" + \
+                         str(variant_details['gene_id']) + \
+                         "/summary/variants/" + str(variant_details['id']) + \
+                         "/summary#variant"
+        self.gene_id = None
+        self.errors = 0
+        self.error_str = ""
+
+class LegacyEvidenceItems:
+    "The evidence record the evidence items lister used to keep"
+
+    def __init__(self, variant_details, evidence_items, error_type):
+        self.error = str(error_type)
+        self.variant_name = variant_details['name']
+        self.variant_id = variant_details['id']
+        self.gene_name = variant_details['entrez_name']
+        self.evi_id = evidence_items['id']
+        self.evi_type = evidence_items['evidence_type']
+        self.drugs = evidence_items['drugs']
+        self.disease = evidence_items['disease']
+        self.doid = self.disease['doid']
+        variant_url = "https://civic.genome.wustl.edu/#/events/genes/" + \
+                      str(variant_details['gene_id']) + "/summary/variants/" + \
+                      str(variant_details['id'])
+        self.evidence_civic_url = variant_url + "/summary/evidence/" + \
+                                  str(evidence_items['id']) + "/summary#evidence"
+        self.variant_civic_url = variant_url + "/summary#variant"
+
+def deep_size(root):
+    "Bytes of root and of everything it references, each object once"
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for cls in getattr(type(obj), '__mro__', ()):
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+def legacy_records(variants, args):
+    "Variant and evidence records the way the listers used to build them"
+    return ([LegacyVariantDetails(args, variant) for variant in variants],
+            [LegacyEvidenceItems(variant, evidence_item, "DOID")
+             for variant in variants
+             for evidence_item in variant['evidence_items']])
+
+def slotted_records(variants, args):
+    "Variant and evidence records the way the listers build them now"
+    return ([VariantDetails(variant) for variant in variants],
+            [EvidenceItems(variant, evidence_item, "DOID")
+             for variant in variants
+             for evidence_item in variant['evidence_items']])
+
+def main():
+    args = argparse.Namespace(max_var_length = None, max_gene_count = 100000)
+    print("%10s %24s %24s %8s" % ("variants", "legacy (bytes/variant)",
+                                  "slotted (bytes/variant)", "ratio"))
+    for n_variants in (1000, 5000, 20000):
+        sizes = []
+        for build in (legacy_records, slotted_records):
+            variants = make_variants(n_variants)
+            records = build(variants, args)
+            del variants
+            sizes.append(deep_size(records))
+        print("%10d %24.0f %24.0f %8.2f" % (n_variants,
+              sizes[0] / float(n_variants), sizes[1] / float(n_variants),
+              sizes[0] / float(sizes[1])))
+
+if __name__ == '__main__':
+    main()
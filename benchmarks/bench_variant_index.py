@@ -0,0 +1,68 @@
+"""bench_variant_index.py - Time the dedup of variant IDs in the gene listing
+
+Compares the list based dedup get_variant_ids used to do with VariantIndex
+on synthetic gene listings of growing size. The time per variant of the
+index should stay flat as the listing grows.
+
+Usage: python benchmarks/bench_variant_index.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from civic_api_client.variant_index import VariantIndex
+
+VARIANTS_PER_GENE = 5
+
+def make_genes(n_variants):
+    "A gene listing with n_variants variants, 10% of them listed twice"
+    genes = []
+    for gene_id in range(n_variants // VARIANTS_PER_GENE):
+        first = gene_id * VARIANTS_PER_GENE
+        variants = [{'id': variant_id} for variant_id in
+                    range(first, first + VARIANTS_PER_GENE)]
+        if gene_id % 2:
+            variants.append({'id': first - 1})
+        genes.append({'id': gene_id, 'name': 'GENE%d' % gene_id,
+                      'variants': variants})
+    return genes
+
+def list_dedup(genes):
+    "The dedup get_variant_ids used to do"
+    variant_ids = []
+    for gene in genes:
+        for variant in gene['variants']:
+            variant_id = variant['id']
+            if variant_id in variant_ids:
+                continue
+            variant_ids.append(variant_id)
+    return variant_ids
+
+def index_dedup(genes):
+    return VariantIndex(genes).variant_ids
+
+def best_time(func, genes, repeat = 3):
+    "Best wall time of func(genes) over repeat runs"
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func(genes)
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    print("%10s %14s %14s %16s" % ("variants", "list (s)", "index (s)",
+                                   "index (us/var)"))
+    for n_variants in (1000, 2000, 4000, 8000, 16000, 32000):
+        genes = make_genes(n_variants)
+        assert list_dedup(genes) == index_dedup(genes)
+        list_time = best_time(list_dedup, genes) if n_variants <= 16000 \
+                    else float('nan')
+        index_time = best_time(index_dedup, genes)
+        print("%10d %14.4f %14.4f %16.3f" % (n_variants, list_time,
+              index_time, index_time / n_variants * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""mock_civic.py - Local stand-in for the CIViC and disease ontology APIs
+
+Serves a synthetic dataset the way the APIs the client reads do: the
+paged genes listing, variants/<id> with their evidence items and the
+disease ontology metadata/DOID:<id>. Every response can be delayed by a
+fixed latency. The records carry the same kinds of errors the checks look
+for, in fixed proportions, so the listers have work to do.
+
+Usage: python benchmarks/mock_civic.py --genes 1000 --latency 0.02
+and point the client at it with
+CIVIC_API_URL=http://127.0.0.1:5055/api/
+DISEASE_ONTOLOGY_API_URL=http://127.0.0.1:5055/do/
+"""
+
+import argparse
+import logging
+import random
+import threading
+import time
+
+from flask import Flask, abort, jsonify, request
+from werkzeug.serving import make_server
+
+VARIANTS_PER_GENE = 3
+EVIDENCE_PER_VARIANT = 4
+# DOIDs the disease ontology knows, the others are invalid
+VALID_DOIDS = ['162', '1324', '1909', '3908', '1612']
+INVALID_DOIDS = ['99999', '88888']
+CHROMOSOMES = ['1', '2', '7', '12', '17', 'X']
+TRANSCRIPTS = ['ENST00000288602.6', 'ENST00000355413.4', 'ENST1', None]
+DRUGS = [[], [{'id': 1, 'name': 'N/A', 'pubchem_id': None}],
+         [{'id': 2, 'name': 'Vemurafenib', 'pubchem_id': '42611257'}],
+         [{'id': 2, 'name': 'Vemurafenib', 'pubchem_id': '42611257'},
+          {'id': 3, 'name': 'Cobimetinib', 'pubchem_id': '16222096'}]]
+
+class Dataset:
+    """Synthetic genes and variants, the same for the same size and seed"""
+
+    def __init__(self, n_genes, variants_per_gene = VARIANTS_PER_GENE,
+                 evidence_per_variant = EVIDENCE_PER_VARIANT, seed = 1):
+        "Constructor"
+        rng = random.Random(seed)
+        self.genes = []
+        self.variants = {}
+        variant_id = 1
+        for gene_id in range(1, n_genes + 1):
+            gene_variants = []
+            for _ in range(variants_per_gene):
+                self.variants[variant_id] = self.make_variant(
+                    rng, gene_id, variant_id, evidence_per_variant)
+                gene_variants.append({'id': variant_id,
+                                      'name': 'V%dE' % variant_id})
+                variant_id += 1
+            # The genes listing repeats some variants, like the real one
+            if gene_id % 4 == 0:
+                gene_variants.append(dict(gene_variants[0]))
+            self.genes.append({'id': gene_id, 'name': 'GENE%d' % gene_id,
+                               'entrez_id': 1000 + gene_id,
+                               'description': 'Gene %d' % gene_id,
+                               'variants': gene_variants})
+
+    def make_variant(self, rng, gene_id, variant_id, evidence_per_variant):
+        "A variant payload with its evidence items"
+        chromosome = rng.choice(CHROMOSOMES + [None])
+        start = rng.randint(1, 10000000)
+        stop = start + rng.choice([0, 0, 0, 2, 20, -3])
+        evidence_items = [{
+            'id': variant_id * evidence_per_variant + number,
+            'status': rng.choice(['accepted', 'accepted', 'submitted']),
+            'evidence_type': rng.choice(['Predictive', 'Diagnostic',
+                                         'Prognostic']),
+            'evidence_direction': 'Supports',
+            'clinical_significance': rng.choice(['Sensitivity', 'Resistance',
+                                                 'Poor Outcome']),
+            'evidence_level': rng.choice(['A', 'B', 'C']),
+            'rating': rng.randint(1, 5),
+            'variant_origin': 'Somatic',
+            'description': 'Evidence %d of variant %d' % (number, variant_id),
+            'pubmed_id': str(rng.randint(10000000, 29999999)),
+            'citation': 'Author et al., 2016',
+            'disease': {'id': 10, 'name': 'Melanoma',
+                        'display_name': 'Melanoma',
+                        'doid': rng.choice(VALID_DOIDS * 4 + INVALID_DOIDS)},
+            'drugs': rng.choice(DRUGS),
+        } for number in range(evidence_per_variant)]
+        return {
+            'id': variant_id,
+            'name': 'V%dE' % variant_id,
+            'entrez_name': 'GENE%d' % gene_id,
+            'entrez_id': 1000 + gene_id,
+            'gene_id': gene_id,
+            'description': 'Variant %d' % variant_id,
+            'variant_types': rng.choice([[], [{'id': 47,
+                'name': 'missense_variant', 'so_id': 'SO:0001583'}]]),
+            'coordinates': {
+                'chromosome': chromosome,
+                'start': start if chromosome else None,
+                'stop': stop if chromosome else None,
+                'reference_bases': rng.choice(['A', 'C', 'AT', None]),
+                'variant_bases': rng.choice(['T', 'G', None]),
+                'representative_transcript': rng.choice(TRANSCRIPTS),
+                'chromosome2': None,
+                'start2': None,
+                'stop2': None,
+                'representative_transcript2': None,
+                'ensembl_version': rng.choice([75, 75, None]),
+                'reference_build': 'GRCh37',
+            },
+            'evidence_items': evidence_items,
+        }
+
+    def transcripts(self):
+        "The (transcript ID, version) pairs the variants reference"
+        pairs = set()
+        for variant in self.variants.values():
+            transcript = variant['coordinates']['representative_transcript']
+            if transcript and '.' in transcript:
+                pairs.add(tuple(transcript.split('.')[:2]))
+        return sorted(pairs)
+
+class Stats:
+    "Number and duration of the requests served"
+
+    def __init__(self):
+        "Constructor"
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "Forget the requests served so far"
+        self.requests = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        "Count a request served in seconds"
+        with self.lock:
+            self.requests += 1
+            self.seconds += seconds
+
+def create_app(dataset, latency = 0, stats = None):
+    """Flask app serving the dataset, each response delayed by latency
+    seconds. The requests are counted in stats if given."""
+    app = Flask("mock_civic")
+
+    @app.before_request
+    def start_request():
+        request.started_at = time.time()
+        if latency:
+            time.sleep(latency)
+
+    @app.after_request
+    def end_request(response):
+        if stats is not None:
+            stats.add(time.time() - request.started_at)
+        return response
+
+    @app.route("/api/genes")
+    def genes():
+        count = int(request.args.get('count', 25))
+        page = int(request.args.get('page', 1))
+        total_pages = (len(dataset.genes) + count - 1) // count
+        return jsonify({'_meta': {'current_page': page, 'per_page': count,
+                                  'total_pages': total_pages,
+                                  'total_count': len(dataset.genes)},
+                        'records': dataset.genes[(page - 1) * count:
+                                                 page * count]})
+
+    @app.route("/api/variants/<int:variant_id>")
+    def variant(variant_id):
+        if variant_id not in dataset.variants:
+            abort(404)
+        return jsonify(dataset.variants[variant_id])
+
+    @app.route("/do/metadata/DOID:<doid>")
+    def disease(doid):
+        if doid not in VALID_DOIDS:
+            abort(404)
+        return jsonify({'id': 'DOID:' + doid, 'name': 'Disease ' + doid})
+
+    return app
+
+def serve_in_background(app, port = 0):
+    """Serve the app from a daemon thread, port 0 picks a free port.
+    Returns the server and the base URL. The requests aren't logged."""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded = True)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:%d/" % server.server_port
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--genes", type = int, default = 1000,
+                        help = "Number of genes of the dataset [1000]")
+    parser.add_argument("--latency", type = float, default = 0,
+                        help = "Seconds each response is delayed [0]")
+    parser.add_argument("--port", type = int, default = 5055,
+                        help = "Port to listen on [5055]")
+    parser.add_argument("--seed", type = int, default = 1,
+                        help = "Seed of the synthetic dataset [1]")
+    args = parser.parse_args()
+    dataset = Dataset(args.genes, seed = args.seed)
+    app = create_app(dataset, args.latency)
+    print("Serving %d genes and %d variants on port %d" %
+          (len(dataset.genes), len(dataset.variants), args.port))
+    make_server('127.0.0.1', args.port, app, threaded = True).serve_forever()
+
+if __name__ == '__main__':
+    main()
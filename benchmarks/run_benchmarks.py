@@ -0,0 +1,242 @@
+"""run_benchmarks.py - Benchmarks of the listers against a local mock CIViC
+
+Starts the mock server of mock_civic.py in the background, points the
+client at it and times the hot paths of the tool end to end:
+
+variants_list       VariantsLister.create_filtered_variants_list
+variants_rep_trans  the same with --rep-trans against a synthetic
+                    transcript.txt.gz
+transcript_index    TranscriptIndex loading the synthetic transcript.txt.gz
+evidence_items      EvidenceItemsLister.create_invalid_eis_list
+tsv_create          TsvFileLister.get_info_and_print
+web_routes          the pages and JSON API of the web view
+
+Each benchmark runs in its own process so its peak memory can be measured.
+The results are written as JSON, to be compared across versions.
+
+Usage: python benchmarks/run_benchmarks.py --genes 500 --latency 0.01
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import civic_api_client
+from civic_api_client.evidence_items_lister import EvidenceItemsLister
+from civic_api_client.transcript_index import TranscriptIndex
+from civic_api_client.tsv_creator import TsvFileLister
+from civic_api_client.variants_lister import VariantsLister
+from civic_api_client import web
+
+import mock_civic
+
+# Transcripts of the synthetic transcript.txt.gz besides the ones the
+# variants reference
+EXTRA_TRANSCRIPTS = 200000
+# Requests sent to each route of the web view
+WEB_REQUESTS = 200
+WEB_ROUTES = [
+    '/variants',
+    '/api/variants',
+    '/api/variants?sort=gene_name&order=desc&limit=1000',
+    '/api/evidence-items?error=DOID',
+    '/api/evidence-items?sort=evi_id&offset=100',
+]
+
+def write_transcript_file(path, pairs, n_extra = EXTRA_TRANSCRIPTS):
+    """Write an Ensembl transcript.txt.gz with the (ID, version) pairs and
+    n_extra made up transcripts"""
+    output = gzip.open(path, 'wb')
+    try:
+        rows = list(pairs) + [('ENST%011d' % number, '1')
+                              for number in range(n_extra)]
+        for number, (trans_id, version) in enumerate(rows):
+            fields = [str(number)] * 14 + [trans_id, version, 'x', 'x', 'x']
+            output.write('\t'.join(fields) + '\n')
+    finally:
+        output.close()
+    return len(rows)
+
+def lister_args(options, extra = ()):
+    "Command-line arguments of the listers for the benchmark options"
+    return ['--no-cache', '--concurrency', str(options.concurrency)] + \
+           list(extra)
+
+def bench_variants_list(options):
+    vl1 = VariantsLister(lister_args(options))
+    vl1.parse_args()
+    return {'records': len(vl1.create_filtered_variants_list())}
+
+def bench_variants_rep_trans(options):
+    vl1 = VariantsLister(lister_args(options, ['--rep-trans',
+        '--transcript-file', options.transcript_file]))
+    vl1.parse_args()
+    return {'records': len(vl1.create_filtered_variants_list())}
+
+def bench_transcript_index(options):
+    transcripts = TranscriptIndex.from_transcript_file(options.transcript_file)
+    return {'records': len(transcripts)}
+
+def bench_evidence_items(options):
+    eil1 = EvidenceItemsLister(lister_args(options))
+    eil1.parse_args()
+    return {'records': len(eil1.create_invalid_eis_list())}
+
+def bench_tsv_create(options):
+    output = os.path.join(options.work_dir, 'evidence.tsv')
+    tsv1 = TsvFileLister(lister_args(options, ['--output', output]))
+    tsv1.parse_args()
+    tsv1.get_info_and_print()
+    with open(output) as lines:
+        return {'records': sum(1 for line in lines) - 1}
+
+def bench_web_routes(options):
+    vl1 = VariantsLister(lister_args(options))
+    vl1.parse_args()
+    eil1 = EvidenceItemsLister(lister_args(options), vl1.client)
+    eil1.parse_args()
+    variants = vl1.create_filtered_variants_list()
+    evidence_items = eil1.create_invalid_eis_list()
+    store = web.ResultStore({'variants': lambda: variants,
+                             'evidence_items': lambda: evidence_items})
+    store.refresh()
+    client = web.create_app(store).test_client()
+    routes = {}
+    start = time.time()
+    for route in WEB_ROUTES:
+        latencies = []
+        for _ in range(WEB_REQUESTS):
+            sent = time.time()
+            response = client.get(route)
+            latencies.append(time.time() - sent)
+            assert response.status_code == 200, route
+        latencies.sort()
+        routes[route] = {
+            'mean_seconds': sum(latencies) / len(latencies),
+            'p50_seconds': latencies[len(latencies) // 2],
+            'p95_seconds': latencies[int(len(latencies) * 0.95)],
+        }
+    # The crawl filling the store isn't part of the timing
+    return {'records': WEB_REQUESTS * len(WEB_ROUTES), 'routes': routes,
+            'seconds': time.time() - start}
+
+BENCHMARKS = [
+    ('variants_list', bench_variants_list),
+    ('variants_rep_trans', bench_variants_rep_trans),
+    ('transcript_index', bench_transcript_index),
+    ('evidence_items', bench_evidence_items),
+    ('tsv_create', bench_tsv_create),
+    ('web_routes', bench_web_routes),
+]
+
+def current_rss_kb():
+    "Resident memory of this process in kB"
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+def run_in_child(bench, options, results):
+    "Run a benchmark, put its timings and memory use in the results queue"
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start_rss = current_rss_kb()
+        start = time.time()
+        result = bench(options)
+        result.setdefault('seconds', time.time() - start)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_kb'] = peak_rss
+        result['rss_growth_kb'] = peak_rss - start_rss
+    except Exception as e:
+        result = {'error': '%s: %s' % (type(e).__name__, e)}
+    results.put(result)
+
+def run_benchmark(name, bench, options, stats):
+    "Run a benchmark in its own process, with the requests it made"
+    stats.reset()
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target = run_in_child,
+                                    args = (bench, options, results))
+    child.start()
+    result = results.get()
+    child.join()
+    result['name'] = name
+    result['requests'] = stats.requests
+    if stats.requests:
+        result['mean_request_seconds'] = stats.seconds / stats.requests
+    if result.get('seconds'):
+        result['records_per_second'] = result['records'] / result['seconds']
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--genes", type = int, default = 500,
+                        help = "Number of genes of the mock dataset [500]")
+    parser.add_argument("--latency", type = float, default = 0,
+                        help = "Seconds each mock response is delayed [0]")
+    parser.add_argument("--concurrency", type = int, default = 10,
+                        help = "Concurrent requests of the client [10]")
+    parser.add_argument("--only", type = str,
+                        help = "Comma separated benchmarks to run [all]")
+    parser.add_argument("--output", type = str,
+                        default = "benchmark-results.json",
+                        help = "JSON file of the results "
+                               "[benchmark-results.json]")
+    options = parser.parse_args()
+    selected = BENCHMARKS
+    if options.only:
+        names = options.only.split(',')
+        selected = [(name, bench) for name, bench in BENCHMARKS
+                    if name in names]
+
+    dataset = mock_civic.Dataset(options.genes)
+    stats = mock_civic.Stats()
+    server, base_url = mock_civic.serve_in_background(
+        mock_civic.create_app(dataset, options.latency, stats))
+    os.environ['CIVIC_API_URL'] = base_url + 'api/'
+    os.environ['DISEASE_ONTOLOGY_API_URL'] = base_url + 'do/'
+    options.work_dir = tempfile.mkdtemp(prefix = 'civic-bench-')
+    options.transcript_file = os.path.join(options.work_dir,
+                                           'transcript.txt.gz')
+    write_transcript_file(options.transcript_file, dataset.transcripts())
+
+    results = []
+    try:
+        for name, bench in selected:
+            result = run_benchmark(name, bench, options, stats)
+            results.append(result)
+            if 'error' in result:
+                print("%-20s failed: %s" % (name, result['error']))
+            else:
+                print("%-20s %8.2f s %10.0f records/s %8d kB peak" %
+                      (name, result['seconds'], result['records_per_second'],
+                       result['peak_rss_kb']))
+    finally:
+        server.shutdown()
+        shutil.rmtree(options.work_dir)
+
+    report = {
+        'version': civic_api_client.__version__,
+        'python': platform.python_version(),
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'dataset': {'genes': len(dataset.genes),
+                    'variants': len(dataset.variants),
+                    'latency_seconds': options.latency},
+        'concurrency': options.concurrency,
+        'results': results,
+    }
+    with open(options.output, 'w') as output:
+        json.dump(report, output, indent = 2, sort_keys = True)
+    print("Results written to " + options.output)
+
+if __name__ == '__main__':
+    main()
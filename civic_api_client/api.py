@@ -0,0 +1,191 @@
+"api.py - Library interface to the CIVIC fetch layer and checks"
+
+import argparse
+import Queue
+import threading
+
+import rules
+import sources
+import utils
+from doid_validator import DoidValidator
+from evidence_items_lister import EvidenceItemsLister
+from variants_lister import VariantsLister
+
+# Seconds a Feed thread waits on a full queue before checking for close()
+FEED_PUT_TIMEOUT = 0.5
+# Marks the end of the items of a Feed
+FEED_END = object()
+
+def api_args(**options):
+    """The options of the commands with their defaults, overridden by the
+    options given: concurrency, max_rate, max_gene_count, no_cache, dump,
+    db, transcript_file, doid_file, evi_type... Raises TypeError for
+    unknown options."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-gene-count", type = int, default = 100000)
+    VariantsLister.add_check_args(parser)
+    EvidenceItemsLister.add_check_args(parser)
+    utils.add_fetch_args(parser)
+    args = parser.parse_args([])
+    args.workers = 1
+    for name, value in options.items():
+        if not hasattr(args, name):
+            raise TypeError("Unknown option " + repr(name))
+        setattr(args, name, value)
+    return args
+
+class Feed:
+    """The items of an iterator, produced by a background thread into a
+    bounded queue. poll() returns the items ready so far without waiting,
+    for event loops that can't block on the fetches."""
+
+    def __init__(self, items, maxsize = 1000):
+        "Constructor, starts producing the items"
+        self.queue = Queue.Queue(maxsize)
+        self.done = False
+        self.closed = False
+        self.error = None
+        self.thread = threading.Thread(target = self.produce, args = (items,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def produce(self, items):
+        "Put the items in the queue, then the end marker"
+        try:
+            for item in items:
+                if not self.put(item):
+                    return
+        except Exception as e:
+            self.error = e
+        self.put(FEED_END)
+
+    def put(self, item):
+        "Put an item in the queue, False if the feed was closed meanwhile"
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout = FEED_PUT_TIMEOUT)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def take(self, item):
+        "Handle an item out of the queue, False at the end of the items"
+        if item is FEED_END:
+            self.done = True
+            if self.error is not None:
+                raise self.error
+            return False
+        return True
+
+    def poll(self, max_items = None):
+        """The items produced since the last poll, up to max_items, without
+        waiting. done is set once all the items were returned. Raises the
+        error that stopped the production, after the items produced before
+        it."""
+        items = []
+        while not self.done and (max_items is None or
+                                 len(items) < max_items):
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if self.take(item):
+                items.append(item)
+        return items
+
+    def __iter__(self):
+        "Wait for the items one by one"
+        while not self.done:
+            item = self.queue.get(timeout = utils.POOL_WAIT_TIMEOUT)
+            if self.take(item):
+                yield item
+
+    def close(self):
+        "Stop producing items"
+        self.closed = True
+
+class CivicApi:
+    """Iterators over the genes, variants and evidence items of CIVIC for
+    programs embedding the client, and the checks of the listers run on
+    them. The requests share one pooled keep-alive session, at most
+    concurrency are in flight and max_rate caps them per second. Takes the
+    options of api_args."""
+
+    def __init__(self, client = None, **options):
+        "Constructor"
+        self.args = api_args(**options)
+        self.client = client or utils.CivicClient.from_args(self.args)
+
+    def genes(self):
+        "The genes of the CIVIC gene listing, with their variant IDs"
+        return sources.ApiSource(self.args, self.client).iter_civic_genes()
+
+    def variants(self):
+        """The details of every variant with its evidence items, in the
+        order of the gene listing, from the API, the dump or the mirror of
+        the options"""
+        return sources.open_source(self.args, self.client). \
+               iter_variant_details()
+
+    def evidence_items(self, variants = None):
+        "(variant, evidence item) pairs of the variants, of all by default"
+        if variants is None:
+            variants = self.variants()
+        for variant in variants:
+            for evidence_item in variant.get('evidence_items') or ():
+                yield variant, evidence_item
+
+    def check_variants(self, variants = None, checks = ()):
+        """VariantDetails of the variants failing the checks, the codes of
+        variant rules, all the default ones if empty. Yielded as the
+        variants are checked, all CIVIC is checked by default."""
+        args = self.check_args(checks)
+        if variants is None:
+            variants = self.variants()
+        return VariantsLister(args, self.client).filter_variants(variants)
+
+    def check_evidence_items(self, variants = None, checks = ()):
+        """EvidenceItems failing the checks, the codes of evidence rules,
+        all of them if empty. All CIVIC is checked by default."""
+        lister = EvidenceItemsLister(self.check_args(checks), self.client)
+        lister.start_checks()
+        try:
+            if variants is None:
+                variants = self.variants()
+            for variant in variants:
+                lister.check_variant(variant)
+            lister.resolve_doids()
+        finally:
+            lister.doid_validator.close()
+        return lister.invalid_eis
+
+    def valid_doids(self, doids):
+        """Which of the DOIDs the disease ontology defines, as a dict, None
+        for the DOIDs whose lookup failed"""
+        validator = DoidValidator.from_args(self.args, self.client)
+        try:
+            validator.resolve(doids, self.args.concurrency)
+            return dict((doid, validator.is_valid(doid)) for doid in doids)
+        finally:
+            validator.close()
+
+    def check_args(self, checks):
+        "The options with the flags of the checks set"
+        args = argparse.Namespace(**vars(self.args))
+        codes = set(rule.code for rule in rules.VARIANT_RULES.rules +
+                    rules.EVIDENCE_RULES.rules)
+        for check in checks:
+            if check not in codes:
+                raise ValueError("Unknown check " + repr(check))
+            setattr(args, check, True)
+        return args
+
+    def feed(self, items, maxsize = 1000):
+        """Feed producing the items of one of the iterators, like
+        api.feed(api.variants()), in a background thread"""
+        return Feed(items, maxsize)
+
+    def close(self):
+        "Close the pooled connections and the cache"
+        self.client.close()
@@ -0,0 +1,216 @@
+"audit.py - Variant checks, evidence checks and export from a single crawl"
+
+import argparse
+
+import civic_api_client
+import metrics
+import rules
+import sources
+import utils
+import writers
+from evidence_items_lister import EvidenceItemsLister
+from snapshot import Checkpointing
+from tsv_creator import TsvFileLister
+from variants_lister import VariantsLister, check_variant, variant_rule_engine
+
+class VariantReport:
+    "The variants-list report of an audit, written to a file"
+
+    def __init__(self, args, client, path):
+        "Constructor"
+        self.lister = VariantsLister(args, client)
+        self.lister.load_transcripts()
+        self.rule_engine = variant_rule_engine(args, self.lister.transcripts)
+        self.path = path
+        self.output = writers.PartialFile(path)
+        self.count = 0
+
+    def add(self, variant_detail):
+        "Check a variant, writing it if it has errors"
+        vd1 = check_variant(self.lister.args, self.rule_engine, variant_detail)
+        if vd1 is not None:
+            vd1.print1(self.output)
+            self.count += 1
+
+    def finish(self):
+        "Summary of the report once all the variants were added"
+        return "%d variants with errors written to %s" % (self.count,
+                                                          self.path)
+
+    def close(self):
+        "Close the file"
+        self.output.close()
+
+    def discard(self):
+        "Drop the file, the audit didn't complete"
+        self.output.discard()
+
+class EvidenceReport:
+    """The evidence-items-list report of an audit, written to a file once
+    the DOIDs seen were all looked up"""
+
+    def __init__(self, args, client, path):
+        "Constructor"
+        self.lister = EvidenceItemsLister(args, client)
+        self.lister.start_checks()
+        self.path = path
+        self.output = writers.PartialFile(path)
+
+    def add(self, variant_detail):
+        "Check the evidence items of a variant"
+        self.lister.check_variant(variant_detail)
+
+    def finish(self):
+        "Look up the DOIDs and write the invalid evidence items"
+        self.lister.resolve_doids()
+        for ei1 in self.lister.invalid_eis:
+            ei1.print1(self.output)
+        return "%d invalid evidence items written to %s" % \
+               (len(self.lister.invalid_eis), self.path)
+
+    def close(self):
+        "Close the file and the DOID cache"
+        self.output.close()
+        self.lister.doid_validator.close()
+
+    def discard(self):
+        "Drop the file, the audit didn't complete, and close the DOID cache"
+        self.output.discard()
+        self.lister.doid_validator.close()
+
+class ExportReport:
+    "The tsv-create export of an audit, in any of its formats"
+
+    def __init__(self, exporter):
+        "Constructor, exporter is the TsvFileLister holding the options"
+        self.exporter = exporter
+        self.path = exporter.output_file_name()
+        self.output = exporter.open_output()
+        self.count = 0
+
+    def add(self, variant_detail):
+        "Export the evidence items of a variant"
+        self.exporter.write_variant(self.output, variant_detail)
+        self.count += len(variant_detail.get('evidence_items') or ())
+
+    def finish(self):
+        "Summary of the export once all the variants were added"
+        return "%d evidence items exported to %s" % (self.count, self.path)
+
+    def close(self):
+        "Write what is left and close the file"
+        self.output.close()
+
+    def discard(self):
+        "Drop the file, the audit didn't complete"
+        self.output.discard()
+
+class Auditor:
+    """Crawl CIVIC once and hand each variant to the reports asked for, so
+    the variant checks, the evidence checks and the export don't each
+    download CIVIC again"""
+
+    def __init__(self, args, client = None):
+        "Constructor"
+        self.args = args
+        self.client = client
+        self.exporter = None
+
+    def parse_args(self):
+        "Parse command-line arguments"
+        parser = argparse.ArgumentParser(description="civic-api-client version {}".format(civic_api_client.__version__),
+            usage = "civic-api-client audit [--variants FILE] "
+                    "[--evidence-items FILE] [--export FILE]",
+            formatter_class = argparse.RawTextHelpFormatter,
+        )
+        parser.add_argument("--variants",
+            help = "File to write the variants with errors to, like\n"
+                   "variants-list prints them.",
+            metavar = "FILE",
+            type = str
+        )
+        parser.add_argument("--evidence-items",
+            help = "File to write the invalid evidence items to, like\n"
+                   "evidence-items-list prints them.",
+            metavar = "FILE",
+            type = str
+        )
+        parser.add_argument("--export",
+            help = "File to export the evidence items to, like tsv-create.",
+            dest = 'output',
+            metavar = "FILE",
+            type = str
+        )
+        for registry, command in ((rules.VARIANT_RULES, "variants-list"),
+                                  (rules.EVIDENCE_RULES,
+                                   "evidence-items-list")):
+            for rule in registry.rules:
+                # The audit checks the variants as they are fetched
+                if rule.code in rules.INDEX_RULES:
+                    continue
+                parser.add_argument("--" + rule.code.replace('_', '-'),
+                    action = 'store_true',
+                    help = "Only run this check of " + command + "."
+                )
+        parser.add_argument("--max-gene-count",
+            help = "Maximum number of genes to query from CIVIC [100,000].",
+            type = int,
+            default = 100000
+        )
+        VariantsLister.add_check_args(parser)
+        EvidenceItemsLister.add_check_args(parser)
+        TsvFileLister.add_export_args(parser)
+        utils.add_fetch_args(parser)
+        metrics.add_profile_args(parser)
+        args = parser.parse_args(self.args)
+        if not (args.variants or args.evidence_items or args.output):
+            parser.error("Give at least one of --variants, --evidence-items "
+                         "and --export")
+        if args.variants:
+            sources.check_dump_rules(parser, args, rules.VARIANT_RULES)
+        if args.output:
+            self.exporter = TsvFileLister(args)
+            self.exporter.check_export_args(parser, args)
+        metrics.configure(args)
+        print "Max number of genes to query is ",args.max_gene_count
+        self.args = args
+        if self.client is None:
+            self.client = utils.CivicClient.from_args(args)
+
+    def open_reports(self, reports):
+        """Append the reports asked for on the command line to reports as
+        they are opened, so the ones opened are discarded if a later one
+        fails to open"""
+        if self.args.variants:
+            reports.append(VariantReport(self.args, self.client,
+                                         self.args.variants))
+        if self.args.evidence_items:
+            reports.append(EvidenceReport(self.args, self.client,
+                                          self.args.evidence_items))
+        if self.exporter is not None:
+            reports.append(ExportReport(self.exporter))
+
+    def main(self):
+        "Execution starts here"
+        self.parse_args()
+        reports = []
+        try:
+            self.open_reports(reports)
+            with Checkpointing(self.args, "audit"):
+                source = sources.open_source(self.args, self.client)
+                for variant_detail in source.iter_variant_details():
+                    for report in reports:
+                        report.add(variant_detail)
+                for report in reports:
+                    print report.finish()
+        except:
+            # The files of the reports are only moved in place complete
+            for report in reports:
+                report.discard()
+            raise
+        finally:
+            self.client.close()
+        for report in reports:
+            report.close()
+        self.client.print_throttling()
+        metrics.print_profile(self.args)
@@ -1,10 +1,13 @@
-from flask import Flask, render_template
+import argparse
 import sys
 
 import civic_api_client
 from variants_lister import VariantsLister
 from evidence_items_lister import EvidenceItemsLister
 from tsv_creator import TsvFileLister
+from mirror import MirrorSyncer
+from audit import Auditor
+import web
 
 def usage():
     "Defines usage for the tool"
@@ -14,6 +17,8 @@ def usage():
     print "\tevidence-items-list"
     print "\taction-items-web-view"
     print "\ttsv-create"
+    print "\tsync"
+    print "\taudit"
 
 def main():
     "Everything starts here"
@@ -30,6 +35,12 @@ def main():
             elif sys.argv[1] == "tsv-create":
                 tsv1 = TsvFileLister(sys.argv[2:])
                 return tsv1.main()
+            elif sys.argv[1] == "sync":
+                sync1 = MirrorSyncer(sys.argv[2:])
+                return sync1.main()
+            elif sys.argv[1] == "audit":
+                audit1 = Auditor(sys.argv[2:])
+                return audit1.main()
             else:
                 return usage()
     except KeyboardInterrupt:
@@ -38,27 +49,26 @@ def main():
 
 def web_view():
     "Setup the webview"
-    app = Flask("civic_api_client")
-    @app.route("/")
-    def template_home():
-        return render_template('home.html')
-    @app.route("/evidence-items")
-    def evidence_items():
-        eil1 = EvidenceItemsLister(sys.argv[2:])
-        eil1.parse_args()
-        eil1.create_invalid_eis_list()
-        invalid_eis = eil1.get_invalid_eis()
-        return render_template('evidence-items.html', \
-                invalid_eis = invalid_eis)
-    @app.route("/variants")
-    def variants():
-        vl1 = VariantsLister(sys.argv[2:])
-        vl1.parse_args()
-        vl1.create_filtered_variants_list()
-        filtered_variant_details = vl1.get_filtered_variant_details()
-        return render_template('variants.html', \
-                filtered_variant_details= filtered_variant_details)
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description="civic-api-client version {}".format(civic_api_client.__version__),
+        usage = "civic-api-client action-items-web-view",
+        formatter_class = argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("--refresh-interval",
+        help = "Minutes between refreshes of the results [60],\n"
+               "0 to only refresh from the refresh button",
+        type = float,
+        default = 60
+    )
+    args, lister_args = parser.parse_known_args(sys.argv[2:])
+    vl1 = VariantsLister(lister_args)
+    vl1.parse_args()
+    eil1 = EvidenceItemsLister(lister_args, vl1.client)
+    eil1.parse_args()
+    store = web.ResultStore({
+        'variants': vl1.create_filtered_variants_list,
+        'evidence_items': eil1.create_invalid_eis_list,
+    }, refresh_interval = args.refresh_interval * 60 or None)
+    web.serve(store)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,144 @@
+"doid_validator.py - Validation of disease ontology IDs"
+
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+
+import requests
+import metrics
+import utils
+from response_cache import default_cache_dir
+
+OBO_ID_PATTERN = re.compile(r'^(?:id|alt_id): DOID:(\d+)\s*$')
+JSON_ID_PATTERN = re.compile(r'DOID[:_](\d+)$')
+
+def read_ontology_file(ontology_file):
+    """The DOIDs defined in a disease ontology dump, either the OBO file or
+    the OBO Graphs JSON file (doid.obo or doid.json, optionally gzipped)"""
+    if ontology_file.endswith('.gz'):
+        handle = gzip.open(ontology_file, 'rb')
+        name = ontology_file[:-3]
+    else:
+        handle = open(ontology_file, 'rb')
+        name = ontology_file
+    doids = set()
+    try:
+        if name.endswith('.json'):
+            for graph in json.load(handle).get('graphs', []):
+                for node in graph.get('nodes', []):
+                    match = JSON_ID_PATTERN.search(node.get('id', ''))
+                    if match:
+                        doids.add(match.group(1))
+        else:
+            for line in handle:
+                match = OBO_ID_PATTERN.match(line)
+                if match:
+                    doids.add(match.group(1))
+    finally:
+        handle.close()
+    return doids
+
+class DoidValidator:
+    """Tells which DOIDs are defined in the disease ontology. Without an
+    ontology dump, unknown DOIDs are looked up on disease-ontology.org in
+    concurrent batches and both the valid and the invalid answers are kept
+    in a SQLite cache for ttl seconds."""
+
+    def __init__(self, client, cache_file = None, ttl = 7 * 24 * 60 * 60,
+                 ontology_file = None, refresh = False):
+        "Constructor"
+        self.client = client
+        self.ttl = ttl
+        self.doids = {}
+        # DOIDs whose last lookup failed, neither valid nor invalid
+        self.failed = set()
+        self.offline_doids = None
+        self.conn = None
+        if ontology_file:
+            self.offline_doids = read_ontology_file(ontology_file)
+        elif cache_file:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            self.conn = sqlite3.connect(cache_file)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS doids ("
+                              "doid TEXT PRIMARY KEY, "
+                              "valid INTEGER NOT NULL, "
+                              "checked_at REAL NOT NULL)")
+            self.conn.commit()
+            if not refresh:
+                self.load_cache()
+
+    @classmethod
+    def from_args(cls, args, client):
+        "Create the validator from the parsed evidence-items arguments"
+        cache_file = None
+        if not args.no_cache:
+            cache_file = os.path.join(args.cache_dir or default_cache_dir(),
+                                      'doids.sqlite')
+        return cls(client, cache_file,
+                   ttl = args.doid_ttl * 24 * 60 * 60,
+                   ontology_file = args.doid_file,
+                   refresh = args.refresh)
+
+    def load_cache(self):
+        "Read the answers younger than ttl from the cache"
+        rows = self.conn.execute("SELECT doid, valid FROM doids "
+                                 "WHERE checked_at > ?",
+                                 (time.time() - self.ttl,))
+        for doid, valid in rows:
+            self.doids[doid] = bool(valid)
+
+    def is_valid(self, doid):
+        "Is the DOID valid, None if it hasn't been resolved yet"
+        if self.offline_doids is not None:
+            return str(doid) in self.offline_doids
+        return self.doids.get(str(doid))
+
+    def lookup_failed(self, doid):
+        "Did the last lookup of the DOID fail, leaving it unresolved"
+        return str(doid) in self.failed
+
+    def lookup(self, doid):
+        """Ask disease-ontology.org about a DOID. Returns the DOID, whether
+        it is valid and whether the answer tells, errors and throttling
+        don't."""
+        url = utils.disease_ontology_api_url() + "metadata/DOID:" + doid
+        try:
+            r = self.client.get(url)
+        except requests.exceptions.RequestException:
+            return doid, False, False
+        # Server errors and throttling say nothing about the DOID, don't
+        # remember them
+        return doid, r.ok, r.status_code not in utils.TRANSIENT_STATUS_CODES \
+                           and r.status_code < 500
+
+    def resolve(self, doids, concurrency):
+        """Look up the DOIDs that aren't known yet. The ones whose lookup
+        fails stay unresolved, see lookup_failed()."""
+        unknown = set(str(doid) for doid in doids
+                      if self.is_valid(doid) is None)
+        answers = []
+        with metrics.stage("doid_lookup"):
+            for doid, valid, cacheable in utils.fetch_concurrently(
+                    self.lookup, sorted(unknown), concurrency):
+                if not cacheable:
+                    self.failed.add(doid)
+                    metrics.DOID_LOOKUPS.inc(("error",))
+                    continue
+                self.failed.discard(doid)
+                self.doids[doid] = valid
+                answers.append((doid, int(valid), time.time()))
+                metrics.DOID_LOOKUPS.inc(("valid" if valid else "invalid",))
+        if self.conn is not None and answers:
+            self.conn.executemany("INSERT OR REPLACE INTO doids "
+                                  "VALUES (?, ?, ?)", answers)
+            self.conn.commit()
+
+    def close(self):
+        "Close the cache"
+        if self.conn is not None:
+            self.conn.close()
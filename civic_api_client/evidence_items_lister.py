@@ -1,158 +1,189 @@
 "variants_lister.py - Get variants using the CIVIC API"
 
 import argparse
-from flask import Flask, render_template, url_for
 import json
 import requests
 requests.packages.urllib3.disable_warnings()
 import sys
 
 import civic_api_client
+import metrics
 import utils
-from variants_lister import VariantsLister, VariantDetails
-
-class EvidenceItems:
-    
-    # Upstream infomation of variants and genes
-    disease = {}
-    #list of drugs
-    drugs = []
-    error = ""
+from variants_lister import VariantsLister
+from doid_validator import DoidValidator
+from snapshot import Checkpointing
+import rules
+import sources
+import web
+
+class EvidenceItems(object):
+    """An invalid evidence item, with the fields of the evidence item and
+    of its variant the outputs need"""
+    __slots__ = (
+        'error',
+        'variant_id',
+        'variant_name',
+        'gene_name',
+        'gene_id',
+        'evi_id',
+        'evi_type',
+        'doid',
+    )
 
     def __init__(self, variant_details, evidence_items, error_type):
         "Constructor"
-        self.error = str(error_type)
-        self.variant_id = None
-        self.variant_name = None
-        self.gene_name = None
-        self.evi_id = None
-        self.evi_type = None
-        self.doid = None
+        self.error = utils.intern_value(str(error_type))
         self.parse_variant_details(variant_details)
         self.parse_evidence_details(evidence_items)
-        self.evidence_civic_url = self.define_evidence_url(variant_details,evidence_items)
-        self.variant_civic_url = VariantDetails.define_civic_url(variant_details)
-        
-
-    @classmethod       
-    def define_evidence_url(self, variant_details, evidence_items):
-        "Define the CIVIC URL for the evidence"
-        if 'gene_id' not in variant_details:
-            variant_details['gene_id'] = "NA"
-        return "https://civic.genome.wustl.edu/#/events/genes/" + \
-               str(variant_details['gene_id']) + "/summary/variants/" + \
-               str(variant_details['id']) + "/summary/evidence/" + \
-               str(evidence_items['id']) + "/summary#evidence"
 
     def parse_variant_details(self, variant_details):
         "Parse variant details into class members"
-        if 'name' in variant_details:
-            self.variant_name = variant_details['name']
-        if 'id' in variant_details:
-            self.variant_id = variant_details['id']
-        if 'entrez_name' in variant_details:
-            self.gene_name = variant_details['entrez_name']
+        self.variant_name = variant_details.get('name')
+        self.variant_id = variant_details.get('id')
+        self.gene_name = utils.intern_value(variant_details.get('entrez_name'))
+        self.gene_id = variant_details.get('gene_id', "NA")
 
     def parse_evidence_details(self, evidence_items):
         "Parse evidence details into class members"
-        if 'id' in evidence_items:
-            self.evi_id = evidence_items['id']
-        if 'evidence_type' in evidence_items:
-            self.evi_type = evidence_items['evidence_type']
-        if 'drugs' in evidence_items:
-            self.drugs = evidence_items['drugs']
-        if 'disease' in evidence_items:
-            self.disease = evidence_items['disease']
-        #if 'doid' in evidence_items['disease']:
-         #   self.doid = evidence_items['disease']['doid']
-
-        
+        self.evi_id = evidence_items.get('id')
+        self.evi_type = utils.intern_value(evidence_items.get('evidence_type'))
+        disease = evidence_items.get('disease') or {}
+        self.doid = utils.intern_value(disease.get('doid'))
+
+    @property
+    def evidence_civic_url(self):
+        "The CIVIC URL for the evidence"
+        return utils.civic_evidence_url(self.gene_id, self.variant_id,
+                                        self.evi_id)
+
+    @property
+    def variant_civic_url(self):
+        "The CIVIC URL for the variant of the evidence"
+        return utils.civic_variant_url(self.gene_id, self.variant_id)
+
+    def as_row(self):
+        "Columns of the evidence item for the web tables"
+        return {
+            'error': self.error,
+            'evi_id': self.evi_id,
+            'evi_type': self.evi_type,
+            'evidence_civic_url': self.evidence_civic_url,
+            'doid': self.doid,
+            'variant_id': self.variant_id,
+            'variant_name': self.variant_name,
+            'gene_name': self.gene_name,
+            'variant_civic_url': self.variant_civic_url,
+        }
+
+    def print1(self, out = None):
+        "Print the invalid evidence item, to out if given"
+        if out is None:
+            out = sys.stdout
+        print >> out, "Error_type: ", \
+                self.error, \
+                "Evidence_ID: ", \
+                self.evi_id, \
+                "Variant_id: ", \
+                self.variant_id, \
+                "Variant_name: ", \
+                self.variant_name, \
+                "Gene_name: ", \
+                self.gene_name, \
+                "Evidence_type: ", \
+                self.evi_type, \
+                "DOID: ", \
+                self.doid, \
+                "Evidence_URL: ", \
+                self.evidence_civic_url, \
+                "Variant_URL", \
+                self.variant_civic_url
+
+rules.EVIDENCE_RULES.check_fields(sources.EVIDENCE_FIELDS)
 
 class EvidenceItemsLister:
     """Represent the evidence-items in CIVIC"""
-    valid_doids = {}
-    invalid_eis = []
-    def __init__(self, args):
+    def __init__(self, args, client = None):
         "Constructor"
         self.args = args
+        self.client = client
+        self.doid_validator = None
+        self.rule_engine = None
+        self.invalid_eis = []
     def parse_args(self):
         "Parse command-line arguments"
         parser = argparse.ArgumentParser(description="civic-api-client version {}".format(civic_api_client.__version__),
             usage = "civic-api-client evidence-items-list",
             formatter_class = argparse.RawTextHelpFormatter,
         )
-        parser.add_argument("--doid",
-            action='store_true',
-            help = "Print evidence-items with improper DOID (not defined"\
-                    " on disease-ontology.org)."
-        )
-        parser.add_argument("--drug",
-            action='store_true',
-            help = "Print predictive evidence-items without drug defined."
-        )
+        rules.EVIDENCE_RULES.add_flags(parser)
         parser.add_argument("--max-gene-count",
             help = "Maximum number of genes to query from CIVIC [100,000].",
             type = int,
             default = 100000
         )
-        parser.add_argument("--evi-type",
-            type = str,
-            default = "All",
-            help = "Specify one evidence_type to check (default = All)."\
-                    " Chose from Predictive,Diagnostic,Prognostic or All."
-        )
+        self.add_check_args(parser)
         parser.add_argument("--web",
             action='store_true',
             help = "Publish evidence-items to a webpage."
         )
+        utils.add_fetch_args(parser)
+        metrics.add_profile_args(parser)
         args = parser.parse_args(self.args)
+        metrics.configure(args)
         print "Max number of genes to query is ",args.max_gene_count
         self.args = args
+        if self.client is None:
+            self.client = utils.CivicClient.from_args(args)
 
-    def check_doid(self, variant_id, variant_detail, evidence_items):
-        "Check if DOID is valid, if not add to list of invalids"
-        for evidence_item in evidence_items:
-            if evidence_item['status'] == 'rejected':
-                continue
-            doid = evidence_item['disease']['doid']
-            #Query each DOID once
-            if doid not in self.valid_doids:
-                url = utils.disease_ontology_api_url() + \
-                        "metadata/DOID:" + str(doid)
-                r = requests.get(url, verify = False)
-                try:
-                    r.raise_for_status()
-                except requests.exceptions.HTTPError:
-                    ei1 = EvidenceItems(variant_detail,evidence_item,"DOID")
-                    self.invalid_eis.append(ei1)
+    @staticmethod
+    def add_check_args(parser):
+        "Add the options of the evidence checks, shared with the audit command"
+        parser.add_argument("--doid-file",
+            type = str,
+            help = "Check the DOIDs against a local disease ontology dump"\
+                    " (doid.obo or doid.json)\ninstead of disease-ontology.org."
+        )
+        parser.add_argument("--doid-ttl",
+            type = float,
+            default = 7,
+            help = "Days the answers of disease-ontology.org are cached [7]."
+        )
+        parser.add_argument("--evi-type",
+            type = str,
+            default = "All",
+            help = "Specify one evidence_type to check (default = All)."\
+                    " Chose from Predictive,Diagnostic,Prognostic or All."
+        )
+
+    def check_evidence_items(self, variant_detail, evidence_items):
+        """Run the selected rules on the evidence items that weren't
+        rejected, adding one invalid evidence item per error found"""
+        for rule in self.rule_engine.rules:
+            for evidence_item in evidence_items:
+                if evidence_item['status'] == 'rejected':
                     continue
-                self.valid_doids[doid] = 1
-
-
-    def check_drug_for_pre(self, variant_id, variant_detail,evidence_items):
-        "Check if predictive evidence items have drug information"
-        for evidence_item in evidence_items:
-            if evidence_item['status'] == 'rejected':
-                continue
-            doid = evidence_item['disease']['doid']
-            #For the same output format add doid
-            drugs = evidence_item['drugs']
-            evi_type_to_check = 0
-
-            if self.args.evi_type == evidence_item['evidence_type'] or self.args.evi_type == "All":
-                evi_type_to_check = 1
-            if evi_type_to_check == 0:
-                continue
-
-            if len(drugs) == 1 and drugs[0]['name'] == "N/A":
-                ei1 = EvidenceItems(variant_detail,evidence_item,"Drug name is NA")
-                self.invalid_eis.append(ei1)
-            #if evidence_item['evidence_type'] == "Predictive":
-            # For predictive evidence, check if there's "drugs"
-            if not drugs:
-                ei1 = EvidenceItems(variant_detail,evidence_item,"Drug was not defined")
-                self.invalid_eis.append(ei1)
-        return
+                errors = self.rule_engine.check(rule, evidence_item)
+                for error in rules.error_names(errors):
+                    ei1 = EvidenceItems(variant_detail,evidence_item,error)
+                    self.invalid_eis.append(ei1)
+
+    def resolve_doids(self):
+        """Look up all the DOIDs seen in one batch and drop the evidence
+        items the DOID rule flagged whose DOID turned out to be valid. The
+        ones whose DOID couldn't be looked up are reported as such."""
+        context = self.rule_engine.context
+        if not context.unresolved_doids:
+            return
+        self.doid_validator.resolve(context.unresolved_doids,
+                                    self.args.concurrency)
+        context.unresolved_doids = set()
+        self.invalid_eis = [ei1 for ei1 in self.invalid_eis
+                            if ei1.error != "DOID" or
+                            not self.doid_validator.is_valid(ei1.doid)]
+        for ei1 in self.invalid_eis:
+            if ei1.error == "DOID" and \
+               self.doid_validator.lookup_failed(ei1.doid):
+                ei1.error = utils.intern_value("DOID lookup failed")
 
 
     def display_invalid_eis(self):
@@ -160,54 +191,41 @@ class EvidenceItemsLister:
         if self.args.web:
             self.display_invalid_eis_web()
         else:
-            for ei1 in self.invalid_eis:
-                print   "Error_type: ", \
-                        ei1.error, \
-                        "Evidence_ID: ", \
-                        ei1.evi_id, \
-                        "Variant_id: ", \
-                        ei1.variant_id, \
-                        "Variant_name: ", \
-                        ei1.variant_name, \
-                        "Gene_name: ", \
-                        ei1.gene_name, \
-                        "Evidence_type: ", \
-                        ei1.evi_type, \
-                        "DOID: ", \
-                        ei1.disease['doid'], \
-                        "Evidence_URL: ", \
-                        ei1.evidence_civic_url, \
-                        "Variant_URL", \
-                        ei1.variant_civic_url
+            with metrics.stage("output"):
+                for ei1 in self.invalid_eis:
+                    ei1.print1()
 
     def display_invalid_eis_web(self):
         "Publish to web page"
-        app = Flask("civic_api_client")
-        @app.route("/")
-        def template_test():
-                return render_template('evidence-items.html', \
-                        invalid_eis = self.invalid_eis)
-        app.run(debug=True)
+        store = web.ResultStore({'evidence_items': self.create_invalid_eis_list})
+        web.serve(store, home = 'evidence_items')
+
+    def start_checks(self):
+        "Set up the DOID validator and the rules selected on the command line"
+        self.invalid_eis = []
+        if self.doid_validator is None:
+            self.doid_validator = DoidValidator.from_args(self.args,
+                                                          self.client)
+        context = rules.RuleContext(doid_validator = self.doid_validator,
+                                    evi_type = self.args.evi_type)
+        self.rule_engine = rules.RuleEngine.from_args(rules.EVIDENCE_RULES,
+                                                      self.args, context)
+
+    def check_variant(self, variant_detail):
+        "Check the evidence items of a variant"
+        if "evidence_items" in variant_detail:
+            self.check_evidence_items(variant_detail,
+                                      variant_detail['evidence_items'])
 
     def create_invalid_eis_list(self):
         "Create the list of invalid evidence items"
-        vl1 = VariantsLister(self.args)
-        vl1.get_civic_genes()
-        variant_ids = vl1.get_variant_ids()
-        for variant_id in variant_ids:
-            variant_detail = vl1.get_variant_details(variant_id)
-            if "evidence_items" in variant_detail:
-                evidence_items = variant_detail['evidence_items']   
-                if self.args.doid:
-                    #If not valid, add to list of invalids
-                    self.check_doid(variant_id, variant_detail, evidence_items)
-                if self.args.drug:
-                    #If drug doesn't exist, add to list of invalids
-                    self.check_drug_for_pre(variant_id, variant_detail,evidence_items)
-                # if neither of the flags were specified, do both checks
-                if not (self.args.doid or self.args.drug):
-                    self.check_doid(variant_id, variant_detail, evidence_items)
-                    self.check_drug_for_pre(variant_id, variant_detail,evidence_items)
+        self.start_checks()
+        vl1 = VariantsLister(self.args, self.client)
+        for variant_detail in vl1.iter_all_variant_details(
+                evidence_rules = self.rule_engine.rules):
+            self.check_variant(variant_detail)
+        self.resolve_doids()
+        return self.invalid_eis
 
     def get_invalid_eis(self):
         "Return the list of invalid DOIDs"
@@ -216,5 +234,12 @@ class EvidenceItemsLister:
     def main(self):
         "Execution starts here"
         self.parse_args()
-        self.create_invalid_eis_list()
+        if not self.args.web:
+            with Checkpointing(self.args, "evidence-items-list"):
+                self.create_invalid_eis_list()
         self.display_invalid_eis()
+        if self.doid_validator is not None:
+            self.doid_validator.close()
+        self.client.close()
+        self.client.print_throttling()
+        metrics.print_profile(self.args)
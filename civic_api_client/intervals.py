@@ -0,0 +1,128 @@
+"intervals.py - Index of genomic intervals for region and overlap queries"
+
+import bisect
+import gzip
+import re
+
+# chr:start-stop, with an optional chr prefix and thousands separators
+REGION_PATTERN = re.compile(r'^(?:chr)?([^:\s]+):([\d,]+)-([\d,]+)$',
+                            re.IGNORECASE)
+
+def normalize_chromosome(chromosome):
+    "Chromosome name without the chr prefix, the way CIVIC writes them"
+    chromosome = str(chromosome)
+    if chromosome[:3].lower() == 'chr':
+        return chromosome[3:]
+    return chromosome
+
+def parse_region(region):
+    """(chromosome, start, stop) of a chr:start-stop region, 1-based with
+    both ends included like the CIVIC coordinates. Raises ValueError if the
+    region is malformed."""
+    match = REGION_PATTERN.match(region.strip())
+    if not match:
+        raise ValueError("Malformed region " + repr(region) +
+                         ", expected chr:start-stop")
+    start = int(match.group(2).replace(',', ''))
+    stop = int(match.group(3).replace(',', ''))
+    if start > stop:
+        raise ValueError("Region " + repr(region) + " starts after its end")
+    return normalize_chromosome(match.group(1)), start, stop
+
+def read_bed(bed_file):
+    """The (chromosome, start, stop) regions of a BED file, optionally
+    gzipped. BED regions are 0-based and exclude their end, they are
+    returned 1-based with both ends included."""
+    if bed_file.endswith('.gz'):
+        handle = gzip.open(bed_file, 'rb')
+    else:
+        handle = open(bed_file, 'rb')
+    regions = []
+    try:
+        for line in handle:
+            fields = line.split()
+            if not fields or fields[0].startswith(('#', 'track', 'browser')):
+                continue
+            regions.append((normalize_chromosome(fields[0]),
+                            int(fields[1]) + 1, int(fields[2])))
+    finally:
+        handle.close()
+    return regions
+
+def variant_intervals(variant):
+    """The (chromosome, start, stop) intervals of a VariantDetails, the
+    second one for fusions. Incomplete or inverted coordinates are
+    skipped."""
+    intervals = []
+    for chromosome, start, stop in (
+            (variant.chromosome, variant.start, variant.stop),
+            (variant.chromosome2, variant.start2, variant.stop2)):
+        try:
+            start, stop = int(start), int(stop)
+        except (TypeError, ValueError):
+            continue
+        if chromosome and start <= stop:
+            intervals.append((normalize_chromosome(chromosome), start, stop))
+    return intervals
+
+class IntervalIndex:
+    """Intervals sorted by start on each chromosome, with the running
+    maximum of their stops. The intervals that may overlap a query are
+    found with two bisections: the ones starting after the end of the query
+    are cut off on the starts, the ones all ending before the query starts
+    are cut off on the running maximum of the stops."""
+
+    def __init__(self, intervals = ()):
+        "Constructor, intervals are (chromosome, start, stop, item) tuples"
+        by_chromosome = {}
+        for chromosome, start, stop, item in intervals:
+            by_chromosome.setdefault(normalize_chromosome(chromosome),
+                                     []).append((start, stop, item))
+        self.chromosomes = {}
+        for chromosome, entries in by_chromosome.items():
+            entries.sort(key = lambda entry: entry[:2])
+            max_stops = []
+            max_stop = None
+            for start, stop, item in entries:
+                max_stop = stop if max_stop is None else max(max_stop, stop)
+                max_stops.append(max_stop)
+            self.chromosomes[chromosome] = (
+                [entry[0] for entry in entries], max_stops, entries)
+
+    @classmethod
+    def from_variants(cls, variants):
+        "Index of the intervals of VariantDetails, the items are the variants"
+        return cls((chromosome, start, stop, variant)
+                   for variant in variants
+                   for chromosome, start, stop in variant_intervals(variant))
+
+    @classmethod
+    def from_regions(cls, regions):
+        "Index of (chromosome, start, stop) regions, the items are the regions"
+        return cls((chromosome, start, stop, (chromosome, start, stop))
+                   for chromosome, start, stop in regions)
+
+    def __len__(self):
+        return sum(len(index[0]) for index in self.chromosomes.values())
+
+    def overlapping(self, chromosome, start, stop):
+        "Items of the intervals overlapping start-stop, ordered by start"
+        index = self.chromosomes.get(normalize_chromosome(chromosome))
+        if index is None:
+            return []
+        starts, max_stops, entries = index
+        first = bisect.bisect_left(max_stops, start)
+        last = bisect.bisect_right(starts, stop)
+        return [item for entry_start, entry_stop, item in entries[first:last]
+                if entry_stop >= start]
+
+    def overlaps_any(self, intervals):
+        "Does one of the (chromosome, start, stop) intervals overlap the index"
+        return any(self.overlapping(chromosome, start, stop)
+                   for chromosome, start, stop in intervals)
+
+    def overlaps(self, regions):
+        """Batch query, the items overlapping each (chromosome, start, stop)
+        region, in the order of the regions"""
+        return [self.overlapping(chromosome, start, stop)
+                for chromosome, start, stop in regions]
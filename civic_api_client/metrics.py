@@ -0,0 +1,266 @@
+"metrics.py - Counters, latency histograms and stage timings of a run"
+
+import bisect
+import json
+import sys
+import threading
+import time
+
+# Nothing is recorded until enable() is called, by --profile or the web view
+enabled = False
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+# All the metrics, in the order they are reported
+METRICS = []
+
+def enable():
+    "Start recording"
+    global enabled
+    enabled = True
+
+class Counter:
+    """A total per combination of label values, only ever going up"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels = ()):
+        "Constructor"
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values = (), amount = 1):
+        "Add amount to the total of the label values"
+        if not enabled:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + \
+                                        amount
+
+    def samples(self):
+        "(label values, total) pairs, sorted on the label values"
+        with self.lock:
+            return sorted(self.values.items())
+
+    def take(self):
+        "The totals recorded since the last take, reset to zero"
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values):
+        "Add totals taken from the same counter in another process"
+        for label_values, amount in values.items():
+            self.inc(label_values, amount)
+
+class Histogram:
+    """Count of the observed values falling in each bucket, with their sum,
+    per combination of label values"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels = (), buckets = LATENCY_BUCKETS):
+        "Constructor"
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_values = ()):
+        "Count a value"
+        if not enabled:
+            return
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # One count per bucket, the values above the last bucket,
+                # then the sum of the values
+                counts = self.values[label_values] = \
+                         [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        "(label values, bucket counts + [sum]) pairs, sorted"
+        with self.lock:
+            return sorted((label_values, list(counts))
+                          for label_values, counts in self.values.items())
+
+    def quantile(self, counts, q):
+        "Upper bound of the bucket holding the q quantile, None if past them"
+        total = sum(counts[:-1])
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return None
+
+def counter(name, help, labels = ()):
+    "Create and register a Counter"
+    metric = Counter(name, help, labels)
+    METRICS.append(metric)
+    return metric
+
+def histogram(name, help, labels = (), buckets = LATENCY_BUCKETS):
+    "Create and register a Histogram"
+    metric = Histogram(name, help, labels, buckets)
+    METRICS.append(metric)
+    return metric
+
+REQUESTS = counter('civic_requests_total',
+                   "Requests sent to the APIs, by endpoint and HTTP status",
+                   ('endpoint', 'status'))
+RESPONSE_BYTES = counter('civic_response_bytes_total',
+                         "Bytes of the response bodies, by endpoint",
+                         ('endpoint',))
+REQUEST_RETRIES = counter('civic_request_retries_total',
+                          "Requests retried, by endpoint and the HTTP status "
+                          "or error of the failed try", ('endpoint', 'reason'))
+REQUEST_SECONDS = histogram('civic_request_seconds',
+                            "Latency of the requests, by endpoint",
+                            ('endpoint',))
+CACHE_LOOKUPS = counter('civic_cache_lookups_total',
+                        "Response cache lookups: fresh hits, revalidated "
+                        "hits, stale entries refetched and misses",
+                        ('result',))
+DOID_LOOKUPS = counter('civic_doid_lookups_total',
+                       "DOIDs looked up on disease-ontology.org, by answer",
+                       ('result',))
+RULE_CHECKS = counter('civic_rule_checks_total',
+                      "Records checked by each rule", ('rule',))
+RULE_ERRORS = counter('civic_rule_errors_total',
+                      "Records flagged by each rule, the DOIDs not looked up "
+                      "yet included", ('rule',))
+RULE_SECONDS = counter('civic_rule_seconds_total',
+                       "Seconds spent in each rule", ('rule',))
+# The counters the rules record, sent back by the --workers processes
+RULE_COUNTERS = (RULE_CHECKS, RULE_ERRORS, RULE_SECONDS)
+STAGE_SECONDS = counter('civic_stage_seconds_total',
+                        "Seconds spent in each stage of the run",
+                        ('stage',))
+EXPORTED_RECORDS = counter('civic_exported_records_total',
+                           "Records written by the exports, by format",
+                           ('format',))
+
+class Timer:
+    "Context manager adding the seconds spent in its block to a counter"
+
+    def __init__(self, counter, label_values = ()):
+        "Constructor"
+        self.counter = counter
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.counter.inc(self.label_values, time.time() - self.start)
+
+def stage(name):
+    """Timer of a stage of the run: gene_listing, transcript_load,
+    doid_lookup, export or output"""
+    return Timer(STAGE_SECONDS, (name,))
+
+def format_labels(names, values, extra = ()):
+    "Prometheus label set of the label names and values"
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                       .replace('"', '\\"'))
+                          for name, value in pairs) + "}"
+
+def prometheus_text():
+    "All the metrics in the Prometheus text exposition format"
+    lines = []
+    for metric in METRICS:
+        lines.append("# HELP %s %s" % (metric.name, metric.help))
+        lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+        for label_values, value in metric.samples():
+            if metric.kind == 'counter':
+                lines.append("%s%s %r" % (metric.name,
+                    format_labels(metric.labels, label_values), value))
+                continue
+            cumulative = 0
+            bounds = [repr(bound) for bound in metric.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (metric.name,
+                    format_labels(metric.labels, label_values,
+                                  [('le', bound)]), cumulative))
+            labels = format_labels(metric.labels, label_values)
+            lines.append("%s_sum%s %r" % (metric.name, labels, value[-1]))
+            lines.append("%s_count%s %d" % (metric.name, labels, cumulative))
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    "All the metrics as a dict, for the JSON profile"
+    data = {}
+    for metric in METRICS:
+        samples = []
+        for label_values, value in metric.samples():
+            sample = {'labels': dict(zip(metric.labels, label_values))}
+            if metric.kind == 'counter':
+                sample['value'] = value
+            else:
+                sample['count'] = sum(value[:-1])
+                sample['sum'] = value[-1]
+                sample['buckets'] = dict(zip(
+                    [repr(bound) for bound in metric.buckets] + ["+Inf"],
+                    value[:-1]))
+            samples.append(sample)
+        if samples:
+            data[metric.name] = {'type': metric.kind, 'help': metric.help,
+                                 'samples': samples}
+    return data
+
+def summary_table():
+    "All the metrics recorded, one line per label values"
+    lines = []
+    for metric in METRICS:
+        for label_values, value in metric.samples():
+            name = metric.name + format_labels(metric.labels, label_values)
+            if metric.kind == 'counter':
+                shown = "%.3f" % value if isinstance(value, float) \
+                        else str(value)
+            else:
+                count = sum(value[:-1])
+                p95 = metric.quantile(value, 0.95)
+                shown = "count=%d mean=%.4fs p95<=%s" % (count,
+                    value[-1] / count, "%gs" % p95 if p95 else "+Inf")
+            lines.append("%-60s %s" % (name, shown))
+    return "\n".join(lines)
+
+def add_profile_args(parser):
+    "Add the --profile option"
+    parser.add_argument("--profile",
+        help = "Print the request counts, latencies, cache hits and the time"
+                " spent in each\nrule and stage to stderr at the end, as a"
+                " table or JSON [table].",
+        nargs = '?',
+        const = 'table',
+        choices = ['table', 'json'],
+    )
+
+def configure(args):
+    "Start recording if --profile was given"
+    if getattr(args, 'profile', None):
+        enable()
+
+def print_profile(args, out = None):
+    "Print the metrics if --profile was given"
+    profile = getattr(args, 'profile', None)
+    if not profile:
+        return
+    if out is None:
+        out = sys.stderr
+    if profile == 'json':
+        json.dump(snapshot(), out, indent = 2, sort_keys = True)
+        out.write("\n")
+    else:
+        out.write(summary_table() + "\n")
@@ -0,0 +1,404 @@
+"mirror.py - Local SQLite mirror of CIVIC"
+
+import argparse
+import itertools
+import os
+import sqlite3
+import time
+
+import civic_api_client
+import metrics
+import sources
+import utils
+from snapshot import Checkpointing
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS genes ("
+    "id INTEGER PRIMARY KEY, "
+    "name TEXT, "
+    "entrez_id INTEGER)",
+    # position is the order of the variants in the crawl
+    "CREATE TABLE IF NOT EXISTS variants ("
+    "id INTEGER PRIMARY KEY, "
+    "gene_id INTEGER REFERENCES genes(id), "
+    "name TEXT, "
+    "description TEXT, "
+    "has_variant_types INTEGER NOT NULL, "
+    "position INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS variant_types ("
+    "variant_id INTEGER NOT NULL REFERENCES variants(id), "
+    "position INTEGER NOT NULL, "
+    "name TEXT)",
+    # ensembl_version has no type so a version given as text stays text,
+    # the ensembl_version rule flags those
+    "CREATE TABLE IF NOT EXISTS coordinates ("
+    "variant_id INTEGER PRIMARY KEY REFERENCES variants(id), "
+    "chromosome TEXT, "
+    "start INTEGER, "
+    "stop INTEGER, "
+    "reference_bases TEXT, "
+    "variant_bases TEXT, "
+    "representative_transcript TEXT, "
+    "chromosome2 TEXT, "
+    "start2 INTEGER, "
+    "stop2 INTEGER, "
+    "representative_transcript2 TEXT, "
+    "ensembl_version, "
+    "reference_build TEXT)",
+    "CREATE TABLE IF NOT EXISTS evidence_items ("
+    "id INTEGER PRIMARY KEY, "
+    "variant_id INTEGER NOT NULL REFERENCES variants(id), "
+    "evidence_type TEXT, "
+    "evidence_direction TEXT, "
+    "clinical_significance TEXT, "
+    "description TEXT, "
+    "pubmed_id TEXT, "
+    "citation TEXT, "
+    "rating INTEGER, "
+    "status TEXT, "
+    "variant_origin TEXT, "
+    "disease_name TEXT, "
+    "doid TEXT, "
+    "position INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS evidence_drugs ("
+    "evidence_id INTEGER NOT NULL REFERENCES evidence_items(id), "
+    "position INTEGER NOT NULL, "
+    "name TEXT, "
+    "pubchem_id TEXT)",
+    "CREATE TABLE IF NOT EXISTS sync ("
+    "key TEXT PRIMARY KEY, "
+    "value TEXT)",
+    "CREATE INDEX IF NOT EXISTS variants_gene ON variants(gene_id)",
+    "CREATE INDEX IF NOT EXISTS variants_position ON variants(position)",
+    "CREATE INDEX IF NOT EXISTS variant_types_variant "
+    "ON variant_types(variant_id)",
+    "CREATE INDEX IF NOT EXISTS coordinates_region "
+    "ON coordinates(chromosome, start, stop)",
+    "CREATE INDEX IF NOT EXISTS evidence_items_variant "
+    "ON evidence_items(variant_id)",
+    "CREATE INDEX IF NOT EXISTS evidence_items_doid ON evidence_items(doid)",
+    "CREATE INDEX IF NOT EXISTS evidence_items_type "
+    "ON evidence_items(evidence_type)",
+    "CREATE INDEX IF NOT EXISTS evidence_drugs_evidence "
+    "ON evidence_drugs(evidence_id)",
+]
+# Tables emptied before a sync, children first
+TABLES = ['evidence_drugs', 'evidence_items', 'coordinates', 'variant_types',
+          'variants', 'genes']
+
+# SQL conditions on the coordinates (c) of the variants that may fail a
+# variant rule, the rule still decides. Rules missing here can't be
+# answered by a query and get every variant.
+VARIANT_FILTERS = {
+    'wrong_coords': "(c.chromosome IS NOT NULL OR c.start IS NOT NULL OR "
+                    "c.stop IS NOT NULL) AND "
+                    "(typeof(c.start) != 'integer' OR "
+                    "typeof(c.stop) != 'integer' OR c.start > c.stop OR "
+                    "typeof(c.start2) NOT IN ('integer', 'null') OR "
+                    "typeof(c.stop2) NOT IN ('integer', 'null') OR "
+                    "c.start2 > c.stop2)",
+}
+# SQL conditions on the evidence items (e) that may fail an evidence rule,
+# :evi_type is the --evi-type
+EVIDENCE_FILTERS = {
+    'drug': "(:evi_type = 'All' OR e.evidence_type = :evi_type) AND "
+            "(NOT EXISTS (SELECT 1 FROM evidence_drugs d "
+            "WHERE d.evidence_id = e.id) OR "
+            "EXISTS (SELECT 1 FROM evidence_drugs d "
+            "WHERE d.evidence_id = e.id AND d.name = 'N/A'))",
+}
+COORDINATE_SELECT = ", ".join("c." + column
+                              for column in sources.COORDINATE_COLUMNS)
+EVIDENCE_COLUMNS = ['id', 'variant_id', 'evidence_type', 'evidence_direction',
+                    'clinical_significance', 'description', 'pubmed_id',
+                    'citation', 'rating', 'status', 'variant_origin',
+                    'disease_name', 'doid']
+
+def candidate_filter(selected_rules, filters):
+    """SQL condition matching the records that may fail one of the rules,
+    None if one of the rules has no condition"""
+    if not selected_rules:
+        return None
+    conditions = []
+    for rule in selected_rules:
+        if rule.code not in filters:
+            return None
+        conditions.append("(" + filters[rule.code] + ")")
+    return " OR ".join(conditions)
+
+class CivicMirror:
+    """SQLite database holding the genes, variants, coordinates and evidence
+    items of CIVIC, written by the sync command. The listers read it with
+    MirrorSource instead of crawling the API."""
+
+    def __init__(self, db_file):
+        "Constructor"
+        db_dir = os.path.dirname(db_file)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def sync(self, variant_details, source):
+        """Replace the content of the mirror with the variant details, in
+        one transaction. Returns the number of genes, variants and evidence
+        items written."""
+        conn = self.conn
+        genes = set()
+        variant_count = 0
+        evidence_count = 0
+        with conn:
+            for table in TABLES:
+                conn.execute("DELETE FROM " + table)
+            for position, variant_detail in enumerate(variant_details):
+                gene_id = variant_detail.get('gene_id')
+                if gene_id is not None and gene_id not in genes:
+                    genes.add(gene_id)
+                    conn.execute("INSERT OR REPLACE INTO genes VALUES (?, ?, ?)",
+                                 (gene_id, variant_detail.get('entrez_name'),
+                                  variant_detail.get('entrez_id')))
+                self.insert_variant(position, variant_detail)
+                variant_count += 1
+                evidence_count += len(variant_detail.get('evidence_items')
+                                      or [])
+            conn.executemany("INSERT OR REPLACE INTO sync VALUES (?, ?)",
+                             [('synced_at', str(time.time())),
+                              ('source', source)])
+        return len(genes), variant_count, evidence_count
+
+    def insert_variant(self, position, variant_detail):
+        "Write a variant, its coordinates and its evidence items"
+        conn = self.conn
+        variant_id = variant_detail['id']
+        variant_types = variant_detail.get('variant_types')
+        conn.execute("INSERT OR REPLACE INTO variants VALUES (?, ?, ?, ?, ?, ?)",
+                     (variant_id, variant_detail.get('gene_id'),
+                      variant_detail.get('name'),
+                      variant_detail.get('description'),
+                      int(variant_types is not None), position))
+        conn.executemany("INSERT INTO variant_types VALUES (?, ?, ?)",
+                         [(variant_id, number, variant_type.get('name'))
+                          for number, variant_type
+                          in enumerate(variant_types or [])])
+        coordinates = variant_detail.get('coordinates')
+        if coordinates:
+            conn.execute("INSERT OR REPLACE INTO coordinates VALUES "
+                         "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         [variant_id] + [coordinates.get(column) for column
+                                         in sources.COORDINATE_COLUMNS])
+        for number, evidence_item in \
+                enumerate(variant_detail.get('evidence_items') or []):
+            disease = evidence_item.get('disease') or {}
+            conn.execute("INSERT OR REPLACE INTO evidence_items VALUES "
+                         "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (evidence_item.get('id'), variant_id,
+                          evidence_item.get('evidence_type'),
+                          evidence_item.get('evidence_direction'),
+                          evidence_item.get('clinical_significance'),
+                          evidence_item.get('description'),
+                          evidence_item.get('pubmed_id'),
+                          evidence_item.get('citation'),
+                          evidence_item.get('rating'),
+                          evidence_item.get('status'),
+                          evidence_item.get('variant_origin'),
+                          disease.get('name'), disease.get('doid'), number))
+            conn.executemany("INSERT INTO evidence_drugs VALUES (?, ?, ?, ?)",
+                             [(evidence_item.get('id'), drug_number,
+                               drug.get('name'), drug.get('pubchem_id'))
+                              for drug_number, drug
+                              in enumerate(evidence_item.get('drugs') or [])])
+
+    def synced_at(self):
+        "Time of the last sync, None if the mirror was never synced"
+        row = self.conn.execute("SELECT value FROM sync "
+                                "WHERE key = 'synced_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def iter_variant_details(self, variant_rules = None,
+                             evidence_rules = None, evi_type = "All"):
+        """Variant details in the shape of the API, in the order of the
+        crawl they were synced from. With variant_rules, only the variants
+        that may fail one of the rules are read. With evidence_rules, only
+        the evidence items that may fail one of the rules, and their
+        variants, are read."""
+        params = {'evi_type': evi_type}
+        evidence_condition = candidate_filter(evidence_rules,
+                                              EVIDENCE_FILTERS)
+        variant_conditions = []
+        variant_condition = candidate_filter(variant_rules, VARIANT_FILTERS)
+        if variant_condition:
+            variant_conditions.append(variant_condition)
+        if evidence_condition:
+            variant_conditions.append("EXISTS (SELECT 1 FROM evidence_items e "
+                                      "WHERE e.variant_id = v.id AND (" +
+                                      evidence_condition + "))")
+        where = ""
+        if variant_conditions:
+            where = " WHERE " + " AND ".join(variant_conditions)
+        variants = self.conn.execute(
+            "SELECT v.id, v.name, v.description, v.has_variant_types, "
+            "v.gene_id, g.name, g.entrez_id, c.variant_id, " +
+            COORDINATE_SELECT + " FROM variants v "
+            "LEFT JOIN genes g ON g.id = v.gene_id "
+            "LEFT JOIN coordinates c ON c.variant_id = v.id" + where +
+            " ORDER BY v.position", params)
+        evidence_where = where or " WHERE 1"
+        if evidence_condition:
+            evidence_where += " AND (" + evidence_condition + ")"
+        evidence_items = self.conn.execute(
+            "SELECT " + ", ".join("e." + column for column in
+                                  EVIDENCE_COLUMNS) +
+            " FROM evidence_items e JOIN variants v ON v.id = e.variant_id "
+            "LEFT JOIN coordinates c ON c.variant_id = v.id" +
+            evidence_where + " ORDER BY v.position, e.position", params)
+        evidence_by_variant = itertools.groupby(
+            (dict(zip(EVIDENCE_COLUMNS, row)) for row in evidence_items),
+            lambda evidence_item: evidence_item['variant_id'])
+        next_group = next(evidence_by_variant, None)
+        variant_types = self.read_variant_types()
+        drugs = self.read_drugs()
+        for row in variants:
+            variant_detail = self.variant_from_row(row, variant_types)
+            variant_detail['evidence_items'] = []
+            if next_group is not None and next_group[0] == row[0]:
+                variant_detail['evidence_items'] = [
+                    self.evidence_from_row(evidence_item, drugs)
+                    for evidence_item in next_group[1]]
+                next_group = next(evidence_by_variant, None)
+            yield variant_detail
+
+    def read_variant_types(self):
+        "Names of the variant types of each variant"
+        variant_types = {}
+        for variant_id, name in self.conn.execute(
+                "SELECT variant_id, name FROM variant_types "
+                "ORDER BY variant_id, position"):
+            variant_types.setdefault(variant_id, []).append({'name': name})
+        return variant_types
+
+    def read_drugs(self):
+        "Drugs of each evidence item"
+        drugs = {}
+        for evidence_id, name, pubchem_id in self.conn.execute(
+                "SELECT evidence_id, name, pubchem_id FROM evidence_drugs "
+                "ORDER BY evidence_id, position"):
+            drugs.setdefault(evidence_id, []).append(
+                {'name': name, 'pubchem_id': pubchem_id})
+        return drugs
+
+    def variant_from_row(self, row, variant_types):
+        "Variant details in the shape of the API from a variants row"
+        variant_id, name, description, has_variant_types, gene_id, \
+            entrez_name, entrez_id, coordinates_id = row[:8]
+        variant_detail = {
+            'id': variant_id,
+            'name': name,
+            'description': description,
+            'entrez_name': entrez_name,
+            'entrez_id': entrez_id,
+            'variant_types': None,
+        }
+        if gene_id is not None:
+            variant_detail['gene_id'] = gene_id
+        if has_variant_types:
+            variant_detail['variant_types'] = variant_types.get(variant_id, [])
+        if coordinates_id is not None:
+            variant_detail['coordinates'] = dict(
+                zip(sources.COORDINATE_COLUMNS, row[8:]))
+        return variant_detail
+
+    def evidence_from_row(self, evidence_item, drugs):
+        "Evidence item in the shape of the API from an evidence_items row"
+        evidence_item = dict(evidence_item)
+        del evidence_item['variant_id']
+        evidence_item['disease'] = {'name': evidence_item.pop('disease_name'),
+                                    'doid': evidence_item.pop('doid')}
+        evidence_item['drugs'] = drugs.get(evidence_item['id'], [])
+        return evidence_item
+
+    def close(self):
+        "Close the database"
+        self.conn.close()
+
+class MirrorSource:
+    """Variant details from the mirror written by the sync command. The
+    listers give the rules they run, so that only the records that may
+    fail them are read when the rules can be answered by a query."""
+
+    def __init__(self, db_file, evi_type = "All"):
+        "Constructor"
+        if not os.path.isfile(db_file):
+            raise IOError("No CIVIC mirror at " + db_file +
+                          ", create it with: civic-api-client sync --db " +
+                          db_file)
+        self.db_file = db_file
+        self.evi_type = evi_type
+
+    def iter_variant_details(self, variant_rules = None,
+                             evidence_rules = None):
+        "Details of the variants in the mirror"
+        mirror = CivicMirror(self.db_file)
+        try:
+            if mirror.synced_at() is None:
+                raise IOError("The CIVIC mirror " + self.db_file +
+                              " was never synced")
+            for variant_detail in mirror.iter_variant_details(
+                    variant_rules, evidence_rules, self.evi_type):
+                yield variant_detail
+        finally:
+            mirror.close()
+
+class MirrorSyncer:
+    """Crawl CIVIC, or read a bulk dump, into the mirror"""
+
+    def __init__(self, args, client = None):
+        "Constructor"
+        self.args = args
+        self.client = client
+
+    def parse_args(self):
+        "Parse command-line arguments"
+        parser = argparse.ArgumentParser(description="civic-api-client version {}".format(civic_api_client.__version__),
+            usage = "civic-api-client sync --db FILE",
+            formatter_class = argparse.RawTextHelpFormatter,
+        )
+        parser.add_argument("--db",
+            help = "SQLite file to write the mirror to.",
+            type = str,
+            required = True
+        )
+        parser.add_argument("--max-gene-count",
+            help = "Maximum number of genes to query from CIVIC [100,000].",
+            type = int,
+            default = 100000
+        )
+        utils.add_fetch_args(parser, db = False)
+        metrics.add_profile_args(parser)
+        args = parser.parse_args(self.args)
+        metrics.configure(args)
+        self.args = args
+        if self.client is None:
+            self.client = utils.CivicClient.from_args(args)
+
+    def main(self):
+        "Execution starts here"
+        self.parse_args()
+        if self.args.dump:
+            source = sources.DumpSource(self.args.dump)
+        else:
+            source = sources.ApiSource(self.args, self.client)
+        mirror = CivicMirror(self.args.db)
+        try:
+            with Checkpointing(self.args, "sync"):
+                counts = mirror.sync(source.iter_variant_details(),
+                                     self.args.dump or utils.civic_api_url())
+        finally:
+            mirror.close()
+            self.client.close()
+        print "Synced %d genes, %d variants and %d evidence items to %s" % \
+              (counts + (self.args.db,))
+        self.client.print_throttling()
+        metrics.print_profile(self.args)
@@ -0,0 +1,162 @@
+"response_cache.py - On-disk cache of the responses from the CIVIC API"
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Cache hits whose access times are kept in memory before they are written
+ACCESS_FLUSH_SIZE = 500
+
+def default_cache_dir():
+    "Directory the responses are cached in, unless --cache-dir is given"
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+                 os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'civic-api-client')
+
+class CachedResponse:
+    """A response body stored in the cache along with the validators
+    needed to revalidate it with the server"""
+
+    def __init__(self, url, body, etag, last_modified, fetched_at):
+        "Constructor"
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, ttl):
+        "Was the response fetched less than ttl seconds ago"
+        return time.time() - self.fetched_at < ttl
+
+    def conditional_headers(self):
+        "Headers that let the server answer 304 if nothing changed"
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def json(self):
+        "Decode the JSON body"
+        return json.loads(self.body)
+
+class ResponseCache:
+    """SQLite store of response bodies keyed by URL. Entries older than ttl
+    seconds are revalidated and the least recently used entries are evicted
+    once the compressed bodies take more than max_size bytes."""
+
+    def __init__(self, cache_dir, ttl = 24 * 60 * 60,
+                 max_size = 500 * 1024 * 1024):
+        "Constructor"
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Access times of the hits, written in batches so that reading the
+        # cache doesn't hold its write lock
+        self.accessed = {}
+        self.conn = sqlite3.connect(os.path.join(cache_dir,
+                                                 'responses.sqlite'),
+                                    check_same_thread = False)
+        # Readers don't wait for the other processes writing to the cache
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                          "url TEXT PRIMARY KEY, "
+                          "body BLOB NOT NULL, "
+                          "etag TEXT, "
+                          "last_modified TEXT, "
+                          "fetched_at REAL NOT NULL, "
+                          "accessed_at REAL NOT NULL, "
+                          "size INTEGER NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed "
+                          "ON responses (accessed_at)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) "
+                                      "FROM responses").fetchone()[0]
+
+    @classmethod
+    def from_args(cls, args):
+        "Create the cache from the parsed fetch arguments, None if disabled"
+        if args.no_cache:
+            return None
+        return cls(args.cache_dir or default_cache_dir(),
+                   ttl = args.cache_ttl * 60 * 60,
+                   max_size = args.cache_max_size * 1024 * 1024)
+
+    def get(self, url):
+        "Return the cached response for the URL, None on a miss"
+        with self.lock:
+            row = self.conn.execute("SELECT body, etag, last_modified, "
+                                    "fetched_at FROM responses "
+                                    "WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self.accessed[url] = time.time()
+            if len(self.accessed) >= ACCESS_FLUSH_SIZE:
+                self.flush_accessed()
+                self.conn.commit()
+        body, etag, last_modified, fetched_at = row
+        return CachedResponse(url, zlib.decompress(body), etag,
+                              last_modified, fetched_at)
+
+    def put(self, url, body, etag = None, last_modified = None):
+        "Store a response body, evicting old entries if over max_size"
+        compressed = zlib.compress(body)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM responses "
+                                    "WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.conn.execute("INSERT OR REPLACE INTO responses "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (url, sqlite3.Binary(compressed), etag,
+                               last_modified, now, now, len(compressed)))
+            self.size += len(compressed)
+            if self.size > self.max_size:
+                self.flush_accessed()
+                self.evict()
+            self.conn.commit()
+
+    def touch(self, url):
+        "Mark a response as fresh after the server answered 304"
+        with self.lock:
+            self.conn.execute("UPDATE responses SET fetched_at = ? "
+                              "WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+
+    def flush_accessed(self):
+        "Write the access times kept in memory"
+        self.conn.executemany("UPDATE responses SET accessed_at = ? "
+                              "WHERE url = ?",
+                              [(accessed_at, url) for url, accessed_at
+                               in self.accessed.items()])
+        self.accessed = {}
+
+    def evict(self):
+        "Drop the least recently used entries until under max_size"
+        while self.size > self.max_size:
+            rows = self.conn.execute("SELECT url, size FROM responses "
+                                     "ORDER BY accessed_at "
+                                     "LIMIT 100").fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE url = ?",
+                                  (url,))
+                self.size -= size
+                if self.size <= self.max_size:
+                    break
+
+    def close(self):
+        "Write pending access times and close the database"
+        with self.lock:
+            self.flush_accessed()
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,328 @@
+"rules.py - Data-quality rules checked on the variants and evidence items"
+
+import re
+import time
+
+import intervals
+import metrics
+
+# Names of the error types, the position of a name is its bit in an error mask
+ERROR_TYPES = []
+
+def error_type(name):
+    "Bit of an error type in the error masks, new types get the next bit"
+    if name not in ERROR_TYPES:
+        ERROR_TYPES.append(name)
+    return 1 << ERROR_TYPES.index(name)
+
+def error_names(errors):
+    "Names of the error types set in an error mask, in bit order"
+    return [name for bit, name in enumerate(ERROR_TYPES) if errors >> bit & 1]
+
+NO_VARIANT_TYPES = error_type("No variant_types")
+NO_COORDINATE = error_type("No coordinate")
+WRONG_COORDINATES = error_type("Wrong coordinates")
+WRONG_BASE = error_type("Wrong base")
+NO_REP_TRANSCRIPT = error_type("No representative transcript")
+WRONG_TRANSCRIPT_FORMAT = error_type("Wrong transcript format")
+INVALID_REP_TRANSCRIPT = error_type("Invalid representative transcript")
+NO_ENSEMBL_VERSION = error_type("No Ensembl version")
+WRONG_ENSEMBL_VERSION = error_type("Wrong Ensembl version")
+WRONG_DOID = error_type("DOID")
+# Reported instead of WRONG_DOID when disease-ontology.org couldn't answer
+DOID_LOOKUP_FAILED = error_type("DOID lookup failed")
+DRUG_NAME_NA = error_type("Drug name is NA")
+NO_DRUG = error_type("Drug was not defined")
+DUPLICATE_COORDINATES = error_type("Duplicate coordinates")
+OVERLAPPING_COORDINATES = error_type("Overlapping coordinates")
+
+# Pattern example : ENST00000355413.4
+TRANSCRIPT_PATTERN = re.compile(r'ENST\d+\.\d+')
+ALLOWED_NUCS = frozenset(['A', 'C', 'G', 'T', 'N'])
+# Variants longer than this are not checked for wrong bases
+MAX_BASE_CHECK_LENGTH = 10
+
+class Rule:
+    """A data-quality check. code is the stable name of the rule, also the
+    name of the command-line flag selecting it, fields are the fields of the
+    record it reads, checked by RuleRegistry.check_fields, and
+    check(record, context) returns the error mask of the record. Rules that
+    aren't default only run when their flag is given, help describes the
+    flag, the docstring of check by default."""
+
+    def __init__(self, code, fields, check, default = True, help = None):
+        "Constructor"
+        self.code = code
+        self.fields = fields
+        self.check = check
+        self.default = default
+        self.help = help or check.__doc__
+
+class RuleRegistry:
+    "The rules that can run on one kind of record, in the order they run"
+
+    def __init__(self):
+        "Constructor"
+        self.rules = []
+        #Fields of the records, None until the record type is defined
+        self.known_fields = None
+
+    def register(self, code, fields, default = True, help = None):
+        """Decorator adding a check function to the registry as a Rule.
+        Raises ValueError if the rule reads fields the records don't have,
+        once check_fields gave them."""
+        def add(check):
+            rule = Rule(code, fields, check, default, help)
+            if self.known_fields is not None:
+                self.check_rule_fields(rule)
+            self.rules.append(rule)
+            return check
+        return add
+
+    def check_fields(self, known_fields):
+        """Raise ValueError if a rule declares a field the records don't
+        have, called once the record type is defined. The rules registered
+        later are checked as they are registered."""
+        self.known_fields = known_fields
+        for rule in self.rules:
+            self.check_rule_fields(rule)
+
+    def check_rule_fields(self, rule):
+        "Raise ValueError if the rule reads fields the records don't have"
+        unknown = [field for field in rule.fields
+                   if field not in self.known_fields]
+        if unknown:
+            raise ValueError("Rule %s reads unknown fields: %s" %
+                             (rule.code, ", ".join(unknown)))
+
+    def add_flags(self, parser):
+        "Add the flag selecting each rule to an argparse parser"
+        for rule in self.rules:
+            parser.add_argument("--" + rule.code.replace('_', '-'),
+                action = 'store_true',
+                help = rule.help
+            )
+
+    def select(self, args):
+        """The rules whose flag was given on the command line, all the
+        default ones if none was"""
+        selected = [rule for rule in self.rules
+                    if getattr(args, rule.code, False)]
+        return selected or [rule for rule in self.rules if rule.default]
+
+class RuleContext:
+    "What the rules need besides the record"
+
+    def __init__(self, transcripts = None, doid_validator = None,
+                 evi_type = "All", coordinate_index = None):
+        "Constructor"
+        self.transcripts = transcripts
+        #IntervalIndex of all the variants, for the rules comparing them
+        self.coordinate_index = coordinate_index
+        self.doid_validator = doid_validator
+        self.evi_type = evi_type
+        #DOIDs seen by the DOID rule that still need to be looked up
+        self.unresolved_doids = set()
+
+class RuleEngine:
+    "Runs a selection of rules on records"
+
+    def __init__(self, rules, context):
+        "Constructor"
+        self.rules = rules
+        self.context = context
+
+    @classmethod
+    def from_args(cls, registry, args, context):
+        "Engine running the rules selected on the command line"
+        return cls(registry.select(args), context)
+
+    def check(self, rule, record):
+        """Error mask of one rule on the record, the time spent in the rule
+        is recorded in the metrics"""
+        if not metrics.enabled:
+            return rule.check(record, self.context)
+        start = time.time()
+        errors = rule.check(record, self.context)
+        label = (rule.code,)
+        metrics.RULE_SECONDS.inc(label, time.time() - start)
+        metrics.RULE_CHECKS.inc(label)
+        if errors:
+            metrics.RULE_ERRORS.inc(label)
+        return errors
+
+    def run(self, record):
+        "Error mask of the record"
+        errors = 0
+        if metrics.enabled:
+            for rule in self.rules:
+                errors |= self.check(rule, record)
+            return errors
+        for rule in self.rules:
+            errors |= rule.check(record, self.context)
+        return errors
+
+VARIANT_RULES = RuleRegistry()
+EVIDENCE_RULES = RuleRegistry()
+# Rules comparing a variant to all the others, the variants are indexed in
+# RuleContext.coordinate_index before these rules run
+INDEX_RULES = frozenset(['overlapping_coords'])
+
+def needs_coordinate_index(rules):
+    "Does one of the rules need the coordinate index of all the variants"
+    return any(rule.code in INDEX_RULES for rule in rules)
+
+def has_coords(variant):
+    "Does the variant have the chr, start or stop defined"
+    return variant.chromosome or variant.start or variant.stop
+
+@VARIANT_RULES.register('no_variant_types', ['variant_types'],
+                        help = "Print variants with no variant_types defined")
+def no_variant_types(variant, context):
+    "Does the variant have a variant type defined"
+    if variant.variant_types == ():
+        return NO_VARIANT_TYPES
+    return 0
+
+@VARIANT_RULES.register('no_coords', ['chromosome', 'start', 'stop'],
+                        help = "Print variants with no coordinates defined")
+def no_coords(variant, context):
+    "Does the variant have the chr, start and stop defined"
+    if not has_coords(variant):
+        return NO_COORDINATE
+    return 0
+
+@VARIANT_RULES.register('wrong_coords', ['chromosome', 'start', 'stop',
+                                         'start2', 'stop2'],
+                        help = "Print variants where start > stop")
+def wrong_coords(variant, context):
+    "Does the variant have start > stop"
+    if not has_coords(variant):
+        return 0
+    try:
+        if int(variant.start) > int(variant.stop):
+            return WRONG_COORDINATES
+        if variant.start2 and variant.stop2 and \
+           int(variant.start2) > int(variant.stop2):
+            return WRONG_COORDINATES
+    except (TypeError, ValueError):
+        return WRONG_COORDINATES
+    return 0
+
+@VARIANT_RULES.register('wrong_base', ['chromosome2', 'start', 'stop',
+                                       'ref_base', 'var_base'],
+                        help = "Print variants where ref/var base is not in "
+                               "[A,C,G,T,N,None]")
+def wrong_base(variant, context):
+    "Are both the ref/variant base in [A,C,G,T,N,None]"
+    if variant.chromosome2 != None:
+        return 0
+    if variant.stop and variant.start:
+        var_len = int(variant.stop) - int(variant.start)
+        if var_len > MAX_BASE_CHECK_LENGTH:
+            return 0
+    if variant.ref_base not in ALLOWED_NUCS or \
+       variant.var_base not in ALLOWED_NUCS:
+        return WRONG_BASE
+    return 0
+
+def check_transcript(transcript, context):
+    "Is the representative transcript missing, malformed or unknown"
+    if transcript == None:
+        return NO_REP_TRANSCRIPT
+    if not TRANSCRIPT_PATTERN.match(transcript):
+        return WRONG_TRANSCRIPT_FORMAT
+    if context.transcripts is not None:
+        trans_id, version = transcript.split('.')[:2]
+        if not context.transcripts.is_valid(trans_id, version):
+            return INVALID_REP_TRANSCRIPT
+    return 0
+
+@VARIANT_RULES.register('rep_trans', ['representative_transcript',
+                                      'chromosome2',
+                                      'representative_transcript2'],
+                        help = "Print variants with no/wrong representative "
+                               "transcript")
+def rep_trans(variant, context):
+    "Check the representative transcript(s) of the variant"
+    errors = check_transcript(variant.representative_transcript, context)
+    if variant.chromosome2 != None:
+        errors |= check_transcript(variant.representative_transcript2,
+                                   context)
+    return errors
+
+@VARIANT_RULES.register('ensembl_version', ['representative_transcript',
+                                            'ensembl_version'],
+                        help = "Print variants with no/wrong ensembl database "
+                               "version")
+def ensembl_version(variant, context):
+    "Check if the ensembl version is missing"
+    if variant.representative_transcript == None:
+        return 0
+    if variant.ensembl_version == None:
+        return NO_ENSEMBL_VERSION
+    if type(variant.ensembl_version) is not int:
+        return WRONG_ENSEMBL_VERSION
+    return 0
+
+def same_coordinates(variant, other):
+    "Do two variants have the same coordinates and bases"
+    return (variant.chromosome, variant.start, variant.stop,
+            variant.chromosome2, variant.start2, variant.stop2,
+            variant.ref_base, variant.var_base) == \
+           (other.chromosome, other.start, other.stop,
+            other.chromosome2, other.start2, other.stop2,
+            other.ref_base, other.var_base)
+
+@VARIANT_RULES.register('overlapping_coords', ['id', 'gene_name',
+                                               'chromosome', 'start', 'stop',
+                                               'chromosome2', 'start2',
+                                               'stop2', 'ref_base',
+                                               'var_base'],
+                        default = False,
+                        help = "Print variants with the same coordinates as "
+                               "another variant, or\noverlapping a variant of "
+                               "another gene. Not run without the flag")
+def overlapping_coords(variant, context):
+    """Does another variant have the same coordinates and bases, or does a
+    variant of another gene overlap this one"""
+    errors = 0
+    for chromosome, start, stop in intervals.variant_intervals(variant):
+        for other in context.coordinate_index.overlapping(chromosome, start,
+                                                          stop):
+            if other.id == variant.id:
+                continue
+            if same_coordinates(variant, other):
+                errors |= DUPLICATE_COORDINATES
+            elif other.gene_name != variant.gene_name:
+                errors |= OVERLAPPING_COORDINATES
+    return errors
+
+@EVIDENCE_RULES.register('doid', ['disease'],
+                         help = "Print evidence-items with improper DOID (not "
+                                "defined on disease-ontology.org).")
+def doid(evidence_item, context):
+    """Is the DOID defined in the disease ontology. DOIDs that haven't been
+    looked up yet count as errors until they are resolved."""
+    doid = evidence_item['disease']['doid']
+    valid = context.doid_validator.is_valid(doid)
+    if valid:
+        return 0
+    if valid is None:
+        context.unresolved_doids.add(doid)
+    return WRONG_DOID
+
+@EVIDENCE_RULES.register('drug', ['drugs', 'evidence_type'],
+                         help = "Print predictive evidence-items without drug "
+                                "defined.")
+def drug(evidence_item, context):
+    "Check if evidence items of the --evi-type have drug information"
+    if context.evi_type != "All" and \
+       context.evi_type != evidence_item['evidence_type']:
+        return 0
+    drugs = evidence_item['drugs']
+    if len(drugs) == 1 and drugs[0]['name'] == "N/A":
+        return DRUG_NAME_NA
+    if not drugs:
+        return NO_DRUG
+    return 0
@@ -0,0 +1,244 @@
+"snapshot.py - Local snapshot of variant records for incremental runs"
+
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from response_cache import default_cache_dir
+
+class VariantSnapshot:
+    """SQLite store of the variant details from the last run, each saved
+    with the marker of the variant in the gene listing at the time. A
+    variant is refetched when its marker changes, or when it was saved
+    longer ago than the max age the caller allows: the gene listing
+    doesn't tell when the coordinates or evidence of a variant change."""
+
+    def __init__(self, snapshot_file):
+        "Constructor"
+        snapshot_dir = os.path.dirname(snapshot_file)
+        if snapshot_dir and not os.path.isdir(snapshot_dir):
+            os.makedirs(snapshot_dir)
+        self.lock = threading.Lock()
+        #Variants returned from the store so far
+        self.hits = 0
+        self.conn = sqlite3.connect(snapshot_file, check_same_thread = False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS variants ("
+                          "id INTEGER PRIMARY KEY, "
+                          "marker TEXT NOT NULL, "
+                          "detail BLOB NOT NULL, "
+                          "saved_at REAL NOT NULL DEFAULT 0)")
+        columns = [row[1] for row in
+                   self.conn.execute("PRAGMA table_info(variants)")]
+        if 'saved_at' not in columns:
+            # Snapshots of older versions, their variants count as expired
+            self.conn.execute("ALTER TABLE variants ADD COLUMN "
+                              "saved_at REAL NOT NULL DEFAULT 0")
+        self.conn.commit()
+
+    @classmethod
+    def from_args(cls, args):
+        "Open the snapshot if --incremental was given, None otherwise"
+        if not args.incremental:
+            return None
+        return cls(os.path.join(args.cache_dir or default_cache_dir(),
+                                'snapshot.sqlite'))
+
+    @staticmethod
+    def marker(variant):
+        """Marker of a variant in the gene listing, its modification time
+        when the API gives one and a hash of the listing entry otherwise"""
+        for key in ('updated_at', 'last_modified'):
+            if variant.get(key):
+                return str(variant[key])
+        return hashlib.sha1(json.dumps(variant, sort_keys = True)).hexdigest()
+
+    def get(self, variant_id, marker, max_age = None):
+        """Return the saved details, None if missing, the marker changed or
+        they were saved more than max_age seconds ago"""
+        with self.lock:
+            row = self.conn.execute("SELECT marker, detail, saved_at "
+                                    "FROM variants WHERE id = ?",
+                                    (variant_id,)).fetchone()
+        if row is None or row[0] != marker:
+            return None
+        if max_age is not None and time.time() - row[2] > max_age:
+            return None
+        with self.lock:
+            self.hits += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def put(self, variant_id, marker, variant_detail):
+        "Save the details of a variant fetched in this run"
+        detail = zlib.compress(json.dumps(variant_detail))
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO variants "
+                              "VALUES (?, ?, ?, ?)",
+                              (variant_id, marker, sqlite3.Binary(detail),
+                               time.time()))
+            self.conn.commit()
+
+    def prune(self, variant_ids):
+        "Drop the variants that are no longer in the gene listing"
+        keep = set(variant_ids)
+        with self.lock:
+            stored = [row[0] for row in
+                      self.conn.execute("SELECT id FROM variants")]
+            self.conn.executemany("DELETE FROM variants WHERE id = ?",
+                                  [(variant_id,) for variant_id in stored
+                                   if variant_id not in keep])
+            self.conn.commit()
+
+    def close(self):
+        "Close the database"
+        with self.lock:
+            self.conn.close()
+
+# Options that don't change which records a run fetches or what it
+# outputs, a run resumed with different ones picks up the same checkpoint
+CHECKPOINT_IGNORED_ARGS = ('resume', 'checkpoint_interval', 'checkpoint',
+                           'concurrency', 'retries', 'timeout', 'pool_size',
+                           'max_rate', 'workers', 'profile', 'refresh')
+
+def checkpoint_file(args, command):
+    """The checkpoint of a command with the options of args, None when the
+    variants are read from a dump or a mirror"""
+    if args.dump or getattr(args, 'db', None):
+        return None
+    options = sorted((name, value) for name, value in vars(args).items()
+                     if name not in CHECKPOINT_IGNORED_ARGS)
+    digest = hashlib.sha1(command + repr(options)).hexdigest()[:16]
+    return os.path.join(args.cache_dir or default_cache_dir(), 'checkpoints',
+                        command + '-' + digest + '.sqlite')
+
+def lock_holder(lock_file):
+    """PID of the live process holding a lock file, None if the process
+    that created it is gone"""
+    try:
+        with open(lock_file) as lock:
+            pid = int(lock.read())
+    except (IOError, ValueError):
+        # Missing, or being written by the process taking it
+        return -1 if os.path.exists(lock_file) else None
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return None
+    return pid
+
+class Checkpointing:
+    """Context manager claiming the checkpoint of a command line run, the
+    only callers that checkpoint their crawls. Sets args.checkpoint to the
+    file of the checkpoint, guarded by a lock file so that only one run of
+    the same command and options uses it. The checkpoint is removed if the
+    block completes and kept for --resume otherwise."""
+
+    def __init__(self, args, command):
+        "Constructor"
+        self.args = args
+        self.path = checkpoint_file(args, command)
+        self.lock_file = None
+
+    def __enter__(self):
+        self.args.checkpoint = None
+        if self.path is None or self.args.no_cache or \
+           self.args.checkpoint_interval <= 0:
+            return self
+        checkpoint_dir = os.path.dirname(self.path)
+        if not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        if not self.claim(self.path + '.lock'):
+            print >> sys.stderr, "The checkpoint is used by another run " \
+                                 "of the same command, not checkpointing"
+            return self
+        if not self.args.resume and os.path.exists(self.path):
+            os.remove(self.path)
+        elif self.args.resume and not os.path.exists(self.path):
+            print >> sys.stderr, "No checkpoint to resume from, " \
+                                 "fetching every variant"
+        self.args.checkpoint = self.path
+        return self
+
+    def claim(self, lock_file):
+        "Create the lock file, False if a live process holds it"
+        for _ in range(2):
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST or lock_holder(lock_file):
+                    return False
+                # Left by a run that was killed
+                try:
+                    os.remove(lock_file)
+                except OSError:
+                    pass
+                continue
+            os.write(fd, str(os.getpid()))
+            os.close(fd)
+            self.lock_file = lock_file
+            return True
+        return False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.args.checkpoint is not None and exc_type is None and \
+           os.path.exists(self.path):
+            os.remove(self.path)
+        if self.lock_file is not None:
+            os.remove(self.lock_file)
+        self.args.checkpoint = None
+
+class Checkpoint(VariantSnapshot):
+    """The variant details fetched by a crawl that didn't complete yet,
+    committed every interval seconds. A run with --resume reads the
+    variants that didn't change from it instead of fetching them again."""
+
+    def __init__(self, checkpoint_file, interval, resume = True):
+        "Constructor"
+        VariantSnapshot.__init__(self, checkpoint_file)
+        self.interval = interval
+        self.committed = time.time()
+        # A new checkpoint has nothing to look up
+        self.resume = resume
+
+    @classmethod
+    def from_args(cls, args):
+        """Open the checkpoint claimed by Checkpointing, None if the run
+        doesn't checkpoint"""
+        path = getattr(args, 'checkpoint', None)
+        if path is None:
+            return None
+        return cls(path, args.checkpoint_interval, args.resume)
+
+    def get(self, variant_id, marker, max_age = None):
+        "Return the saved details, None if missing or the marker changed"
+        if not self.resume:
+            return None
+        return VariantSnapshot.get(self, variant_id, marker, max_age)
+
+    def put(self, variant_id, marker, variant_detail):
+        "Save the details of a variant, committed with the next checkpoint"
+        # Fastest compression, every command line crawl writes one
+        detail = zlib.compress(json.dumps(variant_detail), 1)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO variants "
+                              "VALUES (?, ?, ?, ?)",
+                              (variant_id, marker, sqlite3.Binary(detail),
+                               time.time()))
+            if time.time() - self.committed >= self.interval:
+                self.conn.commit()
+                self.committed = time.time()
+
+    def prune(self, variant_ids):
+        "The checkpoint is removed by Checkpointing at the end instead"
+
+    def close(self):
+        "Commit the variants saved since the last checkpoint and close"
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
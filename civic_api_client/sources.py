@@ -0,0 +1,412 @@
+"sources.py - Where the listers get their variant details from"
+
+import csv
+import glob
+import gzip
+import itertools
+import json
+import os
+import sys
+
+import requests
+
+import metrics
+import utils
+from snapshot import Checkpoint, VariantSnapshot
+from variant_index import VariantIndex
+
+# Columns of the bulk TSV dumps holding the variant coordinates
+COORDINATE_COLUMNS = [
+    'chromosome',
+    'start',
+    'stop',
+    'reference_bases',
+    'variant_bases',
+    'representative_transcript',
+    'chromosome2',
+    'start2',
+    'stop2',
+    'representative_transcript2',
+    'ensembl_version',
+    'reference_build',
+]
+# Fields of the evidence items every source gives, in the shape of the API
+EVIDENCE_FIELDS = [
+    'id',
+    'evidence_type',
+    'evidence_direction',
+    'clinical_significance',
+    'description',
+    'pubmed_id',
+    'citation',
+    'rating',
+    'status',
+    'variant_origin',
+    'disease',
+    'drugs',
+]
+# Fields of the variants that only the VariantSummaries TSV of a dump has
+VARIANT_SUMMARY_FIELDS = [
+    'variant_types',
+]
+# Columns of the bulk TSV dumps holding whole numbers
+INTEGER_COLUMNS = set([
+    'variant_id',
+    'gene_id',
+    'entrez_id',
+    'evidence_id',
+    'start',
+    'stop',
+    'start2',
+    'stop2',
+    'ensembl_version',
+    'rating',
+])
+
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+def open_source(args, client):
+    """The source chosen on the command line, the CIVIC API unless --dump
+    or --db"""
+    if getattr(args, 'dump', None):
+        return DumpSource(args.dump)
+    if getattr(args, 'db', None):
+        # mirror imports this module
+        from mirror import MirrorSource
+        return MirrorSource(args.db, getattr(args, 'evi_type', "All"))
+    return ApiSource(args, client)
+
+class ApiSource:
+    """Variant details from the CIVIC REST API, one request per variant on
+    top of the paged gene listing"""
+
+    def __init__(self, args, client):
+        "Constructor"
+        self.args = args
+        self.client = client
+        #Variant IDs of the gene listing and the gene of each variant
+        self.variant_index = None
+        #Snapshot of the last run, used with --incremental
+        self.snapshot = None
+
+    def get_gene_page(self, page, page_size):
+        "Get one page of the gene listing"
+        genes_url = utils.civic_api_url() + 'genes?count=' + str(page_size) + \
+                    '&page=' + str(page)
+        return self.client.get_json(genes_url)
+
+    def iter_civic_genes(self):
+        """Yield the genes in CIVIC page by page, stopping after
+        --max-gene-count genes. The pages after the first are fetched
+        concurrently once the first one tells how many there are."""
+        max_genes = self.args.max_gene_count
+        if max_genes <= 0:
+            return
+        page_size = min(self.args.gene_page_size, max_genes)
+        first_page = self.get_gene_page(1, page_size)
+        total_pages = first_page.get('_meta', {}).get('total_pages', 1)
+        last_page = min(total_pages, (max_genes + page_size - 1) // page_size)
+        other_pages = utils.fetch_concurrently(
+            lambda page: self.get_gene_page(page, page_size),
+            range(2, last_page + 1),
+            self.args.concurrency)
+        gene_count = 0
+        for genes_page in itertools.chain([first_page], other_pages):
+            for gene in genes_page['records']:
+                if gene_count >= max_genes:
+                    return
+                gene_count += 1
+                yield gene
+
+    def get_civic_genes(self):
+        """Get a list of genes from CIVIC, sorted by gene ID so that the
+        variants come out in the same order whatever the order of the
+        pages"""
+        with metrics.stage("gene_listing"):
+            self.variant_index = VariantIndex(sorted(self.iter_civic_genes(),
+                key = lambda gene: int(gene['id'])))
+
+    def get_variant_ids(self):
+        "Get a list of variants using a list of genes"
+        return self.variant_index.variant_ids
+
+    def add_gene_metadata(self, variant_detail):
+        "Fill in the gene of the variant from the gene listing if missing"
+        if self.variant_index is None:
+            return
+        gene = self.variant_index.gene(variant_detail['id'])
+        for key in gene:
+            if variant_detail.get(key) is None:
+                variant_detail[key] = gene[key]
+
+    def get_variant_details(self, variant_id):
+        """Get the details for a variant given an ID, None if it was removed
+        since the gene listing was read. Other error responses left after
+        the retries stop the run."""
+        variant_url = utils.civic_api_url() + 'variants/' + str(variant_id)
+        try:
+            variant_detail = self.client.get_json(variant_url)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            print >> sys.stderr, "Skipping variant", variant_id, \
+                                 "not found in CIVIC"
+            return None
+        if 'id' not in variant_detail:
+            variant_detail['id'] = variant_id
+        self.add_gene_metadata(variant_detail)
+        return variant_detail
+
+    def get_changed_variant_details(self, variant_id):
+        """Get the details for a variant from the snapshot if it didn't
+        change since the last run and was saved less than
+        --snapshot-max-age hours ago, from CIVIC otherwise. Returns None for
+        unchanged variants with --changed-only, the ones refetched because
+        of their age included."""
+        changed_only = self.args.incremental and self.args.changed_only
+        max_age = None
+        if self.args.incremental:
+            max_age = self.args.snapshot_max_age * 60 * 60
+        variant = self.variant_index.variants[variant_id]
+        marker = VariantSnapshot.marker(variant)
+        variant_detail = self.snapshot.get(variant_id, marker, max_age)
+        if variant_detail is not None:
+            if changed_only:
+                return None
+            return variant_detail
+        variant_detail = self.get_variant_details(variant_id)
+        if variant_detail is None:
+            return None
+        unchanged = changed_only and \
+                    self.snapshot.get(variant_id, marker) == variant_detail
+        self.snapshot.put(variant_id, marker, variant_detail)
+        if unchanged:
+            return None
+        return variant_detail
+
+    def fetch_variant_details(self, variant_ids):
+        """Fetch the details for a list of variant IDs, in the same order.
+        They're saved to the --incremental snapshot, or to the checkpoint a
+        run with --resume reads them back from."""
+        self.snapshot = VariantSnapshot.from_args(self.args) or \
+                        Checkpoint.from_args(self.args)
+        if self.snapshot is None:
+            return (variant_detail for variant_detail in
+                    utils.fetch_concurrently(self.get_variant_details,
+                                             variant_ids,
+                                             self.args.concurrency)
+                    if variant_detail is not None)
+        return self.fetch_changed_variant_details(variant_ids)
+
+    def fetch_changed_variant_details(self, variant_ids):
+        "Fetch only the variants that changed since the last run"
+        try:
+            for variant_detail in utils.fetch_concurrently(
+                    self.get_changed_variant_details,
+                    variant_ids,
+                    self.args.concurrency):
+                if variant_detail is not None:
+                    yield variant_detail
+            self.snapshot.prune(variant_ids)
+            if self.args.incremental:
+                print >> sys.stderr, "%d of %d variants read from the " \
+                      "snapshot, saved less than %g hours ago" % \
+                      (self.snapshot.hits, len(variant_ids),
+                       self.args.snapshot_max_age)
+        finally:
+            self.snapshot.close()
+
+    def iter_variant_details(self, variant_rules = None,
+                             evidence_rules = None):
+        """Details of every variant in CIVIC, in the order of the gene
+        listing. The rules the caller runs are ignored, every variant has
+        to be fetched anyway."""
+        self.get_civic_genes()
+        return self.fetch_variant_details(self.get_variant_ids())
+
+def check_dump_rules(parser, args, registry):
+    """Error out if a rule of the registry given on the command line reads
+    fields the --dump doesn't have, warn if a default rule does as it then
+    finds nothing"""
+    if not getattr(args, 'dump', None):
+        return
+    missing = DumpSource(args.dump).missing_fields()
+    for rule in registry.select(args):
+        fields = [field for field in rule.fields if field in missing]
+        if not fields:
+            continue
+        message = "the --dump has no %s, the %s check needs the " \
+                  "VariantSummaries TSV" % (", ".join(fields), rule.code)
+        if getattr(args, rule.code, False):
+            parser.error(message)
+        print >> sys.stderr, "Warning: %s, it reports nothing without it" % \
+                             message
+
+def open_dump_file(path):
+    "Open a dump file for reading, gzipped or not"
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+def tsv_columns(path):
+    "The column names of a TSV dump"
+    handle = open_dump_file(path)
+    try:
+        return handle.readline().rstrip('\r\n').split('\t')
+    finally:
+        handle.close()
+
+def read_tsv(path):
+    "Yield the rows of a TSV dump as dicts, with typed values"
+    handle = open_dump_file(path)
+    try:
+        for row in csv.DictReader(handle, delimiter = '\t'):
+            yield dict((column, parse_value(column, value))
+                       for column, value in row.items())
+    finally:
+        handle.close()
+
+def parse_value(column, value):
+    "Value of a TSV field, None when empty"
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if value is None or value in (u'', u'None'):
+        return None
+    if column in INTEGER_COLUMNS and value.isdigit():
+        return int(value)
+    return value
+
+def split_names(value):
+    "Turn a comma separated list into a list of {'name': ...} records"
+    if not value:
+        return []
+    return [{'name': name.strip()} for name in value.split(',') if name.strip()]
+
+def variant_from_row(row):
+    "Variant details in the shape of the API from a TSV row"
+    variant_detail = {
+        'id': row.get('variant_id'),
+        'name': row.get('variant'),
+        'entrez_name': row.get('gene'),
+        'entrez_id': row.get('entrez_id'),
+        'gene_id': row.get('gene_id'),
+        'description': row.get('summary') or row.get('variant_summary'),
+        'coordinates': dict((column, row.get(column))
+                            for column in COORDINATE_COLUMNS),
+        'variant_types': None,
+        'evidence_items': [],
+    }
+    if 'variant_types' in row:
+        variant_detail['variant_types'] = split_names(row['variant_types'])
+    return variant_detail
+
+def evidence_from_row(row):
+    "Evidence item in the shape of the API from a TSV row"
+    return {
+        'id': row.get('evidence_id'),
+        'evidence_type': row.get('evidence_type'),
+        'evidence_direction': row.get('evidence_direction'),
+        'clinical_significance': row.get('clinical_significance'),
+        'description': row.get('evidence_statement'),
+        'pubmed_id': row.get('pubmed_id') or row.get('citation_id'),
+        'citation': row.get('citation'),
+        'rating': row.get('rating'),
+        'status': row.get('evidence_status') or 'accepted',
+        'variant_origin': row.get('variant_origin'),
+        'disease': {'name': row.get('disease'), 'doid': row.get('doid')},
+        'drugs': split_names(row.get('drugs')),
+    }
+
+class DumpSource:
+    """Variant details from a local CIVIC bulk dump, so the checks and the
+    exports can run without network access. The dump is either:
+    - a directory with the nightly VariantSummaries and
+      ClinicalEvidenceSummaries TSVs,
+    - a ClinicalEvidenceSummaries TSV alone, the variants are then built
+      from the coordinates in the evidence rows,
+    - a JSON file with a list of variants as returned by the API, or a
+      JSON lines file with one such variant per line.
+    Files can be gzipped."""
+
+    def __init__(self, dump_path):
+        "Constructor"
+        self.dump_path = dump_path
+
+    def find_dump_file(self, pattern):
+        "The file of the dump directory matching a pattern, None if missing"
+        matches = sorted(glob.glob(os.path.join(self.dump_path, pattern)))
+        if matches:
+            return matches[-1]
+        return None
+
+    def missing_fields(self):
+        """The VARIANT_SUMMARY_FIELDS the variants of the dump don't have,
+        those of a TSV dump without a VariantSummaries TSV"""
+        path = self.dump_path
+        if os.path.isdir(path):
+            variant_file = self.find_dump_file('*VariantSummaries*.tsv*')
+        else:
+            name = path[:-3] if path.endswith('.gz') else path
+            if not name.endswith('.tsv'):
+                return []
+            variant_file = None
+        columns = tsv_columns(variant_file) if variant_file else []
+        return [field for field in VARIANT_SUMMARY_FIELDS
+                if field not in columns]
+
+    def iter_variant_details(self, variant_rules = None,
+                             evidence_rules = None):
+        "Details of every variant in the dump, the rules are ignored"
+        path = self.dump_path
+        if os.path.isdir(path):
+            evidence_file = self.find_dump_file('*ClinicalEvidenceSummaries*.tsv*')
+            if evidence_file is None:
+                raise IOError("No ClinicalEvidenceSummaries TSV in " + path)
+            return self.iter_tsv_variant_details(
+                self.find_dump_file('*VariantSummaries*.tsv*'), evidence_file)
+        name = path[:-3] if path.endswith('.gz') else path
+        if name.endswith('.tsv'):
+            return self.iter_tsv_variant_details(None, path)
+        if name.endswith('.jsonl'):
+            return self.iter_jsonl_variant_details(path)
+        return self.iter_json_variant_details(path)
+
+    def iter_tsv_variant_details(self, variant_file, evidence_file):
+        """Join the evidence rows to their variants. The evidence is read
+        first, then the variants are streamed from variant_file if given."""
+        evidence_items = {}
+        variants = []
+        for row in read_tsv(evidence_file):
+            variant_id = row.get('variant_id')
+            if variant_id not in evidence_items:
+                evidence_items[variant_id] = []
+                if variant_file is None:
+                    variants.append(variant_from_row(row))
+            evidence_items[variant_id].append(evidence_from_row(row))
+        if variant_file is not None:
+            variants = (variant_from_row(row) for row in read_tsv(variant_file))
+        for variant_detail in variants:
+            variant_detail['evidence_items'] = \
+                evidence_items.pop(variant_detail['id'], [])
+            yield variant_detail
+
+    def iter_jsonl_variant_details(self, path):
+        "Stream the variants of a JSON lines dump"
+        handle = open_dump_file(path)
+        try:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            handle.close()
+
+    def iter_json_variant_details(self, path):
+        "The variants of a JSON dump, a list or a {'records': [...]} object"
+        handle = open_dump_file(path)
+        try:
+            records = json.load(handle)
+        finally:
+            handle.close()
+        if isinstance(records, dict):
+            records = records.get('records', [])
+        return iter(records)
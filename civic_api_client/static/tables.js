@@ -0,0 +1,132 @@
+/*
+  Tables of the web view, loaded a page at a time from the JSON API.
+
+  loadTable(options) fills the table with id options.table from
+  options.api, options.columns lists the columns as {key, label, link}
+  and options.filters the filter columns shown as drop downs.
+*/
+
+function loadTable(options) {
+    var state = {offset: 0, limit: 100, sort: null, order: 'asc', filters: {}};
+    var table = document.getElementById(options.table);
+    var pager = document.getElementById(options.table + '_pager');
+    var filterBar = document.getElementById(options.table + '_filters');
+
+    function cell(tag, text) {
+        var element = document.createElement(tag);
+        element.appendChild(document.createTextNode(text === null ? 'NA' : text));
+        return element;
+    }
+
+    function renderHeader() {
+        var row = document.createElement('tr');
+        options.columns.forEach(function(column) {
+            var label = column.label;
+            if (state.sort === column.key) {
+                label += state.order === 'asc' ? ' (asc)' : ' (desc)';
+            }
+            var th = cell('th', label);
+            th.style.cursor = 'pointer';
+            th.onclick = function() {
+                if (state.sort === column.key) {
+                    state.order = state.order === 'asc' ? 'desc' : 'asc';
+                } else {
+                    state.sort = column.key;
+                    state.order = 'asc';
+                }
+                state.offset = 0;
+                fetchPage();
+            };
+            row.appendChild(th);
+        });
+        return row;
+    }
+
+    function renderRow(data) {
+        var row = document.createElement('tr');
+        options.columns.forEach(function(column) {
+            var td = document.createElement('td');
+            var value = data[column.key];
+            if (column.link && value) {
+                var a = document.createElement('a');
+                a.href = value;
+                a.appendChild(document.createTextNode(value));
+                td.appendChild(a);
+            } else {
+                td.appendChild(document.createTextNode(value === null ? 'NA' : value));
+            }
+            row.appendChild(td);
+        });
+        return row;
+    }
+
+    function renderFilters(facets) {
+        if (filterBar.childNodes.length) {
+            return;
+        }
+        options.filters.forEach(function(filter) {
+            var select = document.createElement('select');
+            var all = document.createElement('option');
+            all.value = '';
+            all.text = filter.label + ': all';
+            select.appendChild(all);
+            (facets[filter.key] || []).forEach(function(value) {
+                var option = document.createElement('option');
+                option.value = option.text = value;
+                select.appendChild(option);
+            });
+            select.onchange = function() {
+                state.filters[filter.key] = select.value;
+                state.offset = 0;
+                fetchPage();
+            };
+            filterBar.appendChild(select);
+        });
+    }
+
+    function renderPager(data) {
+        pager.innerHTML = '';
+        var last = Math.min(data.offset + data.rows.length, data.total);
+        pager.appendChild(document.createTextNode(
+            (data.total ? data.offset + 1 : 0) + '-' + last + ' of ' + data.total + ' '));
+        [['Previous', data.offset > 0, data.offset - state.limit],
+         ['Next', last < data.total, data.offset + state.limit]].forEach(function(button) {
+            var input = document.createElement('input');
+            input.type = 'button';
+            input.value = button[0];
+            input.disabled = !button[1];
+            input.onclick = function() {
+                state.offset = Math.max(button[2], 0);
+                fetchPage();
+            };
+            pager.appendChild(input);
+        });
+    }
+
+    function fetchPage() {
+        var params = ['offset=' + state.offset, 'limit=' + state.limit];
+        if (state.sort) {
+            params.push('sort=' + state.sort, 'order=' + state.order);
+        }
+        for (var key in state.filters) {
+            if (state.filters[key]) {
+                params.push(key + '=' + encodeURIComponent(state.filters[key]));
+            }
+        }
+        var request = new XMLHttpRequest();
+        request.open('GET', options.api + '?' + params.join('&'));
+        request.onload = function() {
+            var data = JSON.parse(request.responseText);
+            table.innerHTML = '';
+            table.appendChild(renderHeader());
+            data.rows.forEach(function(row) {
+                table.appendChild(renderRow(row));
+            });
+            renderFilters(data.facets);
+            renderPager(data);
+        };
+        request.send();
+    }
+
+    fetchPage();
+}
@@ -0,0 +1,84 @@
+"transcript_index.py - Lookup of valid Ensembl transcripts"
+
+import gzip
+import os
+import sqlite3
+
+# Columns of the transcript ID and version in Ensembl's transcript.txt.gz
+TRANS_ID_COLUMN = 14
+VERSION_COLUMN = 15
+
+class TranscriptIndex:
+    """The (transcript ID, version) pairs of the valid Ensembl transcripts,
+    loaded once per run and shared by all the variants"""
+
+    def __init__(self, transcripts):
+        "Constructor"
+        self.transcripts = transcripts
+
+    def __len__(self):
+        return len(self.transcripts)
+
+    def is_valid(self, trans_id, version):
+        "Is the transcript with this version in the reference"
+        return (trans_id, version) in self.transcripts
+
+    @classmethod
+    def from_transcript_file(cls, transcript_file):
+        "Read the pairs from an Ensembl transcript.txt.gz"
+        transcripts = set()
+        reference = gzip.open(transcript_file, 'rb')
+        try:
+            for line in reference:
+                fields = line.split()
+                transcripts.add((fields[TRANS_ID_COLUMN],
+                                 fields[VERSION_COLUMN]))
+        finally:
+            reference.close()
+        return cls(transcripts)
+
+    @classmethod
+    def from_index_file(cls, index_file):
+        "Read the pairs from an index written by write_index_file"
+        conn = sqlite3.connect(index_file)
+        try:
+            rows = conn.execute("SELECT trans_id, version FROM transcripts")
+            transcripts = set((str(trans_id), str(version))
+                              for trans_id, version in rows)
+        finally:
+            conn.close()
+        return cls(transcripts)
+
+    def write_index_file(self, index_file):
+        "Save the pairs to a SQLite file so they can be reused by later runs"
+        tmp_file = index_file + ".tmp"
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        conn = sqlite3.connect(tmp_file)
+        try:
+            conn.execute("CREATE TABLE transcripts ("
+                         "trans_id TEXT NOT NULL, "
+                         "version TEXT NOT NULL, "
+                         "PRIMARY KEY (trans_id, version))")
+            conn.executemany("INSERT INTO transcripts VALUES (?, ?)",
+                             sorted(self.transcripts))
+            conn.commit()
+        finally:
+            conn.close()
+        os.rename(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, transcript_file = None, index_file = None):
+        """Load the valid transcripts, using index_file when it is up to
+        date with transcript_file and (re)building it otherwise"""
+        if index_file and os.path.exists(index_file):
+            if not transcript_file or \
+               os.path.getmtime(index_file) >= \
+               os.path.getmtime(transcript_file):
+                return cls.from_index_file(index_file)
+        if not transcript_file:
+            return None
+        index = cls.from_transcript_file(transcript_file)
+        if index_file:
+            index.write_index_file(index_file)
+        return index
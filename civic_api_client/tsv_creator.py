@@ -9,97 +9,132 @@ import sys
 import time
 
 import civic_api_client
+import metrics
 import utils
-from variants_lister import VariantsLister, VariantDetails
-from evidence_items_lister import EvidenceItems, EvidenceItemsLister
+import writers
+from variants_lister import VariantsLister
+from snapshot import Checkpointing
+from sources import COORDINATE_COLUMNS
 
-class TsvEvidenceItmes:
-    """What will be listed in tsv file"""
+# Columns of the export, in order, the field of TsvEvidenceItmes holding
+# each of them and its type in the typed formats
+TSV_COLUMNS = [writers.Column(name, attribute, kind)
+               for name, attribute, kind in [
+    ('gene', 'gene_name', writers.CATEGORY),
+    ('entrez_id', 'entrez_id', writers.INT),
+    ('variant', 'variant_name', writers.STRING),
+    ('disease', 'disease_name', writers.CATEGORY),
+    ('doid', 'doid', writers.CATEGORY),
+    ('drugs', 'drug_names', writers.STRING),
+    ('evidence_type', 'evi_type', writers.CATEGORY),
+    ('evidence_direction', 'evi_dir', writers.CATEGORY),
+    ('clinical_significance', 'cli_sig', writers.CATEGORY),
+    ('evidence_statement', 'evi_summary', writers.STRING),
+    ('pubmed_id', 'pub_id', writers.STRING),
+    ('citation', 'citation', writers.STRING),
+    ('rating', 'rating', writers.INT),
+    ('evidence_status', 'evi_status', writers.CATEGORY),
+    ('evidence_id', 'evi_id', writers.INT),
+    ('variant_id', 'var_id', writers.INT),
+    ('gene_id', 'gene_id', writers.INT),
+    ('chromosome', 'chromosome', writers.CATEGORY),
+    ('start', 'start', writers.INT),
+    ('stop', 'stop', writers.INT),
+    ('reference_bases', 'reference_bases', writers.STRING),
+    ('variant_bases', 'variant_bases', writers.STRING),
+    ('representative_transcript', 'representative_transcript',
+     writers.STRING),
+    ('chromosome2', 'chromosome2', writers.CATEGORY),
+    ('start2', 'start2', writers.INT),
+    ('stop2', 'stop2', writers.INT),
+    ('representative_transcript2', 'representative_transcript2',
+     writers.STRING),
+    ('ensembl_version', 'ensembl_version', writers.INT),
+    ('reference_build', 'reference_build', writers.CATEGORY),
+    ('variant_summary', 'var_summary', writers.STRING),
+    ('variant_origin', 'var_ori', writers.CATEGORY),
+    ('evidence_civic_url', 'evidence_civic_url', writers.STRING),
+    ('variant_civic_url', 'variant_civic_url', writers.STRING),
+    ('gene_civic_url', 'gene_civic_url', writers.STRING),
+]]
 
-    def __init__(self, variant_details, evidence_items):
-        "Constructor"
+class TsvEvidenceItmes(object):
+    """What will be listed in tsv file"""
+    __slots__ = (
         # Exist columns
-        self.gene_name = None 
-        self.entrez_id = None 
-        self.variant_name = None
-        self.disease_name = None
-        self.doid = None 
-        self.drug_names = None  
-        self.evi_type = None
-        self.evi_dir = None
-        self.cli_sig = None
-        self.evi_summary = None 
-        self.pub_id = None
-        self.citation = None 
-        self.rating = None
-
+        'gene_name',
+        'entrez_id',
+        'variant_name',
+        'disease_name',
+        'doid',
+        'drug_names',
+        'evi_type',
+        'evi_dir',
+        'cli_sig',
+        'evi_summary',
+        'pub_id',
+        'citation',
+        'rating',
         # Added columns
-        self.evi_status = None
-        self.evi_id = None
-        self.var_id = None     
-        self.gene_id = None
-        self.coordinates = None 
-        self.var_summary = None 
-        self.var_ori = None
-        self.evidence_civic_url = EvidenceItems.define_evidence_url(variant_details,evidence_items)
-        self.variant_civic_url = VariantDetails.define_civic_url(variant_details)
-        self.gene_civic_url = self.define_gene_url(variant_details)
+        'evi_status',
+        'evi_id',
+        'var_id',
+        'gene_id',
+        'var_summary',
+        'var_ori',
+    ) + tuple(COORDINATE_COLUMNS)
 
+    def __init__(self, variant_details, evidence_items):
+        "Constructor"
         self.parse_variant_details(variant_details)
         self.parse_evidence_details(evidence_items)
 
-    def define_gene_url(self, variant_details):
-        "Define the CIVIC URL for the gene"
-        if 'gene_id' not in variant_details:
-            variant_details['gene_id'] = "NA"
-        return "https://civic.genome.wustl.edu/#/events/genes/" + \
-               str(variant_details['gene_id']) + "/summary#gene/" 
+    @property
+    def evidence_civic_url(self):
+        "The CIVIC URL for the evidence"
+        return utils.civic_evidence_url(self.gene_id, self.var_id, self.evi_id)
+
+    @property
+    def variant_civic_url(self):
+        "The CIVIC URL for the variant"
+        return utils.civic_variant_url(self.gene_id, self.var_id)
+
+    @property
+    def gene_civic_url(self):
+        "The CIVIC URL for the gene"
+        return utils.civic_gene_url(self.gene_id)
 
     def parse_variant_details(self, variant_details):
         "Parse Variant Details into class members"
-        if 'entrez_id' in variant_details:
-            self.entrez_id = variant_details['entrez_id']
-        if 'entrez_name' in variant_details:
-            self.gene_name = variant_details['entrez_name']
-        if 'name' in variant_details:
-            self.variant_name = variant_details['name']       
-        if 'id' in variant_details:
-            self.var_id = variant_details['id']
-        if 'gene_id' in variant_details:
-            self.gene_id = variant_details['gene_id']
-        if 'coordinates' in variant_details:
-            self.coordinates = variant_details['coordinates'] 
-        if 'description' in variant_details:
-            self.var_summary = variant_details['description']
+        self.entrez_id = variant_details.get('entrez_id')
+        self.gene_name = utils.intern_value(variant_details.get('entrez_name'))
+        self.variant_name = variant_details.get('name')
+        self.var_id = variant_details.get('id')
+        self.gene_id = variant_details.get('gene_id', "NA")
+        self.var_summary = variant_details.get('description')
+        coordinates = variant_details.get('coordinates') or {}
+        for column in COORDINATE_COLUMNS:
+            setattr(self, column, utils.intern_value(coordinates.get(column)))
 
     def parse_evidence_details(self, evidence_items):
         "Parse evidence details into class members"
-        if 'id' in evidence_items:
-            self.evi_id = evidence_items['id']
-        if 'evidence_type' in evidence_items:
-            self.evi_type = evidence_items['evidence_type']
+        get = evidence_items.get
+        self.evi_id = get('id')
+        self.evi_type = utils.intern_value(get('evidence_type'))
+        self.drug_names = None
         if 'drugs' in evidence_items:
             self.drug_names = self.list_all_drugs(evidence_items['drugs'])
-        if 'disease' in evidence_items:
-            self.disease_name = evidence_items['disease']['name']
-        if 'doid' in evidence_items['disease']:
-            self.doid = evidence_items['disease']['doid']
-        if 'evidence_direction' in evidence_items:
-            self.evi_dir = evidence_items['evidence_direction']
-        if 'clinical_significance' in evidence_items:
-            self.cli_sig = evidence_items['clinical_significance']
-        if 'description' in evidence_items:
-            self.evi_summary = evidence_items['description']
-        if 'pubmed_id' in evidence_items:
-            self.pub_id = evidence_items['pubmed_id']
-        if 'citation' in evidence_items:
-            self.citation = evidence_items['citation']
-        if 'rating' in evidence_items:
-            self.rating = evidence_items['rating']
-        if 'status' in evidence_items:
-            self.evi_status = evidence_items['status']
-        if 'variant_origin' in evidence_items:
-            self.var_ori = evidence_items['variant_origin']
+        disease = get('disease') or {}
+        self.disease_name = utils.intern_value(disease.get('name'))
+        self.doid = utils.intern_value(disease.get('doid'))
+        self.evi_dir = utils.intern_value(get('evidence_direction'))
+        self.cli_sig = utils.intern_value(get('clinical_significance'))
+        self.evi_summary = get('description')
+        self.pub_id = get('pubmed_id')
+        self.citation = get('citation')
+        self.rating = get('rating')
+        self.evi_status = utils.intern_value(get('status'))
+        self.var_ori = utils.intern_value(get('variant_origin'))
 
     def list_all_drugs(self,drugs_list):
         drugs = []
@@ -121,54 +156,15 @@ class TsvEvidenceItmes:
         pubchem_id_str.join(pubchem_ids)
         return pubchem_id_str
 
-    def make_str_for_print(self):
-        "give row string for print out"
-        row_string= self.gene_name+"\t"+  \
-                    repr(self.entrez_id)+"\t"+ \
-                    repr(self.variant_name)+"\t"+ \
-                    repr(self.disease_name)+"\t"+ \
-                    repr(self.doid)+"\t"+ \
-                    repr(self.drug_names)+"\t"+ \
-                    repr(self.evi_type)+"\t"+ \
-                    repr(self.evi_dir)+"\t"+\
-                    repr(self.cli_sig)+"\t"+ \
-                    repr(self.evi_summary)+"\t"+\
-                    repr(self.pub_id)+"\t"+ \
-                    repr(self.citation)+"\t"+ \
-                    repr(self.rating)+"\t"+ \
-                    repr(self.evi_status)+"\t"+ \
-                    repr(self.evi_id)+"\t"+ \
-                    repr(self.var_id)+"\t"+ \
-                    repr(self.gene_id)+"\t"+ \
-                    repr(self.coordinates['chromosome'])+"\t"+ \
-                    repr(self.coordinates['start'])+"\t"+ \
-                    repr(self.coordinates['stop'])+"\t"+ \
-                    repr(self.coordinates['reference_bases'])+"\t"+ \
-                    repr(self.coordinates['variant_bases'])+"\t"+ \
-                    repr(self.coordinates['representative_transcript'])+"\t"+ \
-                    repr(self.coordinates['chromosome2'])+"\t"+ \
-                    repr(self.coordinates['start2'])+"\t"+ \
-                    repr(self.coordinates['stop2'])+"\t"+ \
-                    repr(self.coordinates['representative_transcript2'])+"\t"+ \
-                    repr(self.coordinates['ensembl_version'])+"\t"+ \
-                    repr(self.coordinates['reference_build'])+"\t"+ \
-                    repr(self.var_summary)+"\t"+ \
-                    repr(self.var_ori)+"\t"+ \
-                    repr(self.evidence_civic_url)+"\t"+ \
-                    repr(self.variant_civic_url)+"\t"+ \
-                    repr(self.gene_civic_url)+"\n"
-        row_u_remove = row_string.replace('u\'','')
-        row_remove2 = row_u_remove.replace('u\"','')
-        row_remove3 = row_remove2.replace('\"','')
-        row = row_remove3.replace('\'','')
-        return row         
-    
 
 class TsvFileLister:
     """List the evidence-items in CIVIC to tsv file"""
-    def __init__(self, args):
+    def __init__(self, args, client = None):
         "Constructor"
         self.args = args
+        self.client = client
+        #Columns of the tsv file, chosen with --columns
+        self.columns = TSV_COLUMNS
     def parse_args(self):
         "Parse command-line arguments"
         parser = argparse.ArgumentParser(description="civic-api-client version {}".format(civic_api_client.__version__),
@@ -180,71 +176,116 @@ class TsvFileLister:
             type = int,
             default = 100000
         )
+        parser.add_argument("--output",
+            help = "File to write [ClinicalEvidenceSummary_<date>.<format>].",
+            type = str
+        )
+        self.add_export_args(parser)
+        utils.add_fetch_args(parser)
+        metrics.add_profile_args(parser)
         args = parser.parse_args(self.args)
+        self.check_export_args(parser, args)
+        metrics.configure(args)
         print "Max number of genes to query is ",args.max_gene_count
         self.args = args
+        if self.client is None:
+            self.client = utils.CivicClient.from_args(args)
+
+    @staticmethod
+    def add_export_args(parser):
+        "Add the options of the export, shared with the audit command"
+        parser.add_argument("--format",
+            help = "Format of the file [tsv]. parquet and feather have typed\n"
+                   "columns and need pyarrow.",
+            choices = writers.FORMATS,
+            default = 'tsv'
+        )
+        parser.add_argument("--row-group-size",
+            help = "Evidence items per row group of the parquet files, and\n"
+                   "per batch converted to columns for feather [10,000].",
+            type = int,
+            default = writers.ROW_GROUP_SIZE
+        )
+        parser.add_argument("--columns",
+            help = "Comma separated columns to write, in that order [all].\n"
+                   "Columns: " + ",".join(column.name
+                                           for column in TSV_COLUMNS),
+            type = str
+        )
+        parser.add_argument("--gzip",
+            action = 'store_true',
+            help = "Gzip the file, .gz is added to its name. Parquet files\n"
+                   "get gzip compressed columns instead."
+        )
+
+    def check_export_args(self, parser, args):
+        "Check the options of the export and select the --columns"
+        try:
+            self.columns = writers.select_columns(TSV_COLUMNS, args.columns)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.format in ('parquet', 'feather'):
+            try:
+                writers.import_pyarrow()
+            except ImportError as e:
+                parser.error(str(e))
+        if args.format == 'feather' and args.gzip:
+            parser.error("--gzip isn't supported with --format feather")
 
     def make_header(self):
-        """Returen a header string for tsv file"""
-        return  'gene'+'\t'+ \
-                'entrez_id'+'\t'+ \
-                'variant'+'\t'+ \
-                'disease'+'\t'+ \
-                'doid'+'\t'+ \
-                'drugs'+'\t'+ \
-                'evidence_type'+'\t'+ \
-                'evidence_direction'+'\t'+ \
-                'clinical_significance'+'\t'+ \
-                'evidence_statement'+'\t'+ \
-                'pubmed_id'+'\t'+ \
-                'citation'+'\t'+ \
-                'rating'+'\t'+ \
-                'evidence_status'+'\t'+ \
-                'evidence_id'+'\t'+ \
-                'variant_id'+'\t'+ \
-                'gene_id'+'\t'+ \
-                'chromosome'+'\t'+ \
-                'start'+'\t'+ \
-                'stop'+'\t'+ \
-                'reference_bases'+'\t'+ \
-                'variant_bases'+'\t'+ \
-                'representative_transcript'+'\t'+ \
-                'chromosome2'+'\t'+ \
-                'start2'+'\t'+ \
-                'stop2'+'\t'+ \
-                'representative_transcript2'+'\t'+ \
-                'ensembl_version'+'\t'+ \
-                'reference_build'+'\t'+ \
-                'variant_summary'+'\t'+ \
-                'variant_origin'+'\t'+ \
-                'evidence_civic_url'+'\t'+ \
-                'variant_civic_url'+'\t'+ \
-                'gene_civic_url'+'\n'
+        """Return the header of the tsv file"""
+        return [column.name for column in self.columns]
+
+    def output_file_name(self):
+        """The --output file, ClinicalEvidenceSummary_<date>.<format> by
+        default"""
+        file_name = self.args.output or \
+                    'ClinicalEvidenceSummary_'+time.strftime('%d%m%Y')+ \
+                    '.'+self.args.format
+        if self.args.gzip and self.args.format in ('tsv', 'jsonl') and \
+           not file_name.endswith('.gz'):
+            file_name += '.gz'
+        return file_name
+
+    def open_output(self):
+        "Open the writer of the output file and write the header"
+        output = writers.open_writer(self.args.format,
+                                     self.output_file_name(), self.columns,
+                                     compress = self.args.gzip,
+                                     row_group_size = self.args.row_group_size)
+        output.write_header(self.make_header())
+        return output
+
+    @staticmethod
+    def write_variant(output, variant_detail):
+        "Write the evidence items of a variant"
+        if "evidence_items" in variant_detail:
+            evidence_items = variant_detail['evidence_items']
+            with metrics.stage("export"):
+                for evidence_item in evidence_items:
+                    output.write(TsvEvidenceItmes(variant_detail,
+                                                  evidence_item))
 
     def get_info_and_print(self):
         "Get variants and evidence items "
-        vl1 = VariantsLister(self.args)
-        vl1.get_civic_genes()
-        variant_ids = vl1.get_variant_ids()
-
-        file_name = 'ClinicalEvidenceSummary_'+time.strftime('%d%m%Y')+'.tsv'
-        output = open(file_name,'w')
-        header = self.make_header()
-        output.write(header)
-
-        for variant_id in variant_ids:
-            variant_detail = vl1.get_variant_details(variant_id)
-            if "evidence_items" in variant_detail:
-                evidence_items = variant_detail['evidence_items'] 
-                for evidence_item in evidence_items:
-                    tsv_item = TsvEvidenceItmes(variant_detail, evidence_item)
-                    output.write(tsv_item.make_str_for_print())
+        vl1 = VariantsLister(self.args, self.client)
+        output = self.open_output()
+        try:
+            for variant_detail in vl1.iter_all_variant_details():
+                self.write_variant(output, variant_detail)
+        except:
+            output.discard()
+            raise
         output.close()
 
     def main(self):
         "Execution starts here"
         self.parse_args()
-        self.get_info_and_print()
+        with Checkpointing(self.args, "tsv-create"):
+            self.get_info_and_print()
+        self.client.close()
+        self.client.print_throttling()
+        metrics.print_profile(self.args)
 
 
 
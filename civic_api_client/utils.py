@@ -1,7 +1,501 @@
+import argparse
+from collections import deque
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+requests.packages.urllib3.disable_warnings()
+
+import metrics
+from response_cache import ResponseCache
+
+# Responses worth retrying, the server is likely to recover from these
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+# Responses of a server asking for fewer requests
+THROTTLING_STATUS_CODES = (429, 503)
+# Request errors worth retrying, the connection failed or was cut short
+RETRIED_ERRORS = (requests.exceptions.ConnectionError,
+                  requests.exceptions.Timeout,
+                  requests.exceptions.ChunkedEncodingError)
+# Longest wait in seconds between two tries of a request, whatever the
+# backoff or the Retry-After header of the server say
+MAX_RETRY_WAIT = 300
+# Timeout for waiting on a pooled result, AsyncResult.get() without a
+# timeout can't be interrupted with Ctrl-C on python2
+POOL_WAIT_TIMEOUT = 60 * 60 * 24
+
 def disease_ontology_api_url():
-    "URL to the disease ontology API"
-    return "http://www.disease-ontology.org/api/"
+    "URL to the disease ontology API, DISEASE_ONTOLOGY_API_URL overrides it"
+    return os.environ.get('DISEASE_ONTOLOGY_API_URL',
+                          "http://www.disease-ontology.org/api/")
 
 def civic_api_url():
-    "URL to the CIVIC API"
-    return "https://civic.genome.wustl.edu/api/"
+    "URL to the CIVIC API, CIVIC_API_URL overrides it"
+    return os.environ.get('CIVIC_API_URL',
+                          "https://civic.genome.wustl.edu/api/")
+
+def url_endpoint(url):
+    "Name of the API endpoint of a URL, for the metrics"
+    if url.startswith(disease_ontology_api_url()):
+        return "doid"
+    if url.startswith(civic_api_url()):
+        url = url[len(civic_api_url()):]
+    return url.split('?')[0].split('/')[0] or "other"
+
+def civic_gene_url(gene_id):
+    "URL of a gene on the CIVIC website"
+    return "https://civic.genome.wustl.edu/#/events/genes/" + str(gene_id) + \
+           "/summary#gene/"
+
+def civic_variant_url(gene_id, variant_id):
+    "URL of a variant on the CIVIC website"
+    return "https://civic.genome.wustl.edu/#/events/genes/" + str(gene_id) + \
+           "/summary/variants/" + str(variant_id) + "/summary#variant"
+
+def civic_evidence_url(gene_id, variant_id, evidence_id):
+    "URL of an evidence item on the CIVIC website"
+    return "https://civic.genome.wustl.edu/#/events/genes/" + str(gene_id) + \
+           "/summary/variants/" + str(variant_id) + "/summary/evidence/" + \
+           str(evidence_id) + "/summary#evidence"
+
+# Shared copies of the repeated strings of the records, see intern_value
+INTERNED_VALUES = {}
+
+def intern_value(value):
+    """Return the shared copy of a repeated string (chromosome, gene name,
+    evidence type...) so the records don't each hold their own. intern()
+    only takes byte strings on python2, the API gives unicode."""
+    if not isinstance(value, basestring):
+        return value
+    return INTERNED_VALUES.setdefault(value, value)
+
+def positive_int(value):
+    "argparse type of the options that take a number of at least 1"
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("%s is not at least 1" % value)
+    return number
+
+def add_fetch_args(parser, db = True):
+    """Add the options that control fetching from the CIVIC API, and the
+    --db option reading a mirror instead if db"""
+    parser.add_argument("--concurrency",
+        help = "Maximum number of concurrent requests to the CIVIC API,"
+                " lowered while\nthe server throttles [10].",
+        type = int,
+        default = 10
+    )
+    parser.add_argument("--retries",
+        help = "Number of times a failed or throttled request is retried,"
+                " honouring\nRetry-After [3].",
+        type = int,
+        default = 3
+    )
+    parser.add_argument("--gene-page-size",
+        help = "Number of genes to get per page of the gene listing [500].",
+        type = positive_int,
+        default = 500
+    )
+    parser.add_argument("--pool-size",
+        help = "Number of keep-alive connections to keep per host"
+                " [same as --concurrency].",
+        type = int,
+    )
+    parser.add_argument("--max-rate",
+        help = "Maximum number of requests per second to the APIs"
+                " [unlimited].",
+        type = float,
+    )
+    parser.add_argument("--timeout",
+        help = "Seconds to wait for the server to respond [30].",
+        type = float,
+        default = 30
+    )
+    parser.add_argument("--cache-dir",
+        help = "Directory to cache API responses in"
+                " [~/.cache/civic-api-client].",
+        type = str
+    )
+    parser.add_argument("--no-cache",
+        action = 'store_true',
+        help = "Don't read or write the response cache."
+    )
+    parser.add_argument("--refresh",
+        action = 'store_true',
+        help = "Revalidate every cached response with the server."
+    )
+    parser.add_argument("--cache-ttl",
+        help = "Hours a cached response is used without revalidating [24].",
+        type = float,
+        default = 24
+    )
+    parser.add_argument("--cache-max-size",
+        help = "Size in MB the cache is kept under by evicting the least"
+                " recently used responses [500].",
+        type = int,
+        default = 500
+    )
+    parser.add_argument("--dump",
+        help = "Read the variants from a local CIVIC bulk dump instead of the"
+                " API: a directory\nwith the nightly VariantSummaries and"
+                " ClinicalEvidenceSummaries TSVs,\na ClinicalEvidenceSummaries"
+                " TSV, or a JSON/JSON lines file of variants.",
+        type = str
+    )
+    if db:
+        parser.add_argument("--db",
+            help = "Read CIVIC from a local SQLite mirror written by"
+                    " civic-api-client sync,\nthe checks that can be"
+                    " answered by a query only read the matching records.",
+            type = str
+        )
+    parser.add_argument("--incremental",
+        action = 'store_true',
+        help = "Only fetch the variants that changed since the last"
+                " --incremental run,\nthe others are read from a snapshot"
+                " in the cache directory."
+    )
+    parser.add_argument("--changed-only",
+        action = 'store_true',
+        help = "With --incremental, only check the variants that changed."
+    )
+    parser.add_argument("--snapshot-max-age",
+        help = "With --incremental, hours after which a variant is fetched"
+                " again even if\nits entry in the gene listing didn't change"
+                " [24].",
+        type = float,
+        default = 24
+    )
+    parser.add_argument("--checkpoint-interval",
+        help = "Seconds between checkpoints of the variants fetched from the"
+                " API [60],\n0 or --no-cache to not checkpoint. The checkpoint"
+                " is removed once the\nrun completes.",
+        type = float,
+        default = 60
+    )
+    parser.add_argument("--resume",
+        action = 'store_true',
+        help = "Pick up an interrupted run of the same command and options"
+                " from its\nlast checkpoint, only fetching the variants it"
+                " didn't get to."
+    )
+
+class RateLimiter:
+    """Token bucket letting through rate requests per second on average,
+    and bursts of up to burst requests. Shared by the fetch threads."""
+
+    def __init__(self, rate, burst = None):
+        "Constructor"
+        self.rate = float(rate)
+        self.burst = burst or max(1.0, self.rate)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        "Wait until a request can be sent"
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def retry_after_seconds(response):
+    """Seconds the Retry-After header of a response asks to wait, None if
+    it has none or can't be parsed"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - time.time())
+
+class ConcurrencyLimiter:
+    """Adaptive limit on the requests in flight, shared by the fetch
+    threads. The limit grows by one per limit requests that succeed, up to
+    maximum, and is halved when the server throttles (additive increase,
+    multiplicative decrease). A Retry-After pauses all the requests."""
+
+    def __init__(self, maximum):
+        "Constructor"
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.lowest = maximum
+        self.in_flight = 0
+        # Requests sent so far, and how many had been sent at the last
+        # decrease: the throttled answers to the requests sent before it
+        # don't decrease the limit again
+        self.sent = 0
+        self.decreased_at = 0
+        self.paused_until = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until a request can be sent, returns the ticket to release
+        it with"""
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.time()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self.condition.wait(wait if wait > 0 else POOL_WAIT_TIMEOUT)
+            self.in_flight += 1
+            self.sent += 1
+            return self.sent
+
+    def release(self, ticket, throttled = False, retry_after = None):
+        "Done with a request, throttled if the server pushed back on it"
+        with self.condition:
+            self.in_flight -= 1
+            if not throttled:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif ticket > self.decreased_at:
+                self.limit = max(1.0, self.limit / 2)
+                self.lowest = min(self.lowest, int(self.limit))
+                self.decreased_at = self.sent
+            if retry_after:
+                self.paused_until = max(self.paused_until,
+                                        time.time() + retry_after)
+            self.condition.notify_all()
+
+class CivicClient:
+    """HTTP client shared by the listers. Owns a pooled keep-alive session
+    so connections to CIVIC and the disease ontology are reused, and an
+    optional ResponseCache for the JSON responses."""
+
+    def __init__(self, pool_size = 10, timeout = 30, retries = 3,
+                 backoff = 1.0, cache = None, refresh = False,
+                 max_rate = None, concurrency = None):
+        "Constructor"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.refresh = refresh
+        self.rate_limiter = RateLimiter(max_rate) if max_rate else None
+        self.concurrency = ConcurrencyLimiter(concurrency or pool_size)
+        # Throttled responses by status, retries, seconds waited before
+        # retrying and requests given up on, for the run summary
+        self.throttled = {}
+        self.retried = 0
+        self.waited = 0.0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        # Failed requests are retried by get()
+        adapter = HTTPAdapter(pool_connections = pool_size,
+                              pool_maxsize = pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_args(cls, args):
+        "Create a client from the parsed fetch arguments"
+        return cls(pool_size = args.pool_size or args.concurrency,
+                   timeout = args.timeout,
+                   retries = args.retries,
+                   cache = ResponseCache.from_args(args),
+                   refresh = args.refresh,
+                   max_rate = args.max_rate,
+                   concurrency = args.concurrency)
+
+    def get(self, url, headers = None):
+        """GET a URL. Connection errors and transient error responses are
+        retried up to retries times, after the wait the Retry-After header
+        asks for or an exponential backoff. The last response is returned
+        if the retries run out."""
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            ticket = self.concurrency.acquire()
+            try:
+                r = self.send(url, headers)
+            except RETRIED_ERRORS:
+                self.concurrency.release(ticket, throttled = True)
+                if attempt >= self.retries:
+                    self.count_failure()
+                    raise
+                reason = "error"
+                wait = self.backoff_seconds(attempt)
+            except BaseException:
+                # Other errors aren't retried, the slot is freed all the same
+                self.concurrency.release(ticket)
+                raise
+            else:
+                if r.status_code not in TRANSIENT_STATUS_CODES:
+                    self.concurrency.release(ticket)
+                    return r
+                retry_after = retry_after_seconds(r)
+                if retry_after is not None:
+                    retry_after = min(retry_after, MAX_RETRY_WAIT)
+                self.concurrency.release(ticket, r.status_code in
+                                         THROTTLING_STATUS_CODES, retry_after)
+                self.count_throttled(r.status_code)
+                if attempt >= self.retries:
+                    self.count_failure()
+                    return r
+                reason = str(r.status_code)
+                wait = retry_after if retry_after is not None else \
+                       self.backoff_seconds(attempt)
+                r.close()
+            self.count_retry(url, reason, wait)
+            time.sleep(wait)
+            attempt += 1
+
+    def backoff_seconds(self, attempt):
+        "Seconds to wait before retrying after attempt + 1 failed tries"
+        wait = min(MAX_RETRY_WAIT, self.backoff * 2 ** attempt)
+        # Jitter, so the threads throttled together don't retry together
+        return wait * (0.5 + random.random() / 2)
+
+    def count_throttled(self, status_code):
+        "Count a transient error response"
+        with self.lock:
+            self.throttled[status_code] = \
+                self.throttled.get(status_code, 0) + 1
+
+    def count_retry(self, url, reason, wait):
+        "Count a retry and the wait before it"
+        metrics.REQUEST_RETRIES.inc((url_endpoint(url), reason))
+        with self.lock:
+            self.retried += 1
+            self.waited += wait
+
+    def count_failure(self):
+        "Count a request given up on"
+        with self.lock:
+            self.failed += 1
+
+    def throttling_summary(self):
+        "How much the servers pushed back during the run, None if they didn't"
+        if not (self.throttled or self.retried or self.failed):
+            return None
+        statuses = ", ".join("%d: %d" % (status, count) for status, count
+                             in sorted(self.throttled.items()))
+        summary = "Throttled by the server: %d error responses%s, " \
+                  "%d retries after %.1f s of waits" % (
+                  sum(self.throttled.values()),
+                  " (" + statuses + ")" if statuses else "",
+                  self.retried, self.waited)
+        if self.concurrency.lowest < self.concurrency.maximum:
+            summary += ", concurrency lowered from %d to %d" % (
+                self.concurrency.maximum, self.concurrency.lowest)
+        if self.failed:
+            summary += ", %d requests failed" % self.failed
+        return summary
+
+    def print_throttling(self, out = None):
+        "Print the throttling summary to stderr if the servers pushed back"
+        summary = self.throttling_summary()
+        if summary is not None:
+            print >> (out or sys.stderr), summary
+
+    def send(self, url, headers = None):
+        "GET a URL once. The requests are counted and timed in the metrics."
+        if not metrics.enabled:
+            return self.session.get(url, headers = headers,
+                                    timeout = self.timeout)
+        endpoint = url_endpoint(url)
+        start = time.time()
+        try:
+            r = self.session.get(url, headers = headers,
+                                 timeout = self.timeout)
+        except requests.exceptions.RequestException:
+            metrics.REQUESTS.inc((endpoint, "error"))
+            raise
+        metrics.REQUEST_SECONDS.observe(time.time() - start, (endpoint,))
+        metrics.REQUESTS.inc((endpoint, str(r.status_code)))
+        metrics.RESPONSE_BYTES.inc((endpoint,), len(r.content))
+        return r
+
+    def get_json(self, url):
+        """GET a URL and decode the JSON body. Fresh cached responses are
+        used as is, stale ones are revalidated with the server."""
+        if self.cache is None:
+            r = self.get(url)
+            r.raise_for_status()
+            return r.json()
+        cached = self.cache.get(url)
+        if cached is None:
+            metrics.CACHE_LOOKUPS.inc(("miss",))
+            r = self.get(url)
+        elif cached.is_fresh(self.cache.ttl) and not self.refresh:
+            metrics.CACHE_LOOKUPS.inc(("fresh",))
+            return cached.json()
+        else:
+            r = self.get(url, cached.conditional_headers())
+            if r.status_code == 304:
+                metrics.CACHE_LOOKUPS.inc(("revalidated",))
+                self.cache.touch(url)
+                return cached.json()
+            metrics.CACHE_LOOKUPS.inc(("stale",))
+        if r.status_code == 200:
+            self.cache.put(url, r.content, r.headers.get('ETag'),
+                           r.headers.get('Last-Modified'))
+        r.raise_for_status()
+        return r.json()
+
+    def close(self):
+        "Close the pooled connections and the cache"
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+def ordered_map(pool, func, items, window):
+    """Apply func to every item on the pool, yielding the results in the
+    order of the items. At most window items are in flight at a time."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get(POOL_WAIT_TIMEOUT)
+    while pending:
+        yield pending.popleft().get(POOL_WAIT_TIMEOUT)
+
+def chunks(items, size):
+    "Split an iterable into lists of size items"
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def fetch_concurrently(func, items, concurrency):
+    """Call func (usually a fetch) on every item using a pool of
+    concurrency threads, yielding the results in the order of the items"""
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+    pool = ThreadPool(concurrency)
+    try:
+        for result in ordered_map(pool, func, items, 2 * concurrency):
+            yield result
+    finally:
+        pool.terminate()
@@ -0,0 +1,45 @@
+"variant_index.py - Index of the variants in the CIVIC gene listing"
+
+class VariantIndex:
+    """The variants of a gene listing: their IDs in listing order without
+    duplicates, the listing entry of each variant and the gene it belongs
+    to. Adding a gene takes time linear in its number of variants."""
+
+    def __init__(self, genes = ()):
+        "Constructor"
+        #Variant IDs in the order they were first listed
+        self.variant_ids = []
+        #Variant ID -> entry of the variant in the gene listing
+        self.variants = {}
+        #Variant ID -> metadata of its gene
+        self.genes = {}
+        for gene in genes:
+            self.add_gene(gene)
+
+    def __len__(self):
+        return len(self.variant_ids)
+
+    def __iter__(self):
+        return iter(self.variant_ids)
+
+    def __contains__(self, variant_id):
+        return variant_id in self.variants
+
+    def add_gene(self, gene):
+        "Add the variants of a gene record from the listing"
+        metadata = {
+            'gene_id': gene['id'],
+            'entrez_name': gene.get('name'),
+            'entrez_id': gene.get('entrez_id'),
+        }
+        for variant in gene['variants']:
+            variant_id = variant['id']
+            if variant_id in self.variants:
+                continue
+            self.variant_ids.append(variant_id)
+            self.variants[variant_id] = variant
+            self.genes[variant_id] = metadata
+
+    def gene(self, variant_id):
+        "Metadata (gene_id, entrez_name, entrez_id) of the variant's gene"
+        return self.genes.get(variant_id, {})
@@ -1,282 +1,156 @@
 "variants_lister.py - Get variants using the CIVIC API"
 
 import argparse
-from flask import Flask, render_template
 import json
+import multiprocessing
 import requests
 requests.packages.urllib3.disable_warnings()
 
 import civic_api_client
+import intervals
+import metrics
+import sources
 import utils
-import re
-import gzip
-
-class VariantDetails:
-    coordinates = {}
-    args = []
-
-    def __init__(self, args, variant_details):
+import rules
+import signal
+import sys
+from snapshot import Checkpointing
+from transcript_index import TranscriptIndex
+import web
+
+def variant_rule_engine(args, transcripts, coordinate_index = None):
+    "Engine running the variant rules selected on the command line"
+    return rules.RuleEngine.from_args(rules.VARIANT_RULES, args,
+        rules.RuleContext(transcripts, coordinate_index = coordinate_index))
+
+class VariantDetails(object):
+    """The fields of a variant the checks and the outputs need, copied out
+    of the API payload so the payload can be dropped"""
+    __slots__ = (
+        'id',
+        'name',
+        'gene_name',
+        'gene_id',
+        'ref_base',
+        'var_base',
+        'variant_types',
+        'has_coordinates',
+        'chromosome',
+        'start',
+        'stop',
+        'representative_transcript',
+        'chromosome2',
+        'start2',
+        'stop2',
+        'representative_transcript2',
+        'ensembl_version',
+        'errors',
+    )
+
+    def __init__(self, variant_details):
         "Constructor"
-        self.args = args
-        self.coordinates = None
-        self.name = None
-        self.id = None
-        self.gene_name = None
-        self.ref_base = None
-        self.var_base = None
         self.parse_variant_details(variant_details)
-        self.civic_url = self.define_civic_url(variant_details)
-        self.gene_id = None
-        self.error_type = []
-        self.error_str = ""
-
-    @classmethod
-    def define_civic_url(self, variant_details):
-        "Define the CIVIC URL for the variant"
-        if 'gene_id' not in variant_details:
-            variant_details['gene_id'] = "NA"
-        return "https://civic.genome.wustl.edu/#/events/genes/" + \
-               str(variant_details['gene_id']) + "/summary/variants/" + \
-               str(variant_details['id']) + "/summary#variant"
+        self.errors = 0
 
     def parse_variant_details(self, variant_details):
         "Parse variant details into class members"
-        if 'coordinates' in variant_details:
-            self.coordinates = variant_details['coordinates']
-            if 'reference_bases' in variant_details['coordinates']:
-                self.ref_base = variant_details['coordinates']['reference_bases']
-            if 'variant_bases' in variant_details['coordinates']:
-                self.var_base = variant_details['coordinates']['variant_bases']
-
-        if 'name' in variant_details:
-            self.name = variant_details['name']
-        if 'id' in variant_details:
-            self.id = variant_details['id']
-        if 'entrez_name' in variant_details:
-            self.gene_name = variant_details['entrez_name']
-        if 'gene_id' in variant_details:
-            self.gene_id = variant_details['gene_id']
-        if 'variant_types' in variant_details:
-            self.variant_types = variant_details['variant_types']
-
-    # Make a string of errors for website output
-    def make_error_string(self):
-        self.error_str = ','.join(self.error_type)
-
-    #Returns true if the variant_types is empty
-    def no_variant_types(self):
-        "Does the variant have a variant type defined"
-        if self.variant_types == []:
-            self.error_type.append("No variant_types")
-
-    #Returns true if the variant does not have defined coordinates
-    def no_coords(self):
-        "Does the variant have the chr, start and stop defined"
-        coord = self.coordinates['chromosome'] or \
-                self.coordinates['start'] or \
-                self.coordinates['stop']
-        if not coord:
-            self.error_type.append("No coordinate")
-        return coord
-
-    #Returns true if the variant start > stop
-    def wrong_coords(self):
-        "Does the variant have start > stop"
-        rval = False
-        if "No coordinate" in self.error_type:
-            return False
-
-        try:
-            rval = (int(self.coordinates['start']) > \
-             int(self.coordinates['stop']))
-        except ValueError:
-            self.error_type.append("Wrong coordinates")
-            return True
-
-        if self.coordinates['start2'] and \
-        self.coordinates['stop2'] and \
-        not rval:
-            rval = (int(self.coordinates['start2']) > \
-             int(self.coordinates['stop2']))
-
-        if rval:
-            self.error_type.append("Wrong coordinates")
-
-        return rval
-
-    #Returns true if ref/variant base not in [A,C,G,T,N]
-    def wrong_base(self):
-        "Are both the ref/variant base in [A,C,G,T,N,None]"
-        if self.coordinates['chromosome2'] != None:
-            return False
-
-        if self.coordinates['stop'] and self.coordinates['start']:
-            var_len = int(self.coordinates['stop']) - \
-            int(self.coordinates['start'])
-            if var_len > 10:
-                return False
-
-        allowed_nucs = ['A', 'C', 'G', 'T', 'N']
-        if (self.ref_base not in allowed_nucs or self.var_base not in allowed_nucs):
-            self.error_type.append("Wrong base")
-
-        return (self.ref_base not in allowed_nucs or
-                self.var_base not in allowed_nucs)
+        self.id = variant_details.get('id')
+        self.name = variant_details.get('name')
+        self.gene_name = utils.intern_value(variant_details.get('entrez_name'))
+        self.gene_id = variant_details.get('gene_id', "NA")
+        self.variant_types = None
+        if variant_details.get('variant_types') is not None:
+            self.variant_types = tuple(
+                utils.intern_value(variant_type.get('name'))
+                for variant_type in variant_details['variant_types'])
+        coordinates = variant_details.get('coordinates') or {}
+        self.has_coordinates = bool(coordinates)
+        self.ref_base = utils.intern_value(coordinates.get('reference_bases'))
+        self.var_base = utils.intern_value(coordinates.get('variant_bases'))
+        self.chromosome = utils.intern_value(coordinates.get('chromosome'))
+        self.start = coordinates.get('start')
+        self.stop = coordinates.get('stop')
+        self.representative_transcript = \
+            coordinates.get('representative_transcript')
+        self.chromosome2 = utils.intern_value(coordinates.get('chromosome2'))
+        self.start2 = coordinates.get('start2')
+        self.stop2 = coordinates.get('stop2')
+        self.representative_transcript2 = \
+            coordinates.get('representative_transcript2')
+        self.ensembl_version = coordinates.get('ensembl_version')
+
+    @property
+    def civic_url(self):
+        "The CIVIC URL for the variant"
+        return utils.civic_variant_url(self.gene_id, self.id)
+
+    @property
+    def error_type(self):
+        "Names of the errors found in the variant"
+        return rules.error_names(self.errors)
+
+    # String of errors for website output
+    @property
+    def error_str(self):
+        return ','.join(self.error_type)
 
     #Returns true if variant length within limit or coordinates undefined
-    def max_var_length(self):
+    def max_var_length(self, max_var_length):
         "Does the variant have start - stop <= max_var_length"
         rval = False
-        if self.coordinates and self.coordinates['stop'] and \
-           self.coordinates['start']:
+        if self.has_coordinates and self.stop and self.start:
             try:
-                rval = int(self.coordinates['stop']) - \
-                        int(self.coordinates['start']) < \
-                        self.args.max_var_length
+                rval = int(self.stop) - int(self.start) < max_var_length
             except:
                 return False
 
             return rval
 
-    # Pattern example : ENST00000355413.4
-    def rep_trans_format(self,transcript):
-        "Check the format of representative transcript"
-        if not re.match('ENST\d+\.\d+',transcript):
-            self.error_type.append("Wrong transcript format")
-            return True
-        return False
-
-    def rep_trans_valid(self,transcript):
-        "Check if the representative transcript can be found in reference file"
-        Invalid = True
-        if not self.args.transcript_file:
+    def satisfies_filters(self, rule_engine, max_var_length = None,
+                          regions = None):
+        """Does the variant fail any of the rules of the engine, the
+        variants longer than max_var_length or outside the IntervalIndex of
+        regions are skipped"""
+        if not self.has_coordinates:
             return False
-        transID = transcript.split('.')[0]
-        versionID = transcript.split('.')[1]
-        reference = gzip.open(self.args.transcript_file,'rb')
-        for line in reference:
-            ref_transID = line.split()[14]
-            ref_versionID = line.split()[15]
-            if transID == ref_transID and versionID == ref_versionID:
-                Invalid = False
-        reference.close()
-        if Invalid:
-            self.error_type.append("Invalid representative transcript")
-        return Invalid
-
-
-    def rep_trans(self):
-        "Check if there's missing representative transcript"
-        Invalid = False
-        if self.coordinates['representative_transcript'] == None:
-            self.error_type.append("No representative transcript")
-            Invalid = True
-        else:
-            transcript = self.coordinates['representative_transcript']
-            if self.rep_trans_format(transcript):
-                Invalid = True
-            else:
-                if self.rep_trans_valid(transcript):
-                    Invalid = True
-
-        if self.coordinates['chromosome2'] != None:
-            if self.coordinates['representative_transcript2'] == None:
-                self.error_type.append("No representative transcript")
-                Invalid = True
-            else:
-                transcript = self.coordinates['representative_transcript2']
-                if self.rep_trans_format(transcript):
-                    Invalid = True
-                else :
-                    self.rep_trans_valid(transcript)
-                    Invalid = True
-
-        return Invalid
-
-
-    def ensembl_version(self):
-        "Check if the ensembl version is missing"
-        if self.coordinates['representative_transcript'] == None:
+        if regions is not None and \
+           not regions.overlaps_any(intervals.variant_intervals(self)):
             return False
-        if self.coordinates['ensembl_version'] == None:
-            self.error_type.append("No Ensembl version")
-            return True
-        else:
-            e_version = self.coordinates['ensembl_version']
-            if type(e_version).__name__ == 'int':
+        # Variant length doesn't fit
+        if max_var_length:
+            maxvarlength = self.max_var_length(max_var_length)
+            if not maxvarlength:
                 return False
-            else:
-                self.error_type.append("Wrong Ensembl version")
-                return True
-        return False
-
-
-
-    def satisfies_filters(self):
-        "Does the variant satisfy any one of the conditions"
-        satisfies = True
-
-        if self.coordinates:
-            # Variant length doesn't fit
-            if self.args.max_var_length:
-                maxvarlength = self.max_var_length()
-                if not maxvarlength:
-                    return False;
-
-            self.no_variant_types()
-            self.no_coords()
-            self.wrong_coords()
-            self.wrong_base()
-            self.rep_trans()
-            self.ensembl_version()
-            self.make_error_string()
-
-            if len(self.error_type) == 0:
-                return False
-
-            if self.args.no_variant_types:
-                if "No variant_types" in self.error_type:
-                    return True
-
-            if self.args.no_coords:
-                if "No coordinate" in self.error_type:
-                    return True
-
-            if self.args.wrong_coords :
-                if "Wrong coordinates" in self.error_type:
-                    return True
-
-            if self.args.wrong_base:
-                if "Wrong base" in self.error_type:
-                    return True
-
-            if self.args.rep_trans:
-                if "No representative transcript" in self.error_type \
-                or "Wrong transcript format" in self.error_type \
-                or "Invalid representative transcript" in self.error_type:
-                    return True
-
-            if self.args.ensembl_version:
-                if "No Ensembl version" in self.error_type \
-                or "Wrong Ensembl version" in self.error_type:
-                    return True
-        else:
-            satisfies = False
-
-        if self.args.no_variant_types or \
-        self.args.no_coords or \
-        self.args.wrong_coords or \
-        self.args.wrong_base or \
-        self.args.rep_trans or \
-        self.args.ensembl_version:
-            satisfies = False
-
-        return satisfies
-
-    def print1(self):
-        "Print variant details"
-        print
-        print   "ID: ", \
+        self.errors = rule_engine.run(self)
+        return self.errors != 0
+
+    def as_row(self):
+        "Columns of the variant for the web tables"
+        return {
+            'error_type': self.error_type,
+            'error_str': self.error_str,
+            'id': self.id,
+            'name': self.name,
+            'gene_name': self.gene_name,
+            'ref_base': self.ref_base,
+            'var_base': self.var_base,
+            'chromosome': self.chromosome,
+            'start': self.start,
+            'stop': self.stop,
+            'representative_transcript': self.representative_transcript,
+            'chromosome2': self.chromosome2,
+            'start2': self.start2,
+            'stop2': self.stop2,
+            'representative_transcript2': self.representative_transcript2,
+            'civic_url': self.civic_url,
+        }
+
+    def print1(self, out = None):
+        "Print variant details, to out if given"
+        if out is None:
+            out = sys.stdout
+        print >> out
+        print >> out, "ID: ", \
                 self.id, \
                 "Name: ", \
                 self.name, \
@@ -289,36 +163,80 @@ class VariantDetails:
                 "Var_base: ", \
                 self.var_base, \
                 "Coordinate1: ", \
-                self.coordinates['chromosome'], \
-                self.coordinates['start'], \
-                self.coordinates['stop'], \
-                self.coordinates['representative_transcript'], \
+                self.chromosome, \
+                self.start, \
+                self.stop, \
+                self.representative_transcript, \
                 "Coordinate2: ", \
-                self.coordinates['chromosome2'], \
-                self.coordinates['start2'], \
-                self.coordinates['stop2'], \
-                self.coordinates['representative_transcript2'], \
+                self.chromosome2, \
+                self.start2, \
+                self.stop2, \
+                self.representative_transcript2, \
                 "URL: ", \
                 self.civic_url
 
+rules.VARIANT_RULES.check_fields(VariantDetails.__slots__)
+
+# Variants sent to a --workers process at a time
+FILTER_CHUNK_SIZE = 50
+# Arguments, rule engine and regions of the worker processes, see
+# init_filter_worker
+worker_args = None
+worker_rule_engine = None
+worker_regions = None
+
+def check_variant(args, rule_engine, variant_details, regions = None):
+    "Return the VariantDetails of a variant if it satisfies the filters"
+    if VariantsLister.prior_check(variant_details):
+        vd1 = VariantDetails(variant_details)
+        if vd1.satisfies_filters(rule_engine, args.max_var_length, regions):
+            return vd1
+    return None
+
+def init_filter_worker(args, transcripts, coordinate_index, regions,
+                       metrics_enabled):
+    "Set up a --workers process, Ctrl-C is handled by the parent"
+    global worker_args, worker_rule_engine, worker_regions
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if metrics_enabled:
+        metrics.enable()
+    worker_args = args
+    worker_rule_engine = variant_rule_engine(args, transcripts,
+                                             coordinate_index)
+    worker_regions = regions
+
+def filter_variant_chunk(variant_details_chunk):
+    """Check a chunk of variants in a --workers process, returns the
+    variants that passed and what the rules recorded in the RULE_COUNTERS"""
+    passed = []
+    for variant_details in variant_details_chunk:
+        vd1 = check_variant(worker_args, worker_rule_engine, variant_details,
+                            worker_regions)
+        if vd1 is not None:
+            passed.append(vd1)
+    return passed, [counter.take() for counter in metrics.RULE_COUNTERS]
+
 class VariantsLister:
     """Represent the variants in CIVIC"""
     #Flag for empty variant types
     variant_types = False
     #Flag to select variants with no co-ordinates
     no_coords = False
-    #List of variant details
-    all_variant_details = []
-    #Details of variants satisfying filters
-    filtered_variant_details = []
-    #List of genes that were queried for
-    genes = []
     #Arguments to this tool
     args = []
-
-    def __init__(self, args):
+    #Valid Ensembl transcripts, loaded once from --transcript-file
+    transcripts = None
+    #IntervalIndex of the --region and --bed regions, None to check all
+    regions = None
+    #IntervalIndex of all the variants, for the --overlapping-coords check
+    coordinate_index = None
+
+    def __init__(self, args, client = None):
         "Constructor"
         self.args = args
+        self.client = client
+        #Details of variants satisfying filters
+        self.filtered_variant_details = []
 
     def parse_args(self):
         "Parse command-line arguments"
@@ -326,77 +244,79 @@ class VariantsLister:
             usage = "civic-api-client variants-list",
             formatter_class = argparse.RawTextHelpFormatter,
         )
-        parser.add_argument("--no-variant-types",
-            action='store_true',
-            help = "Print variants with no variant_types defined"
-        )
-        parser.add_argument("--no-coords",
-            action='store_true',
-            help = "Print variants with no coordinates defined"
-        )
-        parser.add_argument("--wrong-coords",
-            action='store_true',
-            help = "Print variants where start > stop",
-        )
-        parser.add_argument("--wrong-base",
-            action='store_true',
-            help = "Print variants where ref/var base is not in [A,C,G,T,N,None]",
-        )
-        parser.add_argument("--rep-trans",
-            action='store_true',
-            help = "Print variants with no/wrong representative transcript",
+        rules.VARIANT_RULES.add_flags(parser)
+        parser.add_argument("--region",
+            help = "Only check the variants overlapping chr:start-stop (1-based,\n"
+                   "inclusive), can be given several times",
+            action = 'append',
         )
-        parser.add_argument("--ensembl-version",
-            action='store_true',
-            help = "Print variants with no/wrong ensembl database version",
-        )
-        parser.add_argument("--transcript-file",
-            help = "Reference file (transcript.txt.gz) of all valid ensembl transcripts for Ensembl v75",
+        parser.add_argument("--bed",
+            help = "Only check the variants overlapping the regions of a BED file",
             type = str
         )
-
+        self.add_check_args(parser)
         parser.add_argument("--max-gene-count",
             help = "Maximum number of genes to query from CIVIC [100,000]",
             type = int,
             default = 100000
         )
-        parser.add_argument("--max-var-length",
-            help = "Maximum length of the variants to query from CIVIC [INF]",
-            type = int,
-        )
         parser.add_argument("--web",
             action='store_true',
             help = "Publish variants to a webpage."
         )
+        parser.add_argument("--workers",
+            help = "Number of processes checking the variants [1]",
+            type = int,
+            default = 1
+        )
+        utils.add_fetch_args(parser)
+        metrics.add_profile_args(parser)
         args = parser.parse_args(self.args)
+        sources.check_dump_rules(parser, args, rules.VARIANT_RULES)
+        metrics.configure(args)
+        try:
+            regions = [intervals.parse_region(region)
+                       for region in args.region or []]
+        except ValueError as e:
+            parser.error(str(e))
+        if args.bed:
+            regions.extend(intervals.read_bed(args.bed))
+        if args.region or args.bed:
+            self.regions = intervals.IntervalIndex.from_regions(regions)
         print "Max number of genes to query is ",args.max_gene_count
         if args.max_var_length:
             print "Max length of variants displayed is ",args.max_var_length
         self.args = args
+        if self.client is None:
+            self.client = utils.CivicClient.from_args(args)
 
-    def get_civic_genes(self):
-        "Get a list of genes from CIVIC"
-        genes_url = utils.civic_api_url() + 'genes?count=' + str(self.args.max_gene_count)
-        self.genes = sorted(requests.get(genes_url, verify = False).json()['records'], \
-                            key=lambda key: int(key['id']))
-
-    def get_variant_ids(self):
-        "Get a list of variants using a list of genes"
-        variant_ids = []
-        for gene in self.genes:
-            for variant in gene['variants']:
-                variant_id = variant['id']
-                if variant_id in variant_ids:
-                    continue
-                variant_ids.append(variant_id)
-        return variant_ids
-
-    def get_variant_details(self, variant_id):
-        "Get the details for a variant given an ID"
-        variant_url = utils.civic_api_url() + 'variants/' + str(variant_id)
-        return requests.get(variant_url, verify = False).json()
-
-    def prior_check(self,variant_detail):
+    @staticmethod
+    def add_check_args(parser):
+        "Add the options of the variant checks, shared with the audit command"
+        parser.add_argument("--transcript-file",
+            help = "Reference file (transcript.txt.gz) of all valid ensembl transcripts for Ensembl v75",
+            type = str
+        )
+        parser.add_argument("--transcript-index",
+            help = "SQLite index of the --transcript-file, built on the first run and\n"
+                   "reused by later runs without reading the transcript file again",
+            type = str
+        )
+        parser.add_argument("--max-var-length",
+            help = "Maximum length of the variants to query from CIVIC [INF]",
+            type = int,
+        )
+
+    def iter_all_variant_details(self, variant_rules = None,
+                                 evidence_rules = None):
+        """Details of every variant, from the source chosen on the command
+        line. A source that can query its records, the --db mirror, only
+        returns the variants or evidence items that may fail the rules."""
+        source = sources.open_source(self.args, self.client)
+        return source.iter_variant_details(variant_rules, evidence_rules)
+
+    @staticmethod
+    def prior_check(variant_detail):
         """Prior checks before parsing variant details:
         1. Filter variant with no accepted evidence item"""
         valid = False
@@ -407,48 +327,102 @@ class VariantsLister:
         return valid
 
 
-    def filter_variants(self):
-        "Filter the variant details"
-        for variant_details in self.all_variant_details:
-            if self.prior_check(variant_details):
-                vd1 = VariantDetails(self.args, variant_details)
-                if vd1.satisfies_filters():
-                    self.filtered_variant_details.append(vd1)
+    def load_transcripts(self):
+        "Load the valid Ensembl transcripts once for all the variants"
+        if self.transcripts is None:
+            with metrics.stage("transcript_load"):
+                self.transcripts = TranscriptIndex.load(
+                    self.args.transcript_file, self.args.transcript_index)
+
+    def index_coordinates(self, all_variant_details):
+        """Index the coordinates of all the variants for the rules comparing
+        the variants, the variant details are read ahead and returned as a
+        list"""
+        all_variant_details = list(all_variant_details)
+        self.coordinate_index = intervals.IntervalIndex.from_variants(
+            VariantDetails(variant_details)
+            for variant_details in all_variant_details)
+        return all_variant_details
+
+    def filter_variants(self, all_variant_details):
+        """Filter the variant details, yielding the variants as they pass.
+        Without a rule comparing the variants to each other the variants
+        are checked as they are fetched."""
+        self.load_transcripts()
+        if rules.needs_coordinate_index(rules.VARIANT_RULES.select(self.args)):
+            all_variant_details = self.index_coordinates(all_variant_details)
+        if self.args.workers > 1:
+            for vd1 in self.filter_variants_in_workers(all_variant_details):
+                yield vd1
+            return
+        rule_engine = variant_rule_engine(self.args, self.transcripts,
+                                          self.coordinate_index)
+        for variant_details in all_variant_details:
+            vd1 = check_variant(self.args, rule_engine, variant_details,
+                                self.regions)
+            if vd1 is not None:
+                yield vd1
+
+    def filter_variants_in_workers(self, all_variant_details):
+        """Filter the variant details in a pool of --workers processes,
+        the variants are checked in chunks and yielded in input order"""
+        pool = multiprocessing.Pool(self.args.workers,
+                                    init_filter_worker,
+                                    (self.args, self.transcripts,
+                                     self.coordinate_index, self.regions,
+                                     metrics.enabled))
+        try:
+            chunks = utils.chunks(all_variant_details, FILTER_CHUNK_SIZE)
+            for passed, rule_values in utils.ordered_map(pool,
+                    filter_variant_chunk, chunks, 2 * self.args.workers):
+                for counter, values in zip(metrics.RULE_COUNTERS,
+                                           rule_values):
+                    counter.merge(values)
+                for vd1 in passed:
+                    yield vd1
+        finally:
+            pool.terminate()
 
     def get_filtered_variant_details(self):
         "Return the list of filtered variant details"
         return self.filtered_variant_details
 
-    def print_variant_coordinates(self):
+    def print_variant_coordinates(self, filtered_variant_details = None):
         "Print the details of the variants to screen"
+        if filtered_variant_details is None:
+            filtered_variant_details = self.filtered_variant_details
         if self.args.web:
             self.print_variant_coordinates_web()
         else:
-            for vd1 in self.filtered_variant_details:
-                vd1.print1()
+            for vd1 in filtered_variant_details:
+                with metrics.stage("output"):
+                    vd1.print1()
 
     def print_variant_coordinates_web(self):
         "Publish to web page"
-        app = Flask("civic_api_client")
-        @app.route("/")
-        def template_test():
-                return render_template('variants.html', \
-                        filtered_variant_details = self.filtered_variant_details)
-        app.run(debug=True)
+        store = web.ResultStore({'variants': self.create_filtered_variants_list})
+        web.serve(store, home = 'variants')
+
+    def iter_filtered_variants(self):
+        """Get variants from CIViC and filter them, the variants are
+        yielded as soon as they are fetched and checked"""
+        variant_rules = rules.VARIANT_RULES.select(self.args)
+        return self.filter_variants(
+            self.iter_all_variant_details(variant_rules = variant_rules))
 
     def create_filtered_variants_list(self):
         "Get variants from CIViC and filter them"
-        self.get_civic_genes()
-        variant_ids = self.get_variant_ids()
-        for variant_id in variant_ids:
-            variant_detail = self.get_variant_details(variant_id)
-            if 'id' not in variant_detail:
-                variant_detail['id'] = variant_id
-            self.all_variant_details.append(variant_detail)
-        self.filter_variants()
+        self.filtered_variant_details = list(self.iter_filtered_variants())
+        return self.filtered_variant_details
 
     def main(self):
         "Execution starts here"
         self.parse_args()
-        self.create_filtered_variants_list()
-        self.print_variant_coordinates()
+        if self.args.web:
+            self.print_variant_coordinates_web()
+        else:
+            with Checkpointing(self.args, "variants-list"):
+                self.print_variant_coordinates(self.iter_filtered_variants())
+        self.client.close()
+        self.client.print_throttling()
+        metrics.print_profile(self.args)
@@ -0,0 +1,240 @@
+"web.py - Web view of the CIVIC action items"
+
+from flask import Flask, render_template, redirect, request, url_for, abort, \
+                  jsonify, Response
+import threading
+import time
+import traceback
+
+import metrics
+
+# Columns the JSON API can filter each result on
+FILTER_COLUMNS = {
+    'variants': ['error_type', 'gene_name'],
+    'evidence_items': ['error', 'evi_type', 'gene_name'],
+}
+# Largest page the JSON API returns
+MAX_PAGE_SIZE = 1000
+
+def sort_key(value):
+    "Sort missing values last"
+    return (value is None, value)
+
+class ResultTable:
+    """Rows of a result with the indexes the JSON API queries: the row
+    positions for each value of the filter columns, and the row order for
+    each sort column, built the first time the column is sorted on"""
+
+    def __init__(self, rows, filter_columns):
+        "Constructor"
+        self.rows = rows
+        self.filters = {}
+        self.orders = {}
+        for column in filter_columns:
+            index = {}
+            for position, row in enumerate(rows):
+                values = row[column]
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    index.setdefault(value, []).append(position)
+            self.filters[column] = index
+
+    def __len__(self):
+        return len(self.rows)
+
+    def facets(self):
+        "The values of each filter column"
+        return dict((column, sorted(value for value in index
+                                    if value is not None))
+                    for column, index in self.filters.items())
+
+    def order(self, column, descending = False):
+        "Row positions sorted on a column, rows missing the value go last"
+        if column not in self.orders:
+            rows = self.rows
+            order = sorted(range(len(rows)),
+                key = lambda position: sort_key(rows[position][column]))
+            present = sum(1 for row in rows if row[column] is not None)
+            self.orders[column] = (order, present)
+        order, present = self.orders[column]
+        if descending:
+            return order[present - 1::-1] + order[present:] if present \
+                   else order
+        return order
+
+    def query(self, filters, sort = None, descending = False,
+              offset = 0, limit = 100):
+        """Return the number of rows matching the filters (a dict of
+        column to value) and one page of those rows"""
+        positions = None
+        for column, value in filters.items():
+            matching = set(self.filters[column].get(value, ()))
+            positions = matching if positions is None \
+                        else positions & matching
+        if sort:
+            order = self.order(sort, descending)
+            if positions is not None:
+                order = [position for position in order
+                         if position in positions]
+        elif positions is not None:
+            order = sorted(positions)
+        else:
+            order = range(len(self.rows))
+        page = [self.rows[position] for position in
+                order[offset:offset + limit]]
+        return len(order), page
+
+class ResultStore:
+    """Results of the listers kept in memory for the web view. The results
+    are computed in a background thread, then recomputed every
+    refresh_interval seconds or when a refresh is requested, while the
+    previous results keep being served."""
+
+    def __init__(self, computes, refresh_interval = None):
+        "Constructor, computes maps a result name to a function computing it"
+        self.computes = computes
+        self.refresh_interval = refresh_interval
+        self.tables = dict((name, ResultTable([], FILTER_COLUMNS[name]))
+                           for name in computes)
+        self.updated_at = None
+        self.error = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def __contains__(self, name):
+        return name in self.computes
+
+    def get(self, name):
+        "Return the table of the last computed results"
+        with self.lock:
+            return self.tables[name]
+
+    def refresh(self):
+        "Recompute all the results, keeping the old ones if that fails"
+        self.refreshing = True
+        try:
+            tables = {}
+            for name in self.computes:
+                rows = [record.as_row() for record in self.computes[name]()]
+                tables[name] = ResultTable(rows, FILTER_COLUMNS[name])
+        except Exception:
+            traceback.print_exc()
+            self.error = traceback.format_exc().splitlines()[-1]
+        else:
+            with self.lock:
+                self.tables = tables
+                self.updated_at = time.time()
+                self.error = None
+        finally:
+            self.refreshing = False
+
+    def request_refresh(self):
+        "Ask the background thread to refresh now"
+        self.wake.set()
+
+    def run(self):
+        "Refresh loop of the background thread"
+        while True:
+            self.refresh()
+            self.wake.wait(self.refresh_interval)
+            self.wake.clear()
+
+    def start(self):
+        "Start computing the results in the background"
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def status(self):
+        "Describe the state of the results for the pages"
+        if self.updated_at is None:
+            status = "Querying the CIViC API, this takes a couple of minutes."
+        else:
+            status = "Results from " + time.strftime("%Y-%m-%d %H:%M:%S",
+                time.localtime(self.updated_at)) + "."
+            if self.refreshing:
+                status += " Refreshing now."
+        if self.error:
+            status += " Last refresh failed: " + self.error
+        return status
+
+def create_app(store, home = None):
+    """Flask app serving the results in the store. If home is given, the
+    root page redirects to that page instead of listing the pages."""
+    app = Flask("civic_api_client")
+
+    @app.route("/")
+    def template_home():
+        if home:
+            return redirect(url_for(home))
+        return render_template('home.html', status = store.status())
+
+    @app.route("/evidence-items")
+    def evidence_items():
+        if 'evidence_items' not in store:
+            abort(404)
+        return render_template('evidence-items.html', status = store.status())
+
+    @app.route("/variants")
+    def variants():
+        if 'variants' not in store:
+            abort(404)
+        return render_template('variants.html', status = store.status())
+
+    @app.route("/api/evidence-items")
+    def api_evidence_items():
+        return query_table('evidence_items')
+
+    @app.route("/api/variants")
+    def api_variants():
+        return query_table('variants')
+
+    def query_table(name):
+        """Answer a JSON API request for one page of a result. Takes the
+        offset, limit, sort and order (asc or desc) parameters, and any
+        filter column of the result as a filter."""
+        if name not in store:
+            abort(404)
+        table = store.get(name)
+        try:
+            offset = max(int(request.args.get('offset', 0)), 0)
+            limit = min(max(int(request.args.get('limit', 100)), 0),
+                        MAX_PAGE_SIZE)
+        except ValueError:
+            abort(400)
+        sort = request.args.get('sort')
+        if sort and table.rows and sort not in table.rows[0]:
+            abort(400)
+        filters = dict((column, request.args[column])
+                       for column in FILTER_COLUMNS[name]
+                       if request.args.get(column))
+        total, rows = table.query(filters, sort,
+                                  request.args.get('order') == 'desc',
+                                  offset, limit)
+        return jsonify(total = total, offset = offset, limit = limit,
+                       rows = rows, facets = table.facets(),
+                       status = store.status())
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        "The metrics of the refreshes in the Prometheus text format"
+        return Response(metrics.prometheus_text(),
+                        mimetype = 'text/plain; version=0.0.4')
+
+    @app.route("/refresh", methods = ['POST'])
+    def refresh():
+        store.request_refresh()
+        return redirect(request.referrer or url_for('template_home'))
+
+    return app
+
+def serve(store, home = None):
+    "Start the store and run the web server until interrupted"
+    metrics.enable()
+    store.start()
+    app = create_app(store, home)
+    # The reloader would run a second crawl in its child process
+    app.run(debug = True, use_reloader = False)
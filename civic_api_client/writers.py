@@ -0,0 +1,361 @@
+"writers.py - Writers of the exported records"
+
+from collections import OrderedDict
+import cStringIO
+import csv
+import gzip
+import json
+from operator import attrgetter, methodcaller
+import os
+import re
+
+import metrics
+
+# Rows batched in memory before they are written to the file
+WRITE_BATCH_SIZE = 1000
+# Characters the csv module quotes a field for, besides the delimiter
+NEEDS_QUOTING = re.compile(u'["\r\n]')
+# Buffer of the output files
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# Added to the name of an output file until it is complete
+PARTIAL_SUFFIX = '.part'
+# Records per row group of the Parquet files and record batch of the
+# Feather files
+ROW_GROUP_SIZE = 10000
+# Formats of the exports
+FORMATS = ['tsv', 'jsonl', 'parquet', 'feather']
+
+# Kinds of columns, the type of the column in the typed formats
+STRING = 'string'
+INT = 'int'
+# Strings with few distinct values, dictionary encoded in Parquet
+CATEGORY = 'category'
+
+class Column:
+    """A column of an export, name is its header, attribute its record
+    field and kind its type in the typed formats"""
+
+    def __init__(self, name, attribute, kind = STRING):
+        "Constructor"
+        self.name = name
+        self.attribute = attribute
+        self.kind = kind
+
+def select_columns(columns, names = None):
+    """The columns of a comma separated list of column names, in the order
+    given, all the columns if names is empty. Raises ValueError for
+    unknown names."""
+    if not names:
+        return list(columns)
+    by_name = dict((column.name, column) for column in columns)
+    selected = []
+    for name in names.split(','):
+        name = name.strip()
+        if name not in by_name:
+            raise ValueError("Unknown column " + repr(name) +
+                             ", choose from " +
+                             ",".join(column.name for column in columns))
+        selected.append(by_name[name])
+    return selected
+
+def row_getter(columns):
+    "Function returning the tuple of the column values of a record"
+    get_values = attrgetter(*[column.attribute for column in columns])
+    if len(columns) == 1:
+        return lambda record: (get_values(record),)
+    return get_values
+
+def to_int(value):
+    "Value of an integer column, None if it isn't a number"
+    if value is None or isinstance(value, (int, long)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def to_text(value):
+    "Value of a string column, None for missing values"
+    if value is None or value.__class__ is unicode:
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+def typed_value(value, kind):
+    "Value of a column of kind in the typed formats"
+    if kind == INT:
+        return to_int(value)
+    return to_text(value)
+
+encode_utf8 = methodcaller('encode', 'utf-8')
+
+def format_values(values):
+    "Text of the values of a row, utf-8 encoded, missing values are None"
+    return [value.encode('utf-8') if value.__class__ is unicode
+            else str(value) for value in values]
+
+def partial_path(path):
+    """Name an output file is written under until it is complete, unique to
+    the process so that runs writing the same file don't mix their parts"""
+    return "%s.%d%s" % (path, os.getpid(), PARTIAL_SUFFIX)
+
+class PartialFile:
+    """Output file written under its partial_path() and renamed to path by
+    close(), so an interrupted run never leaves half a file at path"""
+
+    def __init__(self, path, compress = False):
+        "Constructor, the file is gzipped if compress"
+        self.path = path
+        self.raw = open(partial_path(path), 'wb', OUTPUT_BUFFER_SIZE)
+        self.file = self.raw
+        if compress:
+            # The gzip header names the complete file
+            self.file = gzip.GzipFile(path, 'wb', fileobj = self.raw)
+
+    def write(self, data):
+        "Write to the file"
+        self.file.write(data)
+
+    def close(self):
+        "Close the file and move it to path"
+        self.file.close()
+        self.raw.close()
+        os.rename(partial_path(self.path), self.path)
+
+    def discard(self):
+        "Close and remove the file, path is left as it was"
+        self.file.close()
+        self.raw.close()
+        os.remove(partial_path(self.path))
+
+class TsvWriter:
+    """Writes records as the rows of a TSV file. Rows are batched in memory
+    and written batch_size at a time. A row without tabs, quotes or new
+    lines in its fields is joined and encoded in one go, the other rows go
+    through the csv module which quotes those fields instead of mangling
+    them."""
+
+    def __init__(self, path, columns, compress = False,
+                 batch_size = WRITE_BATCH_SIZE):
+        "Constructor"
+        self.columns = columns
+        self.get_values = row_getter(columns)
+        self.batch_size = batch_size
+        self.output = PartialFile(path, compress)
+        self.batch = cStringIO.StringIO()
+        self.writer = csv.writer(self.batch, delimiter = '\t',
+                                 lineterminator = '\n')
+        self.rows = 0
+
+    def writerow(self, values):
+        "Write a row of values, like the header"
+        try:
+            fields = map(unicode, values)
+        except UnicodeDecodeError:
+            # Byte strings that aren't ascii, written as they are
+            self.writer.writerow(format_values(values))
+        else:
+            line = u'\t'.join(fields)
+            if line and line.count(u'\t') == len(fields) - 1 and \
+               not NEEDS_QUOTING.search(line):
+                self.batch.write(line.encode('utf-8'))
+                self.batch.write('\n')
+            else:
+                self.writer.writerow(map(encode_utf8, fields))
+        self.rows += 1
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def write_header(self, names):
+        "Write the header row"
+        self.writerow(names)
+
+    def write(self, record):
+        "Write the columns of a record"
+        self.writerow(self.get_values(record))
+        metrics.EXPORTED_RECORDS.inc(("tsv",))
+
+    def flush(self):
+        "Write the batched rows"
+        self.output.write(self.batch.getvalue())
+        self.batch.seek(0)
+        self.batch.truncate()
+        self.rows = 0
+
+    def close(self):
+        "Write the batched rows and close the file"
+        self.flush()
+        self.output.close()
+
+    def discard(self):
+        "Drop the file, the run didn't complete"
+        self.output.discard()
+
+class JsonLinesWriter:
+    """Writes records as JSON objects, one per line, with the columns in
+    order and typed values. Lines are written batch_size at a time."""
+
+    def __init__(self, path, columns, compress = False,
+                 batch_size = WRITE_BATCH_SIZE):
+        "Constructor"
+        self.names = [column.name for column in columns]
+        self.kinds = [column.kind for column in columns]
+        self.get_values = row_getter(columns)
+        self.batch_size = batch_size
+        self.output = PartialFile(path, compress)
+        self.lines = []
+
+    def write_header(self, names):
+        "The keys of the objects are the column names, there's no header"
+
+    def write(self, record):
+        "Write the columns of a record"
+        values = [typed_value(value, kind) for value, kind in
+                  zip(self.get_values(record), self.kinds)]
+        self.lines.append(json.dumps(OrderedDict(zip(self.names, values))))
+        metrics.EXPORTED_RECORDS.inc(("jsonl",))
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        "Write the batched lines"
+        if self.lines:
+            self.output.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+
+    def close(self):
+        "Write the batched lines and close the file"
+        self.flush()
+        self.output.close()
+
+    def discard(self):
+        "Drop the file, the run didn't complete"
+        self.output.discard()
+
+def import_pyarrow():
+    "Import pyarrow, needed by the Parquet and Feather exports"
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The parquet and feather formats need pyarrow, "
+                          "install it with: pip install pyarrow")
+    return pyarrow
+
+class ArrowWriter:
+    """Writes records to a Parquet file, or a Feather file, with typed
+    columns and the category columns dictionary encoded. The records are
+    converted to columns every batch_size records. In Parquet each batch is
+    written as a row group, so the whole table is never in memory. Feather
+    stores each column in one piece, so the converted batches are kept
+    until the file is closed."""
+
+    def __init__(self, path, columns, file_format, compress = False,
+                 batch_size = ROW_GROUP_SIZE):
+        "Constructor"
+        pa = import_pyarrow()
+        self.pa = pa
+        self.columns = columns
+        self.get_values = row_getter(columns)
+        self.batch_size = batch_size
+        self.file_format = file_format
+        self.parquet = file_format == 'parquet'
+        self.rows = []
+        self.path = path
+        # pyarrow takes python2 byte strings for buffers, not paths
+        self.sink = pa.OSFile(partial_path(path), 'wb')
+        if self.parquet:
+            self.schema = pa.schema([pa.field(column.name,
+                                              self.arrow_type(column.kind))
+                                     for column in columns])
+            self.writer = pa.parquet.ParquetWriter(self.sink, self.schema,
+                compression = 'gzip' if compress else 'snappy')
+        else:
+            # The string chunks of each column, a Feather file can't hold
+            # several dictionaries per column so they're encoded on close
+            self.chunks = [[] for column in columns]
+
+    def arrow_type(self, kind):
+        "Arrow type of a column kind"
+        if kind == INT:
+            return self.pa.int64()
+        if kind == CATEGORY:
+            return self.pa.dictionary(self.pa.int32(), self.pa.string())
+        return self.pa.string()
+
+    def arrow_array(self, kind, values):
+        "Arrow array of the values of a column, not dictionary encoded"
+        if kind == INT:
+            return self.pa.array([to_int(value) for value in values],
+                                 type = self.pa.int64())
+        return self.pa.array([to_text(value) for value in values],
+                             type = self.pa.string())
+
+    def write_header(self, names):
+        "The schema holds the column names, there's no header"
+
+    def write(self, record):
+        "Write the columns of a record"
+        self.rows.append(self.get_values(record))
+        metrics.EXPORTED_RECORDS.inc((self.file_format,))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        "Write the batched records as a row group, or convert them to chunks"
+        if not self.rows:
+            return
+        arrays = [self.arrow_array(column.kind, values) for column, values
+                  in zip(self.columns, zip(*self.rows))]
+        self.rows = []
+        if not self.parquet:
+            for chunks, array in zip(self.chunks, arrays):
+                chunks.append(array)
+            return
+        arrays = [array.dictionary_encode() if column.kind == CATEGORY
+                  else array for column, array in zip(self.columns, arrays)]
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema = self.schema)
+        self.writer.write_table(self.pa.Table.from_batches([batch]))
+
+    def write_feather(self):
+        "Write the chunks of the columns to the Feather file"
+        # pyarrow.feather.write_feather needs pandas, its writer doesn't
+        writer = self.pa.lib.FeatherWriter()
+        writer.open(self.sink)
+        for column, chunks in zip(self.columns, self.chunks):
+            if chunks:
+                array = self.pa.concat_arrays(chunks)
+            else:
+                array = self.arrow_array(column.kind, [])
+            if column.kind == CATEGORY:
+                array = array.dictionary_encode()
+            writer.write_array(column.name, array)
+        writer.close()
+
+    def close(self):
+        "Write the batched records and close the file"
+        self.flush()
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.write_feather()
+        self.sink.close()
+        os.rename(partial_path(self.path), self.path)
+
+    def discard(self):
+        "Drop the file, the run didn't complete"
+        if self.parquet:
+            self.writer.close()
+        self.sink.close()
+        os.remove(partial_path(self.path))
+
+def open_writer(file_format, path, columns, compress = False,
+                row_group_size = ROW_GROUP_SIZE):
+    "Writer of the records of an export in one of the FORMATS"
+    if file_format in ('parquet', 'feather'):
+        return ArrowWriter(path, columns, file_format, compress,
+                           row_group_size)
+    if file_format == 'jsonl':
+        return JsonLinesWriter(path, columns, compress)
+    return TsvWriter(path, columns, compress)
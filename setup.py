@@ -7,6 +7,9 @@ setup(name='civic_api_client',
           'requests',
           'flask',
       ],
+      extras_require = {
+          'arrow': ['pyarrow'],
+      },
       entry_points = {
           'console_scripts': ['civic-api-client=civic_api_client.command_line:main'],
       },